@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+@file: bench_http_pool.py
+@desc: 对比"每次请求新建连接"（dashscope SDK 与原 pdf_parser 的用法）与共享连接池的耗时。
+       默认在本地启动一个HTTP/1.1服务器，每个新连接先等待 --handshake-ms 毫秒，
+       模拟到远端的 TCP+TLS 握手开销；请求组合模拟一次完整的入库流程：
+       Embedding批次、PDF上传、结果轮询与ZIP下载。也可以用 --url 对真实的HTTPS地址测量。
+
+用法:
+    python benchmarks/bench_http_pool.py --handshake-ms 60 --workers 4
+    python benchmarks/bench_http_pool.py --url https://dashscope.aliyuncs.com --requests 50
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.http_transport import PooledSession
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持keep-alive
+    disable_nagle_algorithm = True  # 避免小响应被延迟确认拖慢，干扰测量
+    handshake_seconds = 0.0
+    payload = b""
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        # 每个新连接只执行一次，用于模拟握手开销
+        with _Handler.lock:
+            _Handler.connections += 1
+        time.sleep(self.handshake_seconds)
+        super().setup()
+
+    def _respond(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond(self.payload if self.path.startswith("/download") else b'{"code": 0}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond(b'{"output": {}}')
+
+    do_PUT = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+def ingestion_workload(base_url: str, args) -> list[tuple]:
+    """一次入库流程中的请求序列：(方法, URL, 请求体)。"""
+    upload_body = b"\0" * (args.file_kb * 1024)
+    embedding_body = b'{"input": {"texts": ["' + b"x" * 2000 + b'"]}}'
+    return (
+        [("POST", f"{base_url}/embeddings", embedding_body)] * args.embedding_batches
+        + [("PUT", f"{base_url}/upload", upload_body)] * args.uploads
+        + [("GET", f"{base_url}/poll", None)] * args.polls
+        + [("GET", f"{base_url}/download", None)] * args.uploads
+    )
+
+
+def run(workload: list[tuple], request_func, workers: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for response in executor.map(lambda item: request_func(item[0], item[1], data=item[2]), workload):
+            response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每次新建连接 vs 共享连接池 的请求耗时对比")
+    parser.add_argument("--handshake-ms", type=float, default=60, help="本地服务器模拟的每个新连接的握手耗时")
+    parser.add_argument("--workers", type=int, default=4, help="并发请求数")
+    parser.add_argument("--embedding-batches", type=int, default=200)
+    parser.add_argument("--uploads", type=int, default=20, help="上传与下载的文件数")
+    parser.add_argument("--polls", type=int, default=40)
+    parser.add_argument("--file-kb", type=int, default=512, help="每个上传/下载文件的大小 (KB)")
+    parser.add_argument("--url", default=None, help="改为对该HTTPS地址发送GET请求，测量真实的握手开销")
+    parser.add_argument("--requests", type=int, default=50, help="使用 --url 时的请求数")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        workload = [("GET", args.url, None)] * args.requests
+        print(f"目标: {args.url}, 请求数: {len(workload)}, 并发: {args.workers}")
+    else:
+        _Handler.handshake_seconds = args.handshake_ms / 1000
+        _Handler.payload = b"\0" * (args.file_kb * 1024)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        workload = ingestion_workload(f"http://127.0.0.1:{server.server_port}", args)
+        print(f"模拟握手: {args.handshake_ms:.0f}ms/连接, 请求数: {len(workload)} "
+              f"(Embedding {args.embedding_batches}, 上传 {args.uploads}, 轮询 {args.polls}, 下载 {args.uploads}), 并发: {args.workers}")
+
+    rows = []
+    for name, make_request in (
+        ("每次新建连接", lambda: requests.request),
+        ("共享连接池", lambda: PooledSession(pool_maxsize=args.workers).request),
+    ):
+        _Handler.connections = 0
+        elapsed = run(workload, make_request(), args.workers)
+        rows.append((name, elapsed, _Handler.connections))
+
+    print(f"{'方式':<10} | {'总耗时(s)':>9} | {'平均(ms/请求)':>12} | {'新建连接数':>8}")
+    for name, elapsed, connections in rows:
+        connection_text = str(connections) if server else "-"
+        print(f"{name:<10} | {elapsed:>9.2f} | {elapsed / len(workload) * 1000:>12.1f} | {connection_text:>8}")
+    print(f"连接池节省: {rows[0][1] - rows[1][1]:.2f}s ({(1 - rows[1][1] / rows[0][1]) * 100:.0f}%)")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@file: bench_ingestion.py
+@desc: 对比全量构建向量库的两种方式：先将全部文档与文档块读入列表再一次性交给 Chroma.from_documents，
+       与流式流水线 (KnowledgeBaseManager.build_db)。报告总耗时与Python堆内存峰值 (tracemalloc)。
+       使用模拟研报与带固定延迟的模拟Embedding，不调用任何API。
+
+用法:
+    python benchmarks/bench_ingestion.py --reports 200 --elements 400 --embedding-latency 0.05
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.embeddings.base import Embeddings
+from langchain_community.vectorstores import Chroma
+from core.knowledge_base_manager import KnowledgeBaseManager
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_WORKERS
+
+DIM = 64
+
+
+class MockEmbeddings(Embeddings):
+    """
+    模拟Embedding：与真实调度器一样按 EMBEDDING_BATCH_SIZE 分批、EMBEDDING_MAX_WORKERS 路并发请求，
+    每个API批次耗时 latency 秒；按文本长度生成确定性的向量。
+    """
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def embed_documents(self, texts):
+        api_batches = math.ceil(len(texts) / EMBEDDING_BATCH_SIZE)
+        time.sleep(self.latency * math.ceil(api_batches / EMBEDDING_MAX_WORKERS))
+        return [[(len(text) % (i + 7)) / 10.0 for i in range(DIM)] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def write_reports(processed_dir: str, num_reports: int, num_elements: int):
+    for r in range(num_reports):
+        records = [
+            {"type": "text", "text": f"研报{r} 第{i // 20}页 段落{i} " + "营收同比增长，毛利率环比改善。" * 12, "page_idx": i // 20}
+            for i in range(num_elements)
+        ]
+        with open(os.path.join(processed_dir, f"report_{r}.json"), 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+
+
+def make_manager(processed_dir: str, persist_directory: str, embeddings: Embeddings) -> KnowledgeBaseManager:
+    manager = KnowledgeBaseManager.__new__(KnowledgeBaseManager)
+    manager.processed_dir = processed_dir
+    manager.persist_directory = persist_directory
+    manager.embedding_function = embeddings
+    manager.db = None
+    return manager
+
+
+def build_with_lists(manager: KnowledgeBaseManager):
+    """原先的构建方式：全部文档 -> 全部文档块 -> Chroma.from_documents。"""
+    docs = [chunk for file_path in manager._list_source_files() for chunk in manager.chunk_file_documents(file_path)]
+    ids, _ = manager._assign_chunk_ids(docs)
+    return Chroma.from_documents(documents=docs, embedding=manager.embedding_function, ids=ids,
+                                 persist_directory=manager.persist_directory)
+
+
+def measure(build) -> tuple[float, float]:
+    """返回 (耗时秒数, Python堆内存峰值MB)。"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列表式构建与流式流水线构建的耗时及内存对比")
+    parser.add_argument("--reports", type=int, default=200, help="模拟研报数量")
+    parser.add_argument("--elements", type=int, default=400, help="每份研报的元素数量")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="每个Embedding API批次的模拟延迟（秒）")
+    args = parser.parse_args()
+
+    embeddings = MockEmbeddings(args.embedding_latency)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        processed_dir = os.path.join(tmp_dir, "processed")
+        os.makedirs(processed_dir)
+        write_reports(processed_dir, args.reports, args.elements)
+
+        for name, build in (
+            ("列表 + from_documents", lambda m: build_with_lists(m)),
+            ("流式流水线", lambda m: m.build_db()),
+        ):
+            manager = make_manager(processed_dir, os.path.join(tmp_dir, name), embeddings)
+            elapsed, peak = measure(lambda: build(manager))
+            count = Chroma(persist_directory=manager.persist_directory)._collection.count()
+            rows.append((name, count, elapsed, peak))
+
+    print(f"研报: {args.reports} 份 x {args.elements} 个元素, Embedding延迟: {args.embedding_latency * 1000:.0f}ms/批次")
+    print(f"{'方式':<20} | {'文档块数':>8} | {'耗时(s)':>8} | {'内存峰值(MB)':>12}")
+    for name, count, elapsed, peak in rows:
+        print(f"{name:<20} | {count:>8} | {elapsed:>8.2f} | {peak:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
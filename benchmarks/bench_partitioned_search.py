@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+@file: bench_partitioned_search.py
+@desc: 对比NumPy索引上带过滤条件的检索方式：全库打分后再按元数据过滤，与只对匹配分区内的行打分 (filters 参数)。
+       分别测量按券商（约 1/brokers 的数据）与按单份研报过滤时的查询延迟。使用随机向量，不调用任何API。
+
+用法:
+    python benchmarks/bench_partitioned_search.py --rows 200000 --reports 400 --brokers 20
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from core.numpy_index import NumpyVectorIndex
+from core.partitions import partition_attributes, normalize_filters
+
+DIM = 1536
+
+
+def random_vectors(n: int, rng: np.random.Generator) -> np.ndarray:
+    vectors = rng.standard_normal((n, DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def search_then_filter(index: NumpyVectorIndex, query: np.ndarray, k: int, filters: dict) -> list:
+    """原先的做法：对全库打分排序，再按元数据依次过滤，直到凑满k个结果。"""
+    filters = normalize_filters(filters)
+    column = index._similarities(query[:, None])[:, 0]
+    results = []
+    for row in np.argsort(-column):
+        attributes = partition_attributes(index.metadatas[row])
+        if all(attributes.get(field) in values for field, values in filters.items()):
+            results.append((index._document(row), float(2.0 - 2.0 * column[row])))
+            if len(results) == k:
+                break
+    return results
+
+
+def measure(search, queries: np.ndarray) -> float:
+    """返回 p50 查询延迟，单位毫秒。"""
+    search(queries[0])  # 预热
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全库检索后过滤与分区检索的延迟对比")
+    parser.add_argument("--rows", type=int, default=200000, help="文档块数量")
+    parser.add_argument("--reports", type=int, default=400, help="研报数量")
+    parser.add_argument("--brokers", type=int, default=20, help="券商数量")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    ids = [f"chunk-{i}" for i in range(args.rows)]
+    texts = [f"文档块 {i}" for i in range(args.rows)]
+    # 文件名与minerU输出的命名方式一致，券商与报告期由文件名解析
+    metadatas = [
+        {"source": f"【券商{(i % args.reports) % args.brokers}】公司{i % args.reports}2025年一季度点评.json", "chunk_id": ids[i]}
+        for i in range(args.rows)
+    ]
+    queries = random_vectors(args.queries, rng)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_dir = os.path.join(tmp_dir, "numpy_index")
+        NumpyVectorIndex.build(index_dir, ids, texts, metadatas, random_vectors(args.rows, rng))
+        index = NumpyVectorIndex(index_dir)
+
+        cases = [
+            ("不过滤", None),
+            ("按券商", {"broker": "券商0"}),
+            ("按研报", {"report": "【券商0】公司02025年一季度点评"}),
+        ]
+        print(f"文档块: {args.rows}, 研报: {args.reports}, 券商: {args.brokers}, 维度: {DIM}, k={args.k}")
+        print(f"{'过滤条件':<8} | {'分区大小':>8} | {'全库+后过滤(ms)':>15} | {'分区检索(ms)':>12} | {'加速':>6}")
+        for name, filters in cases:
+            size = index.partitions.size(filters)
+            partitioned = measure(lambda q: index.similarity_search_by_vector_with_relevance_scores(q, k=args.k, filters=filters), queries)
+            if filters is None:
+                baseline = partitioned
+            else:
+                baseline = measure(lambda q: search_then_filter(index, q, args.k, filters), queries)
+                expected = search_then_filter(index, queries[0], args.k, filters)
+                actual = index.similarity_search_by_vector_with_relevance_scores(queries[0], k=args.k, filters=filters)
+                assert [d.metadata["chunk_id"] for d, _ in expected] == [d.metadata["chunk_id"] for d, _ in actual]
+            print(f"{name:<8} | {size:>8} | {baseline:>15.2f} | {partitioned:>12.2f} | {baseline / partitioned:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+@file: bench_report_loading.py
+@desc: 对比构建知识库时加载已解析研报的两种方式：JSONLoader+jq 解析JSON，与内存映射读取列式文件 (.rcol)。
+       在临时目录中生成与minerU输出结构相同的模拟研报，不调用任何API。
+
+用法:
+    python benchmarks/bench_report_loading.py --reports 200 --elements 800
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.document_loaders import JSONLoader
+from core.knowledge_base_manager import KnowledgeBaseManager
+from core.report_columns import ReportColumns, columnar_path, write_report_columns
+
+
+def fake_report(num_elements: int, rng: random.Random) -> list:
+    """生成一份minerU content_list 风格的模拟研报。"""
+    records = []
+    for i in range(num_elements):
+        page_idx = i // 20
+        if i % 40 == 0:
+            records.append({"type": "text", "text": f"第{page_idx}章 经营情况", "text_level": 1, "page_idx": page_idx})
+        elif i % 15 == 0:
+            rows = "".join(f"<tr><td>{rng.randint(1, 999)}</td><td>{rng.random():.2f}</td></tr>" for _ in range(8))
+            records.append({"type": "table", "table_body": f"<table>{rows}</table>", "table_caption": [],
+                            "img_path": f"images/{i}.jpg", "page_idx": page_idx})
+        else:
+            text = "公司2025年一季度营收同比增长，毛利率环比改善。" * rng.randint(2, 8)
+            records.append({"type": "text", "text": text, "page_idx": page_idx})
+    return records
+
+
+def convert_to_columns(json_path: str):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        write_report_columns(columnar_path(json_path), json.load(f))
+
+
+def timed(func) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON+jq 与列式文件的研报加载耗时对比")
+    parser.add_argument("--reports", type=int, default=200, help="模拟研报数量")
+    parser.add_argument("--elements", type=int, default=800, help="每份研报的元素数量")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_paths = []
+        for i in range(args.reports):
+            path = os.path.join(tmp_dir, f"report_{i}.json")
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(fake_report(args.elements, rng), f, ensure_ascii=False, indent=4)
+            json_paths.append(path)
+
+        manager = KnowledgeBaseManager.__new__(KnowledgeBaseManager)
+        manager.processed_dir = tmp_dir
+        loader_kwargs = manager._json_loader_kwargs()
+
+        json_time, json_docs = timed(lambda: [
+            doc for path in json_paths for doc in JSONLoader(path, **loader_kwargs).load()
+        ])
+        convert_time, _ = timed(lambda: [convert_to_columns(path) for path in json_paths])
+        rcol_time, rcol_docs = timed(lambda: [
+            doc for path in json_paths for doc in manager._load_columnar_documents(path)
+        ])
+
+        def read_page_idx():
+            for path in json_paths:
+                with ReportColumns(columnar_path(path)) as columns:
+                    columns.column("page_idx")
+        page_idx_time, _ = timed(read_page_idx)
+
+        json_size = sum(os.path.getsize(path) for path in json_paths)
+        rcol_size = sum(os.path.getsize(columnar_path(path)) for path in json_paths)
+        assert [(d.page_content, d.metadata) for d in json_docs] == [(d.page_content, d.metadata) for d in rcol_docs]
+
+    print(f"研报: {args.reports} 份 x {args.elements} 个元素, 共 {len(json_docs)} 个文档")
+    print(f"{'方式':<22} | {'耗时(s)':>8} | {'磁盘占用(MB)':>12}")
+    print(f"{'JSONLoader + jq':<22} | {json_time:>8.2f} | {json_size / 2 ** 20:>12.1f}")
+    print(f"{'列式文件 (text列)':<22} | {rcol_time:>8.2f} | {rcol_size / 2 ** 20:>12.1f}")
+    print(f"{'列式文件 (仅page_idx)':<22} | {page_idx_time:>8.2f} | {'-':>12}")
+    print(f"{'JSON -> 列式 一次性转换':<22} | {convert_time:>8.2f} | {'-':>12}")
+    print(f"加载加速: {json_time / rcol_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
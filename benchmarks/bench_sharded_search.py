@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+@file: bench_sharded_search.py
+@desc: 测量分片数量对NumPy索引检索吞吐量的影响。将同一批随机向量按行号哈希划分为 N 个分片，
+       通过 ShardedSearchBackend 并行查询并归并 top-k，分别统计单个客户端的查询延迟与多个客户端并发时的吞吐量。
+       结果会与不分片的索引逐一核对。不调用任何API。
+
+用法:
+    python benchmarks/bench_sharded_search.py --rows 400000 --shards 1 2 4 8 --clients 8
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from core.numpy_index import NumpyVectorIndex
+from core.sharded_store import ShardedSearchBackend
+
+DIM = 1536
+
+
+def random_vectors(n: int, rng: np.random.Generator) -> np.ndarray:
+    vectors = rng.standard_normal((n, DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def build_shards(tmp_dir: str, num_shards: int, ids: list, texts: list, metadatas: list, vectors: np.ndarray) -> list:
+    """按行号取模划分分片（随机数据上与按文件哈希划分等价），每个分片单独建索引。"""
+    shards = []
+    for shard in range(num_shards):
+        rows = np.arange(shard, len(ids), num_shards)
+        index_dir = os.path.join(tmp_dir, f"{num_shards}_{shard:02d}")
+        NumpyVectorIndex.build(index_dir, [ids[i] for i in rows], [texts[i] for i in rows],
+                               [metadatas[i] for i in rows], vectors[rows])
+        shards.append(NumpyVectorIndex(index_dir))
+    return shards
+
+
+def measure(backend, queries: np.ndarray, k: int, clients: int) -> tuple[float, float]:
+    """返回 (单客户端 p50 延迟ms, 多客户端并发吞吐量 queries/s)。"""
+    def search(query):
+        return backend.similarity_search_by_vector_with_relevance_scores(query, k=k)
+
+    search(queries[0])  # 预热
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        start = time.perf_counter()
+        list(pool.map(search, np.concatenate([queries] * clients)))
+        elapsed = time.perf_counter() - start
+    return float(np.percentile(latencies, 50)), len(queries) * clients / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片数量与检索吞吐量")
+    parser.add_argument("--rows", type=int, default=400000, help="文档块数量")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="要测试的分片数量")
+    parser.add_argument("--clients", type=int, default=8, help="并发客户端数量")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    ids = [f"chunk-{i}" for i in range(args.rows)]
+    texts = [f"文档块 {i}" for i in range(args.rows)]
+    metadatas = [{"source": f"研报{i % 1000}.json", "chunk_id": ids[i]} for i in range(args.rows)]
+    vectors = random_vectors(args.rows, rng)
+    queries = random_vectors(args.queries, rng)
+
+    print(f"文档块: {args.rows}, 维度: {DIM}, k={args.k}, 并发客户端: {args.clients}, CPU: {os.cpu_count()}")
+    print(f"{'分片数':>6} | {'p50延迟(ms)':>11} | {'吞吐量(q/s)':>11} | {'相对1分片':>9}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        expected, baseline = None, None
+        for num_shards in args.shards:
+            shards = build_shards(tmp_dir, num_shards, ids, texts, metadatas, vectors)
+            # 与 ShardedKnowledgeBase 一致：每个并发客户端在每个分片上各有一个线程
+            with ThreadPoolExecutor(max_workers=num_shards * args.clients) as executor:
+                backend = ShardedSearchBackend(shards, executor)
+                # 分片检索后归并的结果必须与不分片时一致
+                actual = [d.metadata["chunk_id"] for d, _ in
+                          backend.similarity_search_by_vector_with_relevance_scores(queries[0], k=args.k)]
+                expected = expected or actual
+                assert actual == expected, f"{num_shards} 个分片的检索结果与预期不一致"
+
+                latency, throughput = measure(backend, queries, args.k, args.clients)
+            baseline = baseline or throughput
+            print(f"{num_shards:>6} | {latency:>11.2f} | {throughput:>11.1f} | {throughput / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
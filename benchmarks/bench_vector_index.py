@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+@file: bench_vector_index.py
+@desc: 对比 LangChain→Chroma 检索路径与进程内NumPy索引的单次查询延迟。
+       使用随机生成的归一化向量（维度与 text-embedding-v2 一致），不调用任何API。
+
+用法:
+    python benchmarks/bench_vector_index.py --sizes 10000 100000 1000000
+    python benchmarks/bench_vector_index.py --sizes 1000000 --skip-chroma-above 100000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+from core.numpy_index import NumpyVectorIndex
+
+DIM = 1536
+CHROMA_INSERT_BATCH = 5000
+
+
+def random_vectors(n: int, rng: np.random.Generator) -> np.ndarray:
+    vectors = rng.standard_normal((n, DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def measure(search, queries: np.ndarray, k: int) -> tuple[float, float]:
+    """返回 (p50, p95) 查询延迟，单位毫秒。"""
+    search(queries[0], k)  # 预热
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+def bench_size(n: int, queries: np.ndarray, k: int, dtype: str, run_chroma: bool, rng: np.random.Generator):
+    vectors = random_vectors(n, rng)
+    ids = [f"chunk-{i}" for i in range(n)]
+    texts = [f"文档块 {i}" for i in range(n)]
+    metadatas = [{"source": f"report_{i % 50}.json", "chunk_id": ids[i]} for i in range(n)]
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        NumpyVectorIndex.build(os.path.join(tmp_dir, "numpy_index"), ids, texts, metadatas, vectors, dtype=dtype)
+        index = NumpyVectorIndex(os.path.join(tmp_dir, "numpy_index"))
+        build_time = time.perf_counter() - start
+        p50, p95 = measure(lambda q, k: index.similarity_search_by_vector_with_relevance_scores(q.tolist(), k=k), queries, k)
+        rows.append((n, f"numpy ({dtype})", build_time, p50, p95))
+
+        if run_chroma:
+            db = Chroma(collection_name="bench", persist_directory=os.path.join(tmp_dir, "chroma"))
+            start = time.perf_counter()
+            for i in range(0, n, CHROMA_INSERT_BATCH):
+                db._collection.add(
+                    ids=ids[i:i + CHROMA_INSERT_BATCH],
+                    embeddings=vectors[i:i + CHROMA_INSERT_BATCH].tolist(),
+                    documents=texts[i:i + CHROMA_INSERT_BATCH],
+                    metadatas=metadatas[i:i + CHROMA_INSERT_BATCH],
+                )
+            build_time = time.perf_counter() - start
+            p50, p95 = measure(lambda q, k: db.similarity_search_by_vector_with_relevance_scores(q.tolist(), k=k), queries, k)
+            rows.append((n, "langchain+chroma", build_time, p50, p95))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma 与 NumPy 索引的检索延迟对比")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--skip-chroma-above", type=int, default=None,
+                        help="文档块数量超过该值时跳过Chroma（百万级写入Chroma耗时很长）")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    queries = random_vectors(args.queries, rng)
+
+    print(f"{'文档块数':>10} | {'后端':<18} | {'构建耗时(s)':>11} | {'p50(ms)':>9} | {'p95(ms)':>9}")
+    for n in args.sizes:
+        run_chroma = args.skip_chroma_above is None or n <= args.skip_chroma_above
+        for size, backend, build_time, p50, p95 in bench_size(n, queries, args.k, args.dtype, run_chroma, rng):
+            print(f"{size:>10} | {backend:<18} | {build_time:>11.2f} | {p50:>9.2f} | {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+@file: load_test_async.py
+@desc: 异步问答流程的压测脚本。使用本地模拟的LLM与向量库（以固定延迟模拟网络往返），
+       验证 QAService.aask 的吞吐量随并发数增长，而不会被事件循环串行化。
+
+用法:
+    python benchmarks/load_test_async.py --requests 64 --concurrency 1 4 16 32
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+from core.llm_service import QwenLLM
+from core.qa_service import QAService
+from core.partitions import PartitionIndex
+
+
+class MockQwenLLM(QwenLLM):
+    """
+    模拟的通义千问服务：不发起任何网络请求，只按配置的延迟阻塞当前线程，
+    以此模拟 dashscope SDK 的同步调用。
+    """
+    def __init__(self, rerank_latency: float, generation_latency: float, max_concurrency: int):
+        super().__init__(api_key="mock-api-key", max_concurrency=max_concurrency)
+        self.rerank_latency = rerank_latency
+        self.generation_latency = generation_latency
+
+    def get_rerank_results(self, query: str, documents: list[str], top_n: int = 3) -> list[tuple[int, float]]:
+        time.sleep(self.rerank_latency)
+        return [(i, 1.0 / (i + 1)) for i in range(min(top_n, len(documents)))]
+
+    def get_chat_completion(self, prompt: str, system_prompt: str = "You are a helpful assistant."):
+        time.sleep(self.generation_latency)
+        return json.dumps({
+            "reasoning_steps": ["模拟推理步骤"],
+            "reasoning_summary": "模拟推理摘要",
+            "relevant_context": "> 模拟上下文",
+            "final_answer": "模拟答案"
+        }, ensure_ascii=False)
+
+
+class MockEmbeddings:
+    """模拟的查询Embedding，阻塞固定时长后返回一个固定向量。"""
+    def __init__(self, embedding_latency: float):
+        self.embedding_latency = embedding_latency
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.embedding_latency)
+        return [1.0, 0.0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.embedding_latency)
+        return [[1.0, 0.0] for _ in texts]
+
+
+class MockVectorStore:
+    """模拟的向量库，检索时阻塞固定时长。"""
+    def __init__(self, search_latency: float):
+        self.search_latency = search_latency
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4):
+        time.sleep(self.search_latency)
+        return [
+            (Document(page_content=f"模拟文档 {i}", metadata={"source": f"mock_{i}.json", "chunk_id": f"mock-{i}"}), float(i))
+            for i in range(k)
+        ]
+
+
+class MockKnowledgeBaseManager:
+    """只提供 QAService 需要的接口。"""
+    def __init__(self, embedding_latency: float, search_latency: float):
+        self.embedding_function = MockEmbeddings(embedding_latency)
+        self.db = MockVectorStore(search_latency)
+        self.build_stamp_path = None
+
+    def load_search_backend(self):
+        return self.db
+
+    def load_lexical_index(self):
+        return None
+
+    def load_partition_index(self):
+        return PartitionIndex.from_metadatas([])
+
+
+async def run_level(qa_service: QAService, num_requests: int, concurrency: int) -> float:
+    """以给定的并发数发送 num_requests 个问题，返回吞吐量 (请求/秒)。"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            return await qa_service.aask(f"压测问题 {i}", top_k=10, rerank_top_n=5)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(num_requests)))
+    elapsed = time.perf_counter() - start
+    assert all(r["final_answer"] == "模拟答案" for r in results)
+    return num_requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QAService.aask 并发压测 (模拟LLM)")
+    parser.add_argument("--requests", type=int, default=64, help="每个并发级别发送的问题数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--embedding-latency", type=float, default=0.03)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--rerank-latency", type=float, default=0.1)
+    parser.add_argument("--generation-latency", type=float, default=0.5)
+    parser.add_argument("--max-concurrency", type=int, default=64, help="QwenLLM 的并发上限")
+    args = parser.parse_args()
+
+    llm = MockQwenLLM(args.rerank_latency, args.generation_latency, args.max_concurrency)
+    qa_service = QAService(llm=llm, kb_manager=MockKnowledgeBaseManager(args.embedding_latency, args.search_latency))
+    # 压测的是完整流程的并发能力，关闭问答缓存以免重复问题直接命中
+    qa_service.answer_cache = None
+
+    # 压测期间屏蔽流程中的逐步日志，只保留结果表格
+    rows = []
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            for level in args.concurrency:
+                rows.append((level, asyncio.run(run_level(qa_service, args.requests, level))))
+        finally:
+            sys.stdout = stdout
+    llm.close()
+
+    single_latency = args.embedding_latency + args.search_latency + args.rerank_latency + args.generation_latency
+    print(f"单请求模拟延迟: {single_latency:.2f}s, 每级请求数: {args.requests}, LLM并发上限: {args.max_concurrency}")
+    print(f"{'并发数':>6} | {'吞吐量 (req/s)':>14} | {'相对并发=1':>10}")
+    baseline = rows[0][1]
+    for level, throughput in rows:
+        print(f"{level:>6} | {throughput:>14.2f} | {throughput / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+@file: answer_cache.py
+@desc: 问答结果缓存。位于 QAService.ask 之前，分为两层：
+       1. 精确匹配层：以规范化后的问题文本为键，重复提问直接命中；
+       2. 语义匹配层：比较问题Embedding与已缓存问题的余弦相似度，超过阈值即视为同一问题。
+       缓存条目按LRU淘汰并带有TTL，当向量库被重建时自动整体失效。
+"""
+import os
+import re
+import copy
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# 规范化时需要去除的标点（问题末尾的问号、句号等不影响语义）
+_PUNCTUATION_PATTERN = re.compile(r"[\s,.!?;:，。！？；：、“”‘’\"'（）()【】\[\]]+")
+
+
+class _CacheEntry:
+    """单个缓存条目。"""
+    __slots__ = ("query", "top_k", "rerank_top_n", "embedding", "answer", "created_at")
+
+    def __init__(self, query: str, top_k: int, rerank_top_n: int, embedding, answer: dict):
+        self.query = query
+        self.top_k = top_k
+        self.rerank_top_n = rerank_top_n
+        self.embedding = embedding
+        self.answer = answer
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95, version_file: str = None):
+        """
+        初始化问答缓存。
+
+        :param max_entries: 最多缓存的答案数量，超出后按LRU淘汰。
+        :param ttl_seconds: 缓存条目的有效期（秒），<=0 表示永不过期。
+        :param similarity_threshold: 语义层命中所需的最小余弦相似度，<=0 表示关闭语义层。
+        :param version_file: 向量库的构建标记文件；其修改时间变化时（即向量库被重建）清空缓存。
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_file = version_file
+
+        self._entries: OrderedDict[tuple, _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = self._read_version()
+        # 语义层使用的归一化Embedding矩阵，在条目变化后惰性重建
+        self._matrix = None
+        self._matrix_keys = []
+
+        self._stats = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        规范化问题文本：统一全角/半角、大小写，并去除空白和标点。
+        例如 "中芯国际 2024年营收？" 与 "中芯国际2024年营收" 会得到相同的结果。
+        """
+        text = unicodedata.normalize("NFKC", query).lower()
+        return _PUNCTUATION_PATTERN.sub("", text)
+
+    def get_exact(self, query: str, top_k: int, rerank_top_n: int) -> dict | None:
+        """
+        精确匹配层查询。
+
+        :return: 命中时返回缓存答案的副本，否则返回None。
+        """
+        key = (self.normalize_query(query), top_k, rerank_top_n)
+        with self._lock:
+            self._check_version()
+            self._stats["lookups"] += 1
+            entry = self._get_live_entry(key)
+            if entry is None:
+                return None
+            self._stats["exact_hits"] += 1
+            return copy.deepcopy(entry.answer)
+
+    def get_semantic(self, embedding, top_k: int, rerank_top_n: int) -> dict | None:
+        """
+        语义匹配层查询，应在精确匹配未命中后调用。
+
+        :param embedding: 问题的Embedding向量。
+        :return: 命中时返回最相似问题的缓存答案副本，否则返回None（计为一次未命中）。
+        """
+        with self._lock:
+            self._check_version()
+            matrix, keys = self._get_matrix()
+            if self.similarity_threshold > 0 and embedding is not None and keys:
+                query_vector = self._normalize(embedding)
+                similarities = matrix @ query_vector
+                # 按相似度从高到低检查，跳过参数不同或已过期的条目
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.similarity_threshold:
+                        break
+                    entry = self._get_live_entry(keys[i])
+                    if entry is not None and entry.top_k == top_k and entry.rerank_top_n == rerank_top_n:
+                        self._stats["semantic_hits"] += 1
+                        return copy.deepcopy(entry.answer)
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, query: str, embedding, top_k: int, rerank_top_n: int, answer: dict, version: int = None):
+        """
+        写入一条缓存，必要时按LRU淘汰最久未使用的条目。
+
+        :param version: 可选，生成该答案时所用向量库的版本（version_file 的修改时间）。与当前版本不同时
+                        （答案生成期间向量库被重建或同步）不写入，避免基于旧向量库的答案进入刚清空的缓存。
+        """
+        key = (self.normalize_query(query), top_k, rerank_top_n)
+        vector = self._normalize(embedding) if embedding is not None else None
+        with self._lock:
+            self._check_version()
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = _CacheEntry(query, top_k, rerank_top_n, vector, copy.deepcopy(answer))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+            self._matrix = None
+
+    def clear(self):
+        """清空所有缓存条目。"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def get_stats(self) -> dict:
+        """返回缓存的命中率等统计信息。"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["lookups"]
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        stats["exact_hit_rate"] = stats["exact_hits"] / lookups if lookups else 0.0
+        stats["semantic_hit_rate"] = stats["semantic_hits"] / lookups if lookups else 0.0
+        return stats
+
+    # --- 内部方法（调用方需持有锁） ---
+    def _get_live_entry(self, key: tuple) -> _CacheEntry | None:
+        """取出未过期的条目并将其标记为最近使用；过期条目会被直接删除。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds:
+            del self._entries[key]
+            self._matrix = None
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _get_matrix(self):
+        """构建（或复用）所有带Embedding条目的矩阵，每行已归一化。"""
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+            if self._matrix_keys:
+                self._matrix = np.stack([self._entries[key].embedding for key in self._matrix_keys])
+            else:
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+        return self._matrix, self._matrix_keys
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _read_version(self):
+        if not self.version_file:
+            return None
+        try:
+            return os.stat(self.version_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_version(self):
+        """向量库构建标记发生变化时，整体清空缓存。"""
+        version = self._read_version()
+        if version != self._version:
+            if self._entries:
+                print("检测到向量数据库已重建，问答缓存已清空。")
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._matrix = None
+            self._version = version
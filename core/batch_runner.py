@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+@file: batch_runner.py
+@desc: 并行的批量问答引擎。以可配置的并发数调用 QAService.aask，
+       每完成一个问题就追加写入JSONL检查点，重启后从检查点继续；
+       相同（规范化后）的问题只回答一次。结束时输出吞吐量与各阶段的 p50/p95/p99 延迟。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+
+import numpy as np
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.answer_cache import AnswerCache
+from core.metrics import track_request
+from config import BATCH_CONCURRENCY
+
+
+class BatchRunner:
+    def __init__(self, qa_service, checkpoint_path: str, concurrency: int = BATCH_CONCURRENCY,
+                 top_k: int = 20, rerank_top_n: int = 5):
+        """
+        :param qa_service: QAService 实例。
+        :param checkpoint_path: JSONL检查点文件路径，每行记录一个已完成的问题及其答案与耗时。
+        :param concurrency: 同时处理的问题数。
+        :param top_k: 向量检索时召回的文档数量。
+        :param rerank_top_n: Reranker模型筛选出的最相关文档数量。
+        """
+        self.qa_service = qa_service
+        self.checkpoint_path = checkpoint_path
+        self.concurrency = concurrency
+        self.top_k = top_k
+        self.rerank_top_n = rerank_top_n
+
+    def run(self, questions: list[str]) -> list[dict]:
+        """同步入口，见 arun。"""
+        return asyncio.run(self.arun(questions))
+
+    async def arun(self, questions: list[str]) -> list[dict]:
+        """
+        回答所有问题。
+
+        :param questions: 问题列表，可包含重复问题。
+        :return: 与questions一一对应的答案列表；处理失败的问题对应None，再次运行时会重试。
+        """
+        records = self._load_checkpoint()
+        # 规范化后相同的问题只处理一次，答案按原顺序回填
+        pending = {}
+        for question in questions:
+            key = AnswerCache.normalize_query(question)
+            if key not in records and key not in pending:
+                pending[key] = question
+
+        unique_count = len({AnswerCache.normalize_query(q) for q in questions})
+        print(f"共 {len(questions)} 个问题，去重后 {unique_count} 个，"
+              f"检查点中已完成 {unique_count - len(pending)} 个，本次需处理 {len(pending)} 个 (并发数: {self.concurrency})。")
+
+        completed_records = []
+        failures = 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+
+        async def answer_one(key: str, question: str):
+            nonlocal failures
+            async with semaphore:
+                try:
+                    with track_request("batch") as timings:
+                        answer = await self.qa_service.aask(question, top_k=self.top_k, rerank_top_n=self.rerank_top_n)
+                except Exception as e:
+                    failures += 1
+                    print(f"错误: 处理问题 '{question}' 时发生异常: {e}")
+                    return
+            # 兜底答案说明本次处理失败，不写入检查点，再次运行时会重试
+            if self.qa_service.is_fallback_answer(answer):
+                failures += 1
+                print(f"错误: 处理问题 '{question}' 失败: {answer['final_answer']}")
+                return
+            record = {"question": question, "answer": answer, "timings": timings.to_dict()}
+            records[key] = record
+            completed_records.append(record)
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            print(f"--- 进度: {len(completed_records) + failures}/{len(pending)} ---")
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+        await asyncio.gather(*(answer_one(key, question) for key, question in pending.items()))
+        elapsed = time.perf_counter() - start
+
+        self._print_report(completed_records, failures, elapsed)
+        return [
+            records[key]["answer"] if key in records else None
+            for key in (AnswerCache.normalize_query(q) for q in questions)
+        ]
+
+    def _load_checkpoint(self) -> dict:
+        """
+        读取检查点，返回 规范化问题 -> 记录。
+        中断时写了一半的最后一行会被丢弃并从文件中截掉，以免之后追加的记录与其拼接在同一行。
+        """
+        records = {}
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return records
+
+        valid_lines = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if line.endswith("\n"):
+                records[AnswerCache.normalize_query(record["question"])] = record
+                valid_lines.append(line)
+        if len(valid_lines) != len(lines):
+            print(f"警告: 检查点中有 {len(lines) - len(valid_lines)} 行不完整，已丢弃。")
+            with open(self.checkpoint_path, 'w', encoding='utf-8') as f:
+                f.writelines(valid_lines)
+        return records
+
+    @staticmethod
+    def _print_report(records: list[dict], failures: int, elapsed: float):
+        """打印本次运行的吞吐量与各阶段延迟分位数。"""
+        print("\n--- 批量问答统计 ---")
+        print(f"完成 {len(records)} 个，失败 {failures} 个，耗时 {elapsed:.1f} 秒，"
+              f"吞吐量 {len(records) / elapsed if elapsed > 0 else 0.0:.2f} 个/秒。")
+        if not records:
+            return
+
+        stage_latencies = {}
+        for record in records:
+            for stage, ms in record["timings"]["stages_ms"].items():
+                stage_latencies.setdefault(stage, []).append(ms)
+        print(f"{'阶段':<16} | {'次数':>6} | {'p50(ms)':>9} | {'p95(ms)':>9} | {'p99(ms)':>9}")
+        for stage, latencies in stage_latencies.items():
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print(f"{stage:<16} | {len(latencies):>6} | {p50:>9.1f} | {p95:>9.1f} | {p99:>9.1f}")
+
+        cache_hits = sum(1 for record in records if record["timings"]["cache"] in ("exact", "semantic"))
+        input_tokens = sum(record["timings"]["input_tokens"] for record in records)
+        output_tokens = sum(record["timings"]["output_tokens"] for record in records)
+        context_tokens_saved = sum(record["timings"].get("context_tokens_saved", 0) for record in records)
+        print(f"缓存命中 {cache_hits} 次，输入Token {input_tokens}，输出Token {output_tokens}，"
+              f"上下文打包节省Token约 {context_tokens_saved}。")
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@file: context_packer.py
+@desc: 生成答案前的上下文打包。多家券商对同一公司的研报常常逐字重复相同的数据，
+       重排后的文档块直接拼接会让大模型为冗余内容付出输入Token与延迟。
+       本模块按得分排序文档块，用SimHash剔除近似重复的文档块，并在Token预算内装入尽可能多的内容。
+"""
+import re
+import os
+import sys
+import hashlib
+from dataclasses import dataclass
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.near_duplicates import normalize_text
+
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+# 拼接上下文时使用的分隔符
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的Token数：每个汉字约1个Token，其余字符约4个字符1个Token。"""
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    return cjk_chars + (len(text) - cjk_chars + 3) // 4
+
+
+def simhash(text: str, shingle_size: int = 3, bits: int = 64) -> int:
+    """
+    计算文本的SimHash指纹。以去除空白和标点后的字符 n-gram 为特征，
+    内容几乎相同的文本指纹之间的汉明距离很小。
+    """
+    normalized = normalize_text(text)
+    if len(normalized) <= shingle_size:
+        shingles = [normalized]
+    else:
+        shingles = [normalized[i:i + shingle_size] for i in range(len(normalized) - shingle_size + 1)]
+
+    weights = [0] * bits
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class PackStats:
+    """一次上下文打包的统计信息，Token数均为估算值。"""
+    input_docs: int = 0
+    packed_docs: int = 0
+    duplicates_removed: int = 0
+    over_budget: int = 0
+    input_tokens: int = 0
+    packed_tokens: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.input_tokens - self.packed_tokens
+
+
+class ContextPacker:
+    def __init__(self, token_budget: int, max_hamming_distance: int = 3):
+        """
+        :param token_budget: 上下文（含分隔符）的Token预算，<=0 表示不限制。
+        :param max_hamming_distance: SimHash指纹的汉明距离不超过该值的两个文档块视为近似重复，<0 表示不去重。
+        """
+        self.token_budget = token_budget
+        self.max_hamming_distance = max_hamming_distance
+
+    @staticmethod
+    def _sort_key(doc: dict):
+        # 优先按Rerank相关性得分降序；没有Rerank得分的文档块排在其后并保持原有的检索顺序
+        rerank_score = doc["metadata"].get("rerank_score")
+        return (0, -rerank_score) if rerank_score is not None else (1, 0)
+
+    def pack(self, documents: list[dict]) -> tuple[list[dict], PackStats]:
+        """
+        对上下文文档（{"page_content", "metadata"} 字典）排序、去重并按预算截取。
+        得分较高的文档块优先保留；某个文档块超出剩余预算时跳过它，继续尝试后面较短的文档块。
+        得分最高的文档块总会保留，即使它本身已超出预算。
+
+        :return: (保留的文档列表, 统计信息)
+        """
+        separator_tokens = estimate_tokens(CONTEXT_SEPARATOR)
+        stats = PackStats(input_docs=len(documents))
+        stats.input_tokens = sum(estimate_tokens(doc["page_content"]) for doc in documents) \
+            + separator_tokens * max(len(documents) - 1, 0)
+
+        packed, fingerprints, used_tokens = [], [], 0
+        for doc in sorted(documents, key=self._sort_key):
+            if self.max_hamming_distance >= 0:
+                fingerprint = simhash(doc["page_content"])
+                if any(hamming_distance(fingerprint, kept) <= self.max_hamming_distance for kept in fingerprints):
+                    stats.duplicates_removed += 1
+                    continue
+
+            cost = estimate_tokens(doc["page_content"]) + (separator_tokens if packed else 0)
+            if self.token_budget > 0 and packed and used_tokens + cost > self.token_budget:
+                stats.over_budget += 1
+                continue
+
+            packed.append(doc)
+            used_tokens += cost
+            if self.max_hamming_distance >= 0:
+                fingerprints.append(fingerprint)
+
+        stats.packed_docs = len(packed)
+        stats.packed_tokens = used_tokens
+        return packed, stats
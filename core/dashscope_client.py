@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+@file: dashscope_client.py
+@desc: 基于共享连接池的DashScope REST客户端。
+       dashscope SDK 的每次调用都会新建HTTP会话，连接无法复用。本客户端直接调用相同的REST接口，
+       并提供与SDK相同的调用方式（TextEmbedding.call / TextReRank.call / Generation.call）
+       与响应结构（status_code、code、message、output、usage），QwenLLM 可在两者之间无缝切换。
+"""
+import os
+import sys
+import json
+from http import HTTPStatus
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.http_transport import get_session, iter_stream_lines
+from config import DASHSCOPE_BASE_URL
+
+EMBEDDING_PATH = "/services/embeddings/text-embedding/text-embedding"
+RERANK_PATH = "/services/rerank/text-rerank/text-rerank"
+GENERATION_PATH = "/services/aigc/text-generation/generation"
+
+
+class _AttrDict(dict):
+    """既支持 ['key'] 也支持 .key 访问的字典，与SDK响应对象的用法保持一致。"""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return _AttrDict({key: _wrap(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+    return value
+
+
+class DashScopeResponse:
+    """REST接口的响应，字段与SDK的响应对象相同。"""
+    def __init__(self, status_code: int, body: dict):
+        self.status_code = status_code
+        self.request_id = body.get("request_id", "")
+        self.code = body.get("code", "")
+        self.message = body.get("message", "")
+        self.output = _wrap(body.get("output") or {})
+        self.usage = _wrap(body.get("usage") or {})
+
+    def __repr__(self):
+        return f"DashScopeResponse(status_code={self.status_code}, code={self.code!r}, message={self.message!r})"
+
+
+class _Endpoint:
+    def __init__(self, client: "DashScopeRESTClient", path: str, build_input):
+        self._client = client
+        self._path = path
+        self._build_input = build_input
+
+    def call(self, model: str, stream: bool = False, **kwargs):
+        model_input, parameters = self._build_input(**kwargs)
+        payload = {"model": model, "input": model_input, "parameters": parameters}
+        if stream:
+            return self._client.post_stream(self._path, payload)
+        return self._client.post(self._path, payload)
+
+
+def _embedding_input(input, **parameters):
+    texts = [input] if isinstance(input, str) else list(input)
+    return {"texts": texts}, parameters
+
+
+def _rerank_input(query, documents, top_n=None, **parameters):
+    if top_n is not None:
+        parameters["top_n"] = top_n
+    parameters.setdefault("return_documents", False)
+    return {"query": query, "documents": documents}, parameters
+
+
+def _generation_input(messages, **parameters):
+    return {"messages": messages}, parameters
+
+
+class DashScopeRESTClient:
+    def __init__(self, api_key: str, base_url: str = DASHSCOPE_BASE_URL, session=None):
+        """
+        :param api_key: DashScope API Key。
+        :param base_url: REST接口的根地址。
+        :param session: 可选，自定义的HTTP会话；默认使用进程内共享的 "dashscope" 连接池。
+        """
+        self.base_url = base_url.rstrip("/")
+        self.session = session or get_session("dashscope")
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        self.TextEmbedding = _Endpoint(self, EMBEDDING_PATH, _embedding_input)
+        self.TextReRank = _Endpoint(self, RERANK_PATH, _rerank_input)
+        self.Generation = _Endpoint(self, GENERATION_PATH, _generation_input)
+
+    def post(self, path: str, payload: dict) -> DashScopeResponse:
+        response = self.session.post(self.base_url + path, headers=self.headers, json=payload)
+        return DashScopeResponse(response.status_code, self._json_body(response.text))
+
+    def post_stream(self, path: str, payload: dict):
+        """
+        以SSE方式调用接口，逐个产出 DashScopeResponse。
+        DashScope的SSE事件中，data 行为JSON，HTTP_STATUS 注释行给出该事件的状态码。
+        """
+        headers = {**self.headers, "Accept": "text/event-stream", "X-DashScope-SSE": "enable"}
+        lines = iter_stream_lines(self.session, "POST", self.base_url + path, headers=headers, json=payload)
+        response = next(lines)
+        if response.status_code != HTTPStatus.OK:
+            body = "".join(line for line in lines)
+            yield DashScopeResponse(response.status_code, self._json_body(body))
+            return
+
+        status_code = HTTPStatus.OK
+        for line in lines:
+            if line.startswith(":HTTP_STATUS/"):
+                status_code = int(line.split("/", 1)[1])
+            elif line.startswith("data:"):
+                yield DashScopeResponse(status_code, self._json_body(line[len("data:"):]))
+
+    @staticmethod
+    def _json_body(text: str) -> dict:
+        try:
+            body = json.loads(text)
+        except (json.JSONDecodeError, TypeError):
+            return {"code": "InvalidResponse", "message": (text or "")[:200]}
+        return body if isinstance(body, dict) else {}
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+@file: embedding_cache.py
+@desc: 基于SQLite的持久化Embedding缓存，以 (模型名, 文本内容哈希) 为键。
+       重建向量库时只有从未见过的文本块才需要调用Embedding API。
+"""
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+# SQLite 单条语句中参数数量的安全上限
+_QUERY_CHUNK_SIZE = 500
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: str):
+        """
+        打开（或创建）缓存数据库。
+
+        :param db_path: SQLite数据库文件路径，需位于向量库目录之外，以免重建时被清空。
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash)"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        """计算文本内容的哈希，作为缓存键的一部分。"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> list[list[float] | None]:
+        """
+        批量查询缓存。
+
+        :param model: Embedding模型名称。
+        :param texts: 文本列表。
+        :return: 与texts一一对应的向量列表，未命中的位置为None。
+        """
+        hashes = [self.hash_text(text) for text in texts]
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique_hashes), _QUERY_CHUNK_SIZE):
+                chunk = unique_hashes[i:i + _QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = self._decode(blob)
+        return [found.get(text_hash) for text_hash in hashes]
+
+    def put_many(self, model: str, texts: list[str], embeddings: list[list[float]]):
+        """批量写入缓存，已存在的条目会被覆盖。"""
+        rows = [
+            (model, self.hash_text(text), len(embedding), self._encode(embedding))
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _encode(embedding: list[float]) -> bytes:
+        # 以float32存储，体积是JSON文本的几分之一，精度对检索没有影响
+        return array('f', embedding).tobytes()
+
+    @staticmethod
+    def _decode(blob: bytes) -> list[float]:
+        vector = array('f')
+        vector.frombytes(blob)
+        return vector.tolist()
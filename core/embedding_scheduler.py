@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+@file: embedding_scheduler.py
+@desc: 并发的Embedding批次调度器。将待向量化的文本切分为批次，由有界线程池并发请求，
+       同时用令牌桶限制每秒请求数 (QPS) 与每分钟Token数 (TPM)，
+       遇到限流响应时自适应地全局退避，最终按原始顺序返回结果。
+"""
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core.llm_service import DashScopeAPIError
+
+
+class TokenBucket:
+    """线程安全的令牌桶，用于平滑地限制速率。"""
+    def __init__(self, rate_per_second: float, capacity: float):
+        """
+        :param rate_per_second: 每秒补充的令牌数，<=0 表示不限速。
+        :param capacity: 桶的容量，即允许的最大突发量。
+        """
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """阻塞直到取得 amount 个令牌（超过容量的请求按容量计算，避免永久等待）。"""
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait_time = (amount - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class EmbeddingBatchScheduler:
+    # 全局限流退避的初始与最大等待时间（秒）
+    MIN_THROTTLE_DELAY = 1.0
+    MAX_THROTTLE_DELAY = 60.0
+
+    def __init__(self, embed_batch_func, batch_size: int = 25, max_workers: int = 4,
+                 max_qps: float = 0, max_tokens_per_minute: float = 0, max_retries: int = 5):
+        """
+        :param embed_batch_func: 对一批文本调用Embedding API的函数，失败时抛出异常。
+        :param batch_size: 每个批次的文本数量（通义千问v2模型上限为25）。
+        :param max_workers: 同时在途的批次数量。
+        :param max_qps: 每秒最多发起的请求数，<=0 表示不限制。
+        :param max_tokens_per_minute: 每分钟最多发送的Token数，<=0 表示不限制。
+        :param max_retries: 每个批次失败后的最大重试次数。
+        """
+        self.embed_batch_func = embed_batch_func
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self._qps_bucket = TokenBucket(max_qps, max(1.0, max_qps))
+        self._tpm_bucket = TokenBucket(max_tokens_per_minute / 60, max_tokens_per_minute)
+
+        # 自适应退避状态：遇到限流时所有线程暂停到 _cooldown_until，退避时长逐次翻倍，成功后逐步恢复
+        self._lock = threading.Lock()
+        self._throttle_delay = 0.0
+        self._cooldown_until = 0.0
+
+    @staticmethod
+    def estimate_tokens(texts: list[str]) -> int:
+        """粗略估算一批文本的Token数（中文约每字一个Token，按字符数计偏保守）。"""
+        return sum(len(text) for text in texts)
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """
+        并发地完成所有文本的向量化。
+
+        :param texts: 文本列表。
+        :return: 与texts一一对应的向量列表。任一批次在所有重试后仍失败时抛出异常。
+        """
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if not batches:
+            return []
+
+        results = [None] * len(batches)
+        completed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embedding") as executor:
+            futures = {executor.submit(self._run_batch, index, batch): index for index, batch in enumerate(batches)}
+            try:
+                for future in as_completed(futures):
+                    index = futures[future]
+                    results[index] = future.result()
+                    completed += 1
+                    print(f"成功处理批次 {index + 1} ({completed}/{len(batches)} 完成)。")
+            except Exception:
+                # 任一批次最终失败时，取消尚未开始的批次，尽快终止建库流程
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return [embedding for batch_embeddings in results for embedding in batch_embeddings]
+
+    def _run_batch(self, index: int, texts: list[str]) -> list[list[float]]:
+        """执行单个批次，按限流与退避策略重试。"""
+        tokens = self.estimate_tokens(texts)
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_cooldown()
+            self._qps_bucket.acquire(1)
+            self._tpm_bucket.acquire(tokens)
+            try:
+                embeddings = self.embed_batch_func(texts)
+                if not embeddings or len(embeddings) != len(texts):
+                    raise ValueError(f"Embedding结果数量 ({len(embeddings or [])}) 与批次文本数量 ({len(texts)}) 不一致。")
+                self._on_success()
+                return embeddings
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"错误: 批次 {index + 1} 在 {self.max_retries} 次重试后仍然失败。程序将终止。")
+                    raise
+                if isinstance(e, DashScopeAPIError) and e.is_throttling:
+                    wait_time = self._on_throttled()
+                    print(f"警告: 批次 {index + 1} 触发限流 ({e})，所有批次将暂停 {wait_time:.1f} 秒。")
+                else:
+                    # 其他错误只影响当前批次：指数退避并加入随机抖动
+                    wait_time = min(self.MAX_THROTTLE_DELAY, 2 ** attempt) * random.uniform(0.5, 1.5)
+                    print(f"错误: 处理批次 {index + 1} (尝试 {attempt + 1}/{self.max_retries + 1}) 时发生错误: {e}")
+                    print(f"将在 {wait_time:.1f} 秒后重试...")
+                    time.sleep(wait_time)
+
+    def _wait_for_cooldown(self):
+        while True:
+            with self._lock:
+                wait_time = self._cooldown_until - time.monotonic()
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    def _on_throttled(self) -> float:
+        """记录一次限流：退避时长翻倍（带抖动），并让所有线程暂停。"""
+        with self._lock:
+            self._throttle_delay = min(self.MAX_THROTTLE_DELAY, max(self.MIN_THROTTLE_DELAY, self._throttle_delay * 2))
+            wait_time = self._throttle_delay * random.uniform(0.8, 1.2)
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + wait_time)
+            return wait_time
+
+    def _on_success(self):
+        """请求成功后逐步缩短退避时长。"""
+        with self._lock:
+            self._throttle_delay /= 2
+            if self._throttle_delay < self.MIN_THROTTLE_DELAY:
+                self._throttle_delay = 0.0
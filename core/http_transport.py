@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+@file: http_transport.py
+@desc: 共享的HTTP连接池。DashScope与minerU客户端通过这里获取长连接会话，
+       复用TCP+TLS连接（keep-alive），避免每个Embedding批次、上传、轮询、下载都重新握手。
+       默认使用 requests + urllib3 连接池；安装了 httpx[http2] 且开启 HTTP2_ENABLED 时，
+       可改用HTTP/2会话，在单个连接上多路复用并发请求。
+"""
+import os
+import sys
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+    import h2  # noqa: F401  httpx 的HTTP/2支持依赖 h2
+except ImportError:  # httpx[http2] 为可选依赖
+    httpx = None
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT,
+                    HTTP_READ_TIMEOUT, HTTP2_ENABLED)
+
+
+class PooledSession(requests.Session):
+    """
+    带连接池与默认超时的 requests 会话。
+    requests 本身没有会话级的默认超时，未显式传入 timeout 的请求在这里补上。
+    """
+    def __init__(self, pool_connections: int = HTTP_POOL_CONNECTIONS, pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                 timeout: tuple = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), verify: bool = True):
+        """
+        :param pool_connections: 缓存连接池的主机数量。
+        :param pool_maxsize: 每个主机保持的最大空闲连接数，应不小于该主机上的最大并发请求数，
+                             否则超出的连接在请求结束后会被关闭，下次仍需重新握手。
+        :param timeout: 默认的 (连接超时, 读取超时)，单位为秒。
+        :param verify: 是否校验服务端TLS证书。
+        """
+        super().__init__()
+        self.timeout = timeout
+        self.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(verify: bool = True, http2: bool = HTTP2_ENABLED):
+    """
+    创建一个长连接会话。
+
+    :param verify: 是否校验服务端TLS证书。
+    :param http2: 是否使用HTTP/2（需要安装 httpx[http2]，未安装时回退到 requests 并给出提示）。
+    :return: requests.Session 或 httpx.Client。两者的 get/post/put 及响应的
+             status_code、json()、raise_for_status() 用法一致。
+    """
+    if http2:
+        if httpx is not None:
+            return httpx.Client(
+                http2=True,
+                verify=verify,
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_MAXSIZE),
+            )
+        print("警告: 已开启 HTTP2_ENABLED，但未安装 httpx[http2]，将使用 HTTP/1.1 连接池。")
+    return PooledSession(verify=verify)
+
+
+def iter_stream_lines(session, method: str, url: str, **kwargs):
+    """
+    以流式方式发送请求，逐行产出响应内容（用于SSE），兼容 requests 与 httpx 会话。
+
+    :return: 一个生成器，首个元素为响应对象（供调用方检查状态码），之后为解码后的文本行。
+    """
+    if httpx is not None and isinstance(session, httpx.Client):
+        with session.stream(method, url, **kwargs) as response:
+            yield response
+            yield from response.iter_lines()
+        return
+    with session.request(method, url, stream=True, **kwargs) as response:
+        yield response
+        for line in response.iter_lines():
+            yield line.decode("utf-8") if isinstance(line, bytes) else line
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name: str, verify: bool = True, http2: bool = HTTP2_ENABLED):
+    """
+    获取进程内按名称共享的会话（如 "dashscope"、"mineru"），首次调用时创建。
+    requests.Session 与 httpx.Client 均可在多线程间共享使用。
+    """
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = create_session(verify=verify, http2=http2)
+        return session
+
+
+def close_sessions():
+    """关闭所有共享会话，释放连接。"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
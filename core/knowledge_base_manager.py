@@ -3,84 +3,203 @@ import sys
 import json
 import shutil
 import time
+import hashlib
+import threading
+from collections import OrderedDict
 # 修正: 将项目根目录添加到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from langchain_community.document_loaders import DirectoryLoader, JSONLoader
+from langchain_community.document_loaders import JSONLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
+from chromadb.api.client import SharedSystemClient
 from langchain.embeddings.base import Embeddings
 from typing import List
 # from langchain_huggingface import HuggingFaceEmbeddings  # 不再使用HuggingFaceEmbeddings
 from core.llm_service import QwenLLM # 导入QwenLLM
-from config import PROCESSED_REPORTS_DIR, VECTOR_STORE_DIR
+from core.embedding_cache import EmbeddingCache
+from core.embedding_scheduler import EmbeddingBatchScheduler
+from core.numpy_index import NumpyVectorIndex
+from core.versioned_dir import current_dir
+from core.lexical_index import LexicalIndex, TOKENIZER as LEXICAL_TOKENIZER
+from core.report_columns import ReportColumns, columnar_path, write_report_columns
+from core.pipeline import batched, prefetch
+from core.near_duplicates import NearDuplicateIndex
+from core.structured_chunker import LayoutElement, StructuredChunker
+from core.partitions import PartitionIndex, report_attributes
+from core.metrics import span
+from core.single_flight import SingleFlight
+from config import (PROCESSED_REPORTS_DIR, VECTOR_STORE_DIR, EMBEDDING_MODEL_NAME,
+                    EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH,
+                    EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_WORKERS, EMBEDDING_MAX_QPS,
+                    EMBEDDING_MAX_TOKENS_PER_MINUTE, EMBEDDING_MAX_RETRIES,
+                    RETRIEVAL_BACKEND, NUMPY_INDEX_DTYPE, QUERY_EMBEDDING_CACHE_SIZE,
+                    COLUMNAR_REPORTS_ENABLED, INGEST_BATCH_SIZE, INGEST_QUEUE_SIZE,
+                    INDEX_DEDUP_ENABLED, INDEX_DEDUP_THRESHOLD,
+                    STRUCTURED_CHUNKING_ENABLED, STRUCTURED_TABLE_MAX_CHARS,
+                    VECTOR_STORE_SHARDS)
 from langchain.schema import Document
 
+class QueryEmbeddingError(Exception):
+    """查询向量化失败（Embedding API调用失败）时抛出，此时无法执行向量检索。"""
+
+
 class QwenTongyiEmbeddings(Embeddings):
     """
     自定义的通义千问Embedding类，以适配LangChain的接口。
     """
-    def __init__(self, llm_service: QwenLLM):
+    def __init__(self, llm_service: QwenLLM, cache: EmbeddingCache = None,
+                 model_name: str = EMBEDDING_MODEL_NAME,
+                 query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        """
+        :param llm_service: 用于调用Embedding API的QwenLLM实例。
+        :param cache: 可选，持久化的Embedding缓存；命中的文本块不再调用API。
+        :param model_name: Embedding模型名称，作为缓存键的一部分，更换模型后旧缓存自然失效。
+        :param query_cache_size: 内存中缓存的查询向量数量上限（LRU），为0时不缓存。
+        """
         self.llm_service = llm_service
+        self.cache = cache
+        self.model_name = model_name
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        # 同一查询文本的并发请求只调用一次API
+        self._query_flight = SingleFlight()
+        self.scheduler = EmbeddingBatchScheduler(
+            llm_service.get_text_embeddings_batch,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            max_workers=EMBEDDING_MAX_WORKERS,
+            max_qps=EMBEDDING_MAX_QPS,
+            max_tokens_per_minute=EMBEDDING_MAX_TOKENS_PER_MINUTE,
+            max_retries=EMBEDDING_MAX_RETRIES
+        )
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
         处理一组文档的向量化。
-        采用分批处理以提高效率并避免API单次请求量超限。
-        增加了更健壮的重试和退避机制来应对网络不稳定。
+        配置了Embedding缓存时，先按内容哈希查询缓存，只为未命中的文本调用API，
+        新得到的向量写回缓存，供后续重建复用。
         """
-        all_embeddings = []
-        batch_size = 25  # 通义千问v2模型的batch size上限为25
-        max_retries_per_batch = 5 # 增加每个批次的重试次数
-        
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            
-            for attempt in range(max_retries_per_batch):
+        if self.cache is None:
+            return self._embed_with_api(texts)
+
+        embeddings = self.cache.get_many(self.model_name, texts)
+        missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        print(f"Embedding缓存: 命中 {len(texts) - len(missing_indices)} 个文档块, 未命中 {len(missing_indices)} 个。")
+
+        if missing_indices:
+            missing_texts = [texts[i] for i in missing_indices]
+            new_embeddings = self._embed_with_api(missing_texts)
+            if len(new_embeddings) != len(missing_texts):
+                raise ValueError(f"Embedding结果数量 ({len(new_embeddings)}) 与文档块数量 ({len(missing_texts)}) 不一致。")
+            self.cache.put_many(self.model_name, missing_texts, new_embeddings)
+            for i, embedding in zip(missing_indices, new_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
+    def _embed_with_api(self, texts: List[str]) -> List[List[float]]:
+        """
+        调用Embedding API完成向量化。
+        由并发调度器分批请求，并按配置的QPS/TPM限流，遇到限流时自适应退避。
+        """
+        return self.scheduler.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        处理单个查询的向量化。
+        最近的查询向量保存在内存LRU中；同一文本的并发请求合并为一次API调用。
+
+        :raises QueryEmbeddingError: API调用失败时（合并到该调用的并发请求同样抛出）。
+        """
+        embedding = self._get_cached_query(text)
+        if embedding is not None:
+            return embedding
+        with span("query_embedding"):
+            embedding, _ = self._query_flight.do(text, self._request_query_embedding, text)
+        self._put_cached_queries([text], [embedding])
+        return embedding
+
+    def _request_query_embedding(self, text: str) -> List[float]:
+        """调用API计算单个查询的向量，失败时抛出异常而不是返回None，使合并的请求不会拿到空结果继续检索。"""
+        embedding = self.llm_service.get_text_embedding(text)
+        if not embedding:
+            raise QueryEmbeddingError(f"无法计算查询向量: {text[:50]}")
+        return embedding
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化多个查询，按API的批次上限合并请求（查询向量只进入内存LRU，不写入持久化缓存）。
+
+        :raises QueryEmbeddingError: 任一批次在所有重试后仍失败时。
+        """
+        embeddings = [self._get_cached_query(text) for text in texts]
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing_texts:
+            with span("query_embedding"):
                 try:
-                    # 调用新的批量处理方法
-                    batch_embeddings = self.llm_service.get_text_embeddings_batch(batch_texts)
-                    if batch_embeddings:
-                        all_embeddings.extend(batch_embeddings)
-                        # 成功处理，跳出重试循环
-                        print(f"成功处理批次 {i//batch_size + 1}/{len(texts)//batch_size + 1}。")
-                        break
-                    else:
-                        print(f"警告: 批次 {i//batch_size + 1} 的Embedding返回为空。")
-                        # 同样视为成功处理，跳出重试
-                        break
+                    new_embeddings = dict(zip(missing_texts, self.scheduler.embed(missing_texts)))
                 except Exception as e:
-                    # 捕获到异常，进行重试
-                    wait_time = 5 * (attempt + 1) # 指数退避
-                    print(f"错误: 处理批次 {i//batch_size + 1} (尝试 {attempt + 1}/{max_retries_per_batch}) 时发生错误: {e}")
-                    print(f"将在 {wait_time} 秒后重试...")
-                    if attempt + 1 == max_retries_per_batch:
-                        # 这是最后一次尝试，记录严重错误并抛出异常
-                        print(f"错误: 批次 {i//batch_size + 1} 在所有重试后仍然失败。程序将终止。")
-                        raise e # 重新抛出异常，终止整个建库流程
-                    time.sleep(wait_time)
-        
-        return all_embeddings
+                    raise QueryEmbeddingError(f"无法计算 {len(missing_texts)} 个查询的向量: {e}") from e
+            self._put_cached_queries(missing_texts, [new_embeddings[text] for text in missing_texts])
+            embeddings = [new_embeddings[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return embeddings
 
-    def embed_query(self, text: str) -> List[float]:
-        """处理单个查询的向量化"""
-        return self.llm_service.get_text_embedding(text)
+    def _get_cached_query(self, text: str) -> List[float] | None:
+        with self._query_cache_lock:
+            embedding = self._query_cache.get(text)
+            if embedding is not None:
+                self._query_cache.move_to_end(text)
+            return embedding
+
+    def _put_cached_queries(self, texts: List[str], embeddings: List[List[float]]):
+        if self.query_cache_size <= 0:
+            return
+        with self._query_cache_lock:
+            for text, embedding in zip(texts, embeddings):
+                self._query_cache[text] = embedding
+                self._query_cache.move_to_end(text)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
 
 
 class KnowledgeBaseManager:
+    # 每次向量库构建完成后写入的标记文件，依赖向量库内容的缓存据此判断是否需要失效
+    BUILD_STAMP_FILENAME = "build_stamp"
+    # 增量同步使用的源文件清单，记录每个JSON文件的修改时间、内容哈希及其产生的文档块ID
+    MANIFEST_FILENAME = "manifest.json"
+    # NumPy检索后端的索引目录（位于向量库目录内，随向量库一起重建）
+    NUMPY_INDEX_DIRNAME = "numpy_index"
+    # BM25词法索引目录（同样随向量库一起重建）
+    LEXICAL_INDEX_DIRNAME = "lexical_index"
+    # 全量构建先写入 "<向量库目录>.staging"，完成后替换向量库目录；替换过程中旧目录暂存为 "<向量库目录>.old"
+    STAGING_SUFFIX = ".staging"
+    BACKUP_SUFFIX = ".old"
+    # 暂存目录中的构建检查点，记录构建参数与已写入的文档块数量
+    BUILD_CHECKPOINT_FILENAME = "build_checkpoint.json"
+
     def __init__(self, processed_dir: str = PROCESSED_REPORTS_DIR, 
-                 persist_directory: str = VECTOR_STORE_DIR):
+                 persist_directory: str = VECTOR_STORE_DIR,
+                 llm: QwenLLM = None, embedding_function: Embeddings = None,
+                 source_filter=None):
         """
         初始化知识库管理器。
 
         :param processed_dir: 已处理（JSON）文件所在的目录。
         :param persist_directory: ChromaDB持久化存储的目录。
+        :param llm: 可选，共享的QwenLLM实例；未提供时自动创建。
+        :param embedding_function: 可选，共享的Embedding对象（如多个分片共用一个）；未提供时自动创建。
+        :param source_filter: 可选，接收JSON文件相对 processed_dir 的路径、返回是否纳入本向量库的函数。
+                              分片时每个分片只包含分配给它的文件。
         """
         self.processed_dir = processed_dir
         self.persist_directory = persist_directory
-        # 使用通义千问的Embedding服务,并用包装类适配
-        llm = QwenLLM()
-        self.embedding_function = QwenTongyiEmbeddings(llm)
+        self.source_filter = source_filter
+        if embedding_function is None:
+            # 使用通义千问的Embedding服务,并用包装类适配
+            llm = llm or QwenLLM()
+            embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_ENABLED else None
+            embedding_function = QwenTongyiEmbeddings(llm, cache=embedding_cache)
+        self.embedding_function = embedding_function
         self.db = None
 
     def _metadata_func(self, record: dict, metadata: dict) -> dict:
@@ -98,11 +217,9 @@ class KnowledgeBaseManager:
         # 例如，如果我们创建了一个临时的'loader_content'键，可以在这里 del metadata['loader_content']
         return metadata
 
-    def load_documents(self):
-        """
-        从目录加载JSON文档，使用jq语法和自定义元数据函数高效解析。
-        """
-        json_loader_kwargs = {
+    def _json_loader_kwargs(self) -> dict:
+        """JSONLoader的解析参数，全量加载与单文件加载共用。"""
+        return {
             # 采纳并增强了建议的jq表达式：
             # 1. 'if type == "object"' 检查每个元素的类型。
             # 2. 如果是对象，则在保留原对象所有字段的基础上，添加一个新的'page_content'字段。
@@ -117,22 +234,72 @@ class KnowledgeBaseManager:
             'content_key': 'page_content',  # 统一使用 'page_content' 作为内容来源
             'metadata_func': self._metadata_func
         }
+
+    def load_documents(self):
+        """
+        加载目录下的所有JSON文档，每个文件的解析规则与 load_file_documents 相同。
+        """
+        documents = []
+        for file_path in self._list_source_files():
+            documents.extend(self.load_file_documents(file_path))
+
+        if not documents:
+            print(f"警告: 在目录 '{self.processed_dir}' 中没有成功加载任何文档。")
+            return []
         
-        loader = DirectoryLoader(
-            self.processed_dir, 
-            glob="**/*.json", 
-            loader_cls=JSONLoader,
-            loader_kwargs=json_loader_kwargs,
-            show_progress=True,
-            use_multithreading=True
-        )
-        
+        print(f"成功加载并处理了 {len(documents)} 个文档块。")
+        return documents
+
+    def load_file_documents(self, file_path: str):
+        """
+        加载单个JSON文件。启用列式格式时优先读取同名的 .rcol 文件（不存在或早于JSON时先由JSON生成），
+        否则使用 JSONLoader 和jq表达式解析；两种方式得到的文档完全相同。
+        """
         try:
-            documents = loader.load()
+            documents = self._load_columnar_documents(file_path) if COLUMNAR_REPORTS_ENABLED else None
+            if documents is None:
+                documents = JSONLoader(file_path, **self._json_loader_kwargs()).load()
         except ValueError as e:
-            print(f"JSON文件解析失败，请检查文件格式: {e}")
+            print(f"JSON文件 '{file_path}' 解析失败，请检查文件格式: {e}")
             return []
+        return self._clean_documents(documents)
+
+    @staticmethod
+    def _ensure_columnar(file_path: str) -> str | None:
+        """
+        返回JSON文件对应的列式文件路径，列式文件不存在或早于JSON时先由JSON生成。
+        JSON不是minerU的元素列表格式时返回None。
+        """
+        rcol_path = columnar_path(file_path)
+        if not os.path.exists(rcol_path) or os.path.getmtime(rcol_path) < os.path.getmtime(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            if not isinstance(records, list):
+                return None
+            write_report_columns(rcol_path, records)
+        return rcol_path
+
+    @classmethod
+    def _load_columnar_documents(cls, file_path: str):
+        """
+        从列式文件加载文档，只解码 text 与 table_body 两列。
+        JSON不是minerU的元素列表格式时返回None，由调用方回退到 JSONLoader。
+        """
+        rcol_path = cls._ensure_columnar(file_path)
+        if rcol_path is None:
+            return None
+
+        with ReportColumns(rcol_path) as columns:
+            contents = columns.page_contents()
+        # seq_num 与 JSONLoader 一致，为元素在列表中从1开始的序号
+        return [
+            Document(page_content=content, metadata={"source": file_path, "seq_num": seq_num})
+            for seq_num, content in enumerate(contents, 1)
+        ]
 
+    @staticmethod
+    def _clean_documents(documents):
+        """过滤空文档，并确保所有page_content都是字符串。"""
         # 过滤掉那些没有成功提取出文本的文档
         documents = [doc for doc in documents if doc.page_content]
 
@@ -141,12 +308,6 @@ class KnowledgeBaseManager:
             if not isinstance(doc.page_content, str):
                 print(f"警告: 在文件 {doc.metadata.get('source')} 中发现非文本内容，已强制转换为字符串。")
                 doc.page_content = str(doc.page_content)
-
-        if not documents:
-            print(f"警告: 在目录 '{self.processed_dir}' 中没有成功加载任何文档。")
-            return []
-        
-        print(f"成功加载并处理了 {len(documents)} 个文档块。")
         return documents
 
     def split_documents(self, documents, chunk_size=500, chunk_overlap=50):
@@ -155,36 +316,564 @@ class KnowledgeBaseManager:
         docs = text_splitter.split_documents(documents)
         return docs
 
+    def chunk_file_documents(self, file_path: str, chunk_size=500, chunk_overlap=50):
+        """
+        加载单个JSON文件并切分为文档块。启用结构化分块且文件为minerU的元素列表时，
+        按版面结构合并元素（见 StructuredChunker）；否则逐元素加载后按字符分割。
+        """
+        chunks = None
+        if STRUCTURED_CHUNKING_ENABLED:
+            try:
+                elements = self._load_layout_elements(file_path)
+            except ValueError as e:
+                print(f"JSON文件 '{file_path}' 解析失败，请检查文件格式: {e}")
+                return []
+            if elements is not None:
+                chunks = StructuredChunker(chunk_size, chunk_overlap, STRUCTURED_TABLE_MAX_CHARS).chunk(elements, file_path)
+        if chunks is None:
+            chunks = self.split_documents(self.load_file_documents(file_path), chunk_size, chunk_overlap)
+        # 研报级别的分区属性（券商、报告期等）写入每个文档块的元数据，供检索时按分区过滤
+        attributes = report_attributes(file_path)
+        for chunk in chunks:
+            chunk.metadata.update(attributes)
+        return chunks
+
+    @classmethod
+    def _load_layout_elements(cls, file_path: str) -> list[LayoutElement] | None:
+        """读取minerU元素的版面信息（启用列式格式时从 .rcol 读取）；JSON不是元素列表时返回None。"""
+        if COLUMNAR_REPORTS_ENABLED:
+            rcol_path = cls._ensure_columnar(file_path)
+            if rcol_path is None:
+                return None
+            with ReportColumns(rcol_path) as columns:
+                rows = zip(columns.column("type"), columns.page_contents(),
+                           columns.column("page_idx"), columns.column("text_level"))
+                return [LayoutElement(seq_num, *row) for seq_num, row in enumerate(rows, 1)]
+
+        with open(file_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if not isinstance(records, list):
+            return None
+        return [LayoutElement.from_record(seq_num, record) for seq_num, record in enumerate(records, 1)]
+
     def create_and_persist_db(self, docs):
-        """创建并持久化向量数据库。"""
-        print(f"正在创建和持久化向量数据库到 '{self.persist_directory}'...")
-        # 如果目录已存在，先清空
-        if os.path.exists(self.persist_directory):
-            print(f"目录 '{self.persist_directory}' 已存在，正在清空...")
-            shutil.rmtree(self.persist_directory)
-        
-        # 获取所有文档的文本内容
-        doc_texts = [doc.page_content for doc in docs]
-        
-        # 使用包装好的Embedding对象进行向量化
+        """由已分割好的文档块列表创建并持久化向量数据库（按批次向量化并写入）。"""
+        ids, manifest = self._assign_chunk_ids(docs)
+        batches = batched(zip(ids, docs), INGEST_BATCH_SIZE)
+        return self._build_db_from_batches(batches, manifest)
+
+    def build_db(self, chunk_size=500, chunk_overlap=50):
+        """
+        以流式流水线全量构建向量数据库：加载 -> 分割 -> 向量化 -> 写入。
+        文档按文件逐个加载和分割，文档块按 INGEST_BATCH_SIZE 分批向量化并写入，
+        各阶段之间通过有界队列衔接，彼此并行；下游处理不过来时上游阻塞，
+        内存占用只与批次大小和队列长度有关，与语料规模无关。
+
+        :return: 向量数据库对象；没有任何文档块时返回None。
+        """
+        source_files = self._list_source_files()
+        if not source_files:
+            print(f"警告: 在目录 '{self.processed_dir}' 中没有找到JSON文件。")
+            return None
+        manifest = {}
+        duplicate_sources = {} if INDEX_DEDUP_ENABLED else None
+        chunks = self._iter_chunks(source_files, manifest, chunk_size, chunk_overlap, duplicate_sources)
+        # 参数相同的未完成构建可以从断点继续（文档块ID由来源文件及其内容哈希决定）
+        build_params = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap,
+                        "embedding_model": getattr(self.embedding_function, "model_name", None),
+                        "dedup_threshold": INDEX_DEDUP_THRESHOLD if INDEX_DEDUP_ENABLED else None,
+                        "structured_chunking": STRUCTURED_CHUNKING_ENABLED,
+                        "table_max_chars": STRUCTURED_TABLE_MAX_CHARS}
+        return self._build_db_from_batches(batched(chunks, INGEST_BATCH_SIZE), manifest, build_params, duplicate_sources)
+
+    def _iter_chunks(self, source_files: list, manifest: dict, chunk_size: int, chunk_overlap: int,
+                     duplicate_sources: dict = None):
+        """
+        逐个文件加载并分割文档，产出 (文档块ID, 文档块)。
+        每个文件的清单条目在处理完该文件时写入 manifest。
+
+        :param duplicate_sources: 提供时启用索引去重：与先出现的文档块近似重复的文档块不再产出，
+                                  其来源文件记录到 duplicate_sources[规范文档块ID] 中；
+                                  清单条目的 chunk_ids 只包含保留的文档块，duplicates 记录所依赖的规范文档块ID。
+        """
+        deduplicator = NearDuplicateIndex(INDEX_DEDUP_THRESHOLD) if duplicate_sources is not None else None
+        total, removed = 0, 0
+        for file_path in source_files:
+            chunks = self.chunk_file_documents(file_path, chunk_size, chunk_overlap)
+            ids, file_manifest = self._assign_chunk_ids(chunks)
+            rel_path = os.path.relpath(file_path, self.processed_dir)
+            entry = manifest[rel_path] = file_manifest.get(rel_path) or self._manifest_entry(file_path, [])
+            if deduplicator is None:
+                yield from zip(ids, chunks)
+                continue
+
+            kept_ids, canonical_ids = [], set()
+            for chunk_id, chunk in zip(ids, chunks):
+                canonical_id = deduplicator.add(chunk_id, chunk.page_content)
+                if canonical_id is None:
+                    kept_ids.append(chunk_id)
+                    yield chunk_id, chunk
+                else:
+                    canonical_ids.add(canonical_id)
+                    duplicate_sources.setdefault(canonical_id, []).append(rel_path)
+            total += len(ids)
+            removed += len(ids) - len(kept_ids)
+            entry["chunk_ids"] = kept_ids
+            if canonical_ids:
+                entry["duplicates"] = sorted(canonical_ids)
+
+        if deduplicator is not None:
+            print(f"索引去重: 共 {total} 个文档块，去除近似重复 {removed} 个，保留 {total - removed} 个。")
+
+    def _build_db_from_batches(self, batches, manifest: dict, build_params: dict = None, duplicate_sources: dict = None):
+        """
+        将 [(文档块ID, 文档块), ...] 批次依次向量化并写入暂存目录中的新向量数据库，
+        全部完成后再原子地替换正在使用的向量库；构建失败时旧向量库保持不变。
+        分批与向量化分别在后台线程中执行，与写入并行。
+
+        每个批次写入后更新暂存目录中的构建检查点。提供 build_params 时，若暂存目录中留有
+        参数相同的未完成构建，则从断点继续：已写入的文档块不再向量化。
+        duplicate_sources ({规范文档块ID: [副本的来源文件]}) 在全部写入后记录到规范文档块的元数据中。
+        """
+        staging_dir = self.staging_directory
+        checkpoint = self._load_build_checkpoint()
+        resume = build_params is not None and checkpoint is not None and checkpoint.get("params") == build_params
+        if resume:
+            print(f"检测到未完成的构建（已写入 {checkpoint['committed_chunks']} 个文档块），将从断点继续...")
+        elif os.path.exists(staging_dir):
+            print(f"清理上次遗留的暂存目录 '{staging_dir}'...")
+            shutil.rmtree(staging_dir)
+        print(f"正在创建向量数据库到暂存目录 '{staging_dir}'...")
+        staging_db = Chroma(persist_directory=staging_dir, embedding_function=self.embedding_function)
+
+        def embed(batch):
+            if resume:
+                existing = set(staging_db._collection.get(ids=[chunk_id for chunk_id, _ in batch], include=[])["ids"])
+                batch = [(chunk_id, doc) for chunk_id, doc in batch if chunk_id not in existing]
+            if not batch:
+                return batch, []
+            return batch, self.embedding_function.embed_documents([doc.page_content for _, doc in batch])
+
         print("正在使用通义千问模型为文档生成向量...")
-        # 注意：这里我们直接调用embed_documents方法，而不是在列表推导式中调用
-        # 这一步将由包装类在内部处理
-        
-        # Chroma.from_documents 会自动调用 embedding_function.embed_documents
-        self.db = Chroma.from_documents(
-            documents=docs,
-            embedding=self.embedding_function, 
-            persist_directory=self.persist_directory
+        batches = prefetch(batches, maxsize=INGEST_QUEUE_SIZE, name="ingest-split")
+        embedded_batches = prefetch((embed(batch) for batch in batches), maxsize=INGEST_QUEUE_SIZE, name="ingest-embed")
+        committed = checkpoint["committed_chunks"] if resume else 0
+        try:
+            for batch, embeddings in embedded_batches:
+                if not batch:
+                    continue
+                staging_db._collection.upsert(
+                    ids=[chunk_id for chunk_id, _ in batch],
+                    embeddings=embeddings,
+                    documents=[doc.page_content for _, doc in batch],
+                    metadatas=[doc.metadata for _, doc in batch],
+                )
+                committed += len(batch)
+                self._save_build_checkpoint(build_params, committed)
+                print(f"已写入 {committed} 个文档块。")
+        except Exception:
+            print(f"构建中断，当前向量库未受影响；已写入的文档块保存在 '{staging_dir}'，重新运行将从断点继续。")
+            raise
+
+        expected_ids = {chunk_id for entry in manifest.values() for chunk_id in entry["chunk_ids"]}
+        if resume:
+            # 断点之前写入、但其来源文件已发生变化的文档块不再属于本次构建
+            stale_ids = [chunk_id for chunk_id in staging_db._collection.get(include=[])["ids"] if chunk_id not in expected_ids]
+            if stale_ids:
+                staging_db._collection.delete(ids=stale_ids)
+        if not expected_ids:
+            print("警告: 没有可写入的文档块，当前向量库保持不变。")
+            shutil.rmtree(staging_dir)
+            return None
+
+        if duplicate_sources:
+            self._record_duplicate_sources(staging_db, duplicate_sources)
+        self._save_manifest(manifest, staging_dir)
+        self._write_build_stamp(staging_dir)
+        # 检查点在替换成功后才删除：替换失败时重新运行可直接从断点完成替换，无需重新向量化
+        self._swap_in_staging()
+        os.remove(os.path.join(self.persist_directory, self.BUILD_CHECKPOINT_FILENAME))
+        print(f"成功为 {len(expected_ids)} 个文档块创建向量数据库，并已替换 '{self.persist_directory}'。")
+        return self.load_db()
+
+    @staticmethod
+    def _record_duplicate_sources(db, duplicate_sources: dict, page_size: int = 500):
+        """
+        在规范文档块的元数据中记录被去重的副本：duplicate_count 为副本数量，
+        duplicate_sources 为副本来源文件的JSON数组字符串（Chroma的元数据只支持标量值）。
+        """
+        canonical_ids = list(duplicate_sources)
+        for offset in range(0, len(canonical_ids), page_size):
+            page = db._collection.get(ids=canonical_ids[offset:offset + page_size], include=["metadatas"])
+            metadatas = [
+                {**(metadata or {}),
+                 "duplicate_count": len(duplicate_sources[chunk_id]),
+                 "duplicate_sources": json.dumps(sorted(set(duplicate_sources[chunk_id])), ensure_ascii=False)}
+                for chunk_id, metadata in zip(page["ids"], page["metadatas"])
+            ]
+            if metadatas:
+                db._collection.update(ids=page["ids"], metadatas=metadatas)
+
+    @property
+    def staging_directory(self) -> str:
+        """全量构建使用的暂存目录，与向量库目录位于同一父目录下，以便通过重命名完成替换。"""
+        return self.persist_directory.rstrip(os.sep) + self.STAGING_SUFFIX
+
+    def _load_build_checkpoint(self) -> dict | None:
+        try:
+            with open(os.path.join(self.staging_directory, self.BUILD_CHECKPOINT_FILENAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save_build_checkpoint(self, build_params: dict | None, committed_chunks: int):
+        path = os.path.join(self.staging_directory, self.BUILD_CHECKPOINT_FILENAME)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"params": build_params, "committed_chunks": committed_chunks,
+                       "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+        os.replace(path + ".tmp", path)
+
+    def _swap_in_staging(self):
+        """
+        用暂存目录替换向量库目录：旧目录先重命名为备份，再将暂存目录重命名为向量库目录，最后删除备份。
+        两次重命名之间若进程中断，load_db 会从备份中恢复旧向量库。
+
+        重命名之前先关闭本进程中打开这两个目录的Chroma客户端，释放SQLite与HNSW索引文件的句柄
+        （Windows上无法重命名仍有文件被打开的目录）。其他进程（如正在运行的API服务）仍打开着旧向量库时替换会失败，
+        此时暂存目录保持完整，关闭该进程后重新运行即可从断点完成替换。
+        """
+        backup_dir = self.persist_directory.rstrip(os.sep) + self.BACKUP_SUFFIX
+        self._close_chroma(self.staging_directory)
+        self.close_db()
+        if os.path.exists(backup_dir):
+            shutil.rmtree(backup_dir)
+        try:
+            if os.path.exists(self.persist_directory):
+                os.rename(self.persist_directory, backup_dir)
+        except PermissionError:
+            print(f"替换向量库失败: '{self.persist_directory}' 中的文件仍被其他进程（如正在运行的API服务）占用，"
+                  f"请关闭该进程后重新运行，构建将从断点继续。")
+            raise
+        os.rename(self.staging_directory, self.persist_directory)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+    @staticmethod
+    def _close_chroma(directory: str, stop: bool = True):
+        """
+        将本进程中打开 directory 的Chroma系统移出Chroma的客户端缓存并停止，之后再打开该目录时会重新读取数据库文件。
+        Chroma按路径在进程内共享系统，这里只移除该路径对应的一个，同一进程中的其他向量库（如其他分片）不受影响。
+
+        这里依赖 SharedSystemClient 的私有属性，因此 requirements.txt 固定了 chromadb 的版本，
+        升级时由 tests/test_chroma_internals.py 检查这些属性是否仍然存在。
+
+        :param stop: 是否立即停止该系统。为False时仍在使用旧客户端的请求可以继续完成，旧系统在不再被引用后释放。
+        """
+        with SharedSystemClient._refcount_lock:
+            system = SharedSystemClient._identifier_to_system.pop(directory, None)
+            SharedSystemClient._identifier_to_refcount.pop(directory, None)
+        if system is not None and stop:
+            system.stop()
+
+    def close_db(self, stop: bool = True):
+        """关闭向量数据库，之后调用 load_db 会重新打开。stop 见 _close_chroma。"""
+        self.db = None
+        self._close_chroma(self.persist_directory, stop)
+
+    @property
+    def build_stamp_path(self) -> str:
+        """向量库构建标记文件的路径。"""
+        return os.path.join(self.persist_directory, self.BUILD_STAMP_FILENAME)
+
+    def _write_build_stamp(self, directory: str = None):
+        """记录本次构建的时间，使问答缓存等依赖方能感知向量库已被重建。"""
+        path = os.path.join(directory, self.BUILD_STAMP_FILENAME) if directory else self.build_stamp_path
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    def _read_build_stamp(self) -> str | None:
+        try:
+            return str(os.stat(self.build_stamp_path).st_mtime_ns)
+        except OSError:
+            return None
+
+    @property
+    def numpy_index_dir(self) -> str:
+        return os.path.join(self.persist_directory, self.NUMPY_INDEX_DIRNAME)
+
+    def export_numpy_index(self, dtype: str = NUMPY_INDEX_DTYPE) -> NumpyVectorIndex:
+        """
+        将Chroma中的全部向量导出为NumPy索引（不调用Embedding API）。
+        索引中记录了导出时向量库的构建标记，向量库更新后会被判定为过期。
+        """
+        print(f"正在导出NumPy向量索引到 '{self.numpy_index_dir}' (精度: {dtype})...")
+        NumpyVectorIndex.build_from_chroma(
+            self.load_db(), self.numpy_index_dir, dtype=dtype,
+            extra_meta={"build_stamp": self._read_build_stamp()}
         )
+        index = NumpyVectorIndex(self.numpy_index_dir, embedding_function=self.embedding_function)
+        print(f"NumPy向量索引导出完成，共 {len(index)} 个文档块。")
+        return index
 
-        print(f"成功为 {len(docs)} 个文档块创建向量数据库。")
-        print("向量数据库创建并持久化成功。")
-        return self.db
+    def load_search_backend(self):
+        """
+        加载问答服务使用的检索后端，由配置项 RETRIEVAL_BACKEND 决定：
+        - "chroma": 直接使用Chroma向量库；
+        - "numpy": 使用内存映射的NumPy索引，索引不存在或已过期时自动从Chroma导出。
+        两者提供相同的检索接口。
+        """
+        if RETRIEVAL_BACKEND != "numpy":
+            return self.load_db()
+
+        meta_path = os.path.join(current_dir(self.numpy_index_dir), NumpyVectorIndex.META_FILENAME)
+        if self._is_index_stale(meta_path):
+            # 增量同步后只需删除和追加变化的行；索引不存在或为空（无法确定向量维度）时全量导出
+            meta = self._read_index_meta(meta_path)
+            return self.update_numpy_index() if meta and meta.get("count") else self.export_numpy_index()
+        print(f"正在从 '{self.numpy_index_dir}' 加载NumPy向量索引...")
+        return NumpyVectorIndex(self.numpy_index_dir, embedding_function=self.embedding_function)
+
+    def update_numpy_index(self) -> NumpyVectorIndex:
+        """按向量库的变化增量更新NumPy索引（见 NumpyVectorIndex.update_from_chroma）。"""
+        print(f"正在增量更新NumPy向量索引 '{self.numpy_index_dir}'...")
+        stamp = self._read_build_stamp()
+        removed, added = NumpyVectorIndex.update_from_chroma(self.numpy_index_dir, self.load_db(), self._chroma_ids(),
+                                                             extra_meta={"build_stamp": stamp})
+        index = NumpyVectorIndex(self.numpy_index_dir, embedding_function=self.embedding_function)
+        print(f"NumPy向量索引更新完成: 删除 {removed} 个、新增 {added} 个文档块，共 {len(index)} 个。")
+        return index
+
+    def _chroma_ids(self, page_size: int = 5000) -> list[str]:
+        """向量库中全部文档块的ID（不读取向量与文本）。"""
+        db = self.load_db()
+        ids = []
+        for offset in range(0, db._collection.count(), page_size):
+            ids.extend(db.get(limit=page_size, offset=offset, include=[])["ids"])
+        return ids
+
+    @property
+    def lexical_index_dir(self) -> str:
+        return os.path.join(self.persist_directory, self.LEXICAL_INDEX_DIRNAME)
+
+    def build_lexical_index(self, page_size: int = 5000) -> LexicalIndex:
+        """从Chroma中读取全部文档块文本，构建BM25倒排索引。"""
+        print(f"正在构建BM25词法索引到 '{self.lexical_index_dir}'...")
+        db = self.load_db()
+        ids, texts, metadatas = [], [], []
+        total = db._collection.count()
+        for offset in range(0, total, page_size):
+            page = db.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            ids.extend(page["ids"])
+            texts.extend(page["documents"])
+            metadatas.extend(page["metadatas"])
+        LexicalIndex.build(self.lexical_index_dir, ids, texts, metadatas,
+                           extra_meta={"build_stamp": self._read_build_stamp()})
+        index = LexicalIndex(self.lexical_index_dir)
+        print(f"BM25词法索引构建完成，共 {len(index)} 个文档块，{index.meta['terms']} 个词。")
+        return index
+
+    def load_lexical_index(self) -> LexicalIndex:
+        """
+        加载BM25词法索引；索引不存在或缺少检索分区（早期版本构建）时重建。向量库已更新时，
+        若索引的分词方式与当前环境相同则只对变化的文档块增量更新，否则重建。
+        """
+        version_dir = current_dir(self.lexical_index_dir)
+        meta_path = os.path.join(version_dir, LexicalIndex.META_FILENAME)
+        meta = self._read_index_meta(meta_path)
+        if meta is None or not os.path.exists(os.path.join(version_dir, PartitionIndex.FILENAME)):
+            return self.build_lexical_index()
+        if self._is_index_stale(meta_path):
+            return self.update_lexical_index() if meta.get("tokenizer") == LEXICAL_TOKENIZER else self.build_lexical_index()
+        print(f"正在从 '{self.lexical_index_dir}' 加载BM25词法索引...")
+        return LexicalIndex(self.lexical_index_dir)
+
+    def update_lexical_index(self) -> LexicalIndex:
+        """按向量库的变化增量更新BM25词法索引（见 LexicalIndex.update）。"""
+        print(f"正在增量更新BM25词法索引 '{self.lexical_index_dir}'...")
+        stamp = self._read_build_stamp()
+        removed, added = LexicalIndex.update(self.lexical_index_dir, self.load_db(), self._chroma_ids(),
+                                             extra_meta={"build_stamp": stamp})
+        index = LexicalIndex(self.lexical_index_dir)
+        print(f"BM25词法索引更新完成: 删除 {removed} 个、新增 {added} 个文档块，共 {len(index)} 个。")
+        return index
+
+    def load_partition_index(self, page_size: int = 5000) -> PartitionIndex:
+        """
+        读取Chroma中全部文档块的元数据并划分检索分区，供Chroma检索后端识别问题中的过滤条件。
+        只使用元数据中实际存储的字段（不由文件名补全），因为Chroma的 where 表达式只能匹配这些字段；
+        早期构建、缺少这些字段的向量库因此不会识别出无法生效的过滤条件。
+        NumPy索引与BM25索引各自维护与其行号对应的分区，不需要调用本方法。
+        """
+        db = self.load_db()
+        metadatas = []
+        for offset in range(0, db._collection.count(), page_size):
+            metadatas.extend(db.get(limit=page_size, offset=offset, include=["metadatas"])["metadatas"])
+        return PartitionIndex.from_metadatas(metadatas, from_source=False)
+
+    def _is_index_stale(self, meta_path: str) -> bool:
+        """派生索引不存在，或其记录的构建标记与当前向量库不一致时视为过期。"""
+        meta = self._read_index_meta(meta_path)
+        return meta is None or meta.get("build_stamp") != self._read_build_stamp()
+
+    @staticmethod
+    def _read_index_meta(meta_path: str) -> dict | None:
+        """读取派生索引的元信息；索引不存在或元信息损坏时返回None。"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def sync(self, chunk_size=500, chunk_overlap=50):
+        """
+        增量同步向量数据库，使其与 processed_dir 中的JSON文件保持一致。
+
+        - 修改时间和大小都未变化的文件直接跳过，不读取内容；
+        - 内容哈希未变化的文件只更新清单中的修改时间；
+        - 新增或内容变化的文件：删除其旧文档块，重新分割并写入新文档块；
+        - 已被删除的文件：删除其所有文档块；
+        - 全量构建时被去重、其规范文档块属于上述文件的文件：重新写入其全部文档块，避免内容丢失。
+        增量写入的文档块不做索引去重。没有清单（如首次运行）时退化为全量构建。
+
+        :return: 向量数据库对象。
+        """
+        manifest = self._load_manifest()
+        if manifest is None:
+            print("未找到向量数据库清单，将执行全量构建。")
+            return self.build_db(chunk_size, chunk_overlap)
+
+        db = self.load_db()
+        source_files = {os.path.relpath(file_path, self.processed_dir): file_path for file_path in self._list_source_files()}
+        to_process = {}  # 相对路径 -> (文件路径, 内容哈希)
+        added_chunks, removed_chunks = 0, 0
+
+        for rel_path, file_path in source_files.items():
+            stat = os.stat(file_path)
+            entry = manifest.get(rel_path)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                continue
+
+            file_hash = self._hash_file(file_path)
+            if entry and entry["hash"] == file_hash:
+                entry.update(mtime=stat.st_mtime, size=stat.st_size)
+                continue
+
+            print(f"检测到{'变化' if entry else '新增'}的文件: {rel_path}")
+            to_process[rel_path] = (file_path, file_hash)
+
+        deleted = set(manifest) - set(source_files)
+        invalidated_ids = {chunk_id for rel_path in (*to_process, *deleted) if rel_path in manifest
+                           for chunk_id in manifest[rel_path]["chunk_ids"]}
+        for rel_path, entry in manifest.items():
+            if rel_path in source_files and rel_path not in to_process and invalidated_ids.intersection(entry.get("duplicates", ())):
+                print(f"文件 {rel_path} 中被去重的文档块依赖于发生变化的文件，将重新写入。")
+                to_process[rel_path] = (source_files[rel_path], entry["hash"])
+        changed_files = len(to_process) + len(deleted)
+
+        for rel_path, (file_path, file_hash) in to_process.items():
+            entry = manifest.get(rel_path)
+            if entry and entry["chunk_ids"]:
+                db.delete(ids=entry["chunk_ids"])
+                removed_chunks += len(entry["chunk_ids"])
+
+            chunks = self.chunk_file_documents(file_path, chunk_size, chunk_overlap)
+            ids, file_manifest = self._assign_chunk_ids(chunks)
+            if chunks:
+                db.add_documents(chunks, ids=ids)
+                added_chunks += len(chunks)
+            manifest[rel_path] = file_manifest.get(rel_path) or self._manifest_entry(file_path, [], file_hash)
+
+        for rel_path in deleted:
+            print(f"检测到已删除的文件: {rel_path}")
+            chunk_ids = manifest.pop(rel_path)["chunk_ids"]
+            if chunk_ids:
+                db.delete(ids=chunk_ids)
+                removed_chunks += len(chunk_ids)
+
+        self._save_manifest(manifest)
+        if changed_files:
+            self._write_build_stamp()
+        print(f"增量同步完成: {changed_files} 个文件发生变化，新增 {added_chunks} 个文档块，删除 {removed_chunks} 个文档块。")
+        return db
+
+    def _list_source_files(self) -> list[str]:
+        """列出 processed_dir 下所有的JSON文件（设置了 source_filter 时只列出满足条件的文件）。"""
+        source_files = []
+        for root, _, files in os.walk(self.processed_dir):
+            source_files.extend(os.path.join(root, name) for name in files if name.endswith(".json"))
+        if self.source_filter is not None:
+            source_files = [path for path in source_files if self.source_filter(os.path.relpath(path, self.processed_dir))]
+        return sorted(source_files)
+
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        """计算文件内容的SHA-256哈希。"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    def _manifest_entry(self, file_path: str, chunk_ids: list, file_hash: str = None) -> dict:
+        stat = os.stat(file_path)
+        return {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": file_hash or self._hash_file(file_path),
+            "chunk_ids": chunk_ids,
+        }
+
+    def _assign_chunk_ids(self, docs):
+        """
+        为文档块分配确定性的ID：由来源文件的相对路径、内容哈希和块序号共同决定，
+        并将ID写入元数据的 'chunk_id' 字段。
+
+        :return: (与docs一一对应的ID列表, {相对路径: 清单条目})
+        """
+        ids = []
+        manifest = {}
+        prefixes = {}
+        for doc in docs:
+            source = doc.metadata.get("source", "")
+            rel_path = os.path.relpath(source, self.processed_dir)
+            if rel_path not in manifest:
+                entry = self._manifest_entry(source, [])
+                prefixes[rel_path] = hashlib.sha1(f"{rel_path}\0{entry['hash']}".encode('utf-8')).hexdigest()[:16]
+                manifest[rel_path] = entry
+            chunk_ids = manifest[rel_path]["chunk_ids"]
+            chunk_id = f"{prefixes[rel_path]}-{len(chunk_ids):05d}"
+            chunk_ids.append(chunk_id)
+            doc.metadata["chunk_id"] = chunk_id
+            ids.append(chunk_id)
+        return ids, manifest
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.persist_directory, self.MANIFEST_FILENAME)
+
+    def _load_manifest(self) -> dict | None:
+        """读取源文件清单；向量库或清单不存在时返回None。"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save_manifest(self, manifest: dict, directory: str = None):
+        directory = directory or self.persist_directory
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, self.MANIFEST_FILENAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
 
     def load_db(self):
         """从持久化目录加载向量数据库。"""
         if self.db is None:
+            backup_dir = self.persist_directory.rstrip(os.sep) + self.BACKUP_SUFFIX
+            if not os.path.exists(self.persist_directory) and os.path.exists(backup_dir):
+                print("检测到上次替换向量库时中断，正在恢复原向量库...")
+                os.rename(backup_dir, self.persist_directory)
             print(f"正在从 '{self.persist_directory}' 加载向量数据库...")
             self.db = Chroma(persist_directory=self.persist_directory, embedding_function=self.embedding_function)
         return self.db
@@ -196,27 +885,47 @@ class KnowledgeBaseManager:
         results = self.db.similarity_search(query, k=k)
         return results
 
-def main():
-    """主函数，用于初始化和测试知识库管理器。"""
+def main(mode: str = "sync", shards: list[int] = None):
+    """
+    主函数，用于初始化和测试知识库管理器。
+
+    :param mode: "full" 清空并全量重建向量数据库；"sync" 仅同步新增、变化和删除的文件。
+    :param shards: 分片模式 (VECTOR_STORE_SHARDS > 1) 下全量重建时只重建这些分片，默认全部。
+    """
     
     # 确保文件夹存在
     os.makedirs(PROCESSED_REPORTS_DIR, exist_ok=True)
     os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
 
-    # 实例化管理器
-    kb_manager = KnowledgeBaseManager()
-
-    # 加载和处理文档
-    documents = kb_manager.load_documents()
-    if not documents:
-        print("在 'data/processed' 目录下没有找到JSON文件。")
-        print("请确保 'pdf_parser.py' 已经成功运行并且生成了JSON文件。")
-        return
-
-    docs = kb_manager.split_documents(documents)
+    if VECTOR_STORE_SHARDS > 1:
+        # 分片模式：各分片是独立的向量库，可以单独重建
+        from core.sharded_store import ShardedKnowledgeBase
+        kb_manager = ShardedKnowledgeBase()
+        results = kb_manager.sync() if mode == "sync" else kb_manager.build_db(shards)
+        if not kb_manager._active_shards():
+            print("在 'data/processed' 目录下没有找到JSON文件。")
+            print("请确保 'pdf_parser.py' 已经成功运行并且生成了JSON文件。")
+            return
+        print(f"分片知识库就绪: {len(kb_manager._active_shards())}/{VECTOR_STORE_SHARDS} 个分片，"
+              f"本次处理 {sum(result is not None for result in results)} 个分片。")
+    else:
+        # 实例化管理器
+        kb_manager = KnowledgeBaseManager()
 
-    # 创建或加载数据库
-    db = kb_manager.create_and_persist_db(docs)
+        if mode == "sync":
+            # 增量同步：只处理新增、变化和删除的文件（首次运行时自动全量构建）
+            db = kb_manager.sync()
+            if db is None:
+                print("在 'data/processed' 目录下没有找到JSON文件。")
+                print("请确保 'pdf_parser.py' 已经成功运行并且生成了JSON文件。")
+                return
+        else:
+            # 流式地加载、分割、向量化并写入数据库
+            db = kb_manager.build_db()
+            if db is None:
+                print("在 'data/processed' 目录下没有找到JSON文件。")
+                print("请确保 'pdf_parser.py' 已经成功运行并且生成了JSON文件。")
+                return
 
     # 执行一个测试查询
     print("\n--- 执行测试查询 ---")
@@ -231,4 +940,11 @@ def main():
 
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    # --- 模式选择 ---
+    # "sync": 增量同步，只处理新增、变化和删除的文件 (首次运行时自动全量构建)
+    # "full": 清空并全量重建向量数据库
+    MODE = "sync"
+    # 分片模式下 "full" 只重建这些分片（如 [0, 2]），None 表示全部
+    REBUILD_SHARDS = None
+    # -----------------
+    main(MODE, REBUILD_SHARDS) 
\ No newline at end of file
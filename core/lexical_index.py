@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+@file: lexical_index.py
+@desc: 基于BM25的词法检索索引。金融问题常依赖精确的词元（如 "688981"、"28nm"、"2025年一季度"），
+       纯向量检索容易漏掉它们。本模块对文档块建立倒排索引（CSR格式的紧凑数组），
+       持久化在向量库目录中，并提供与向量检索结果融合的倒数排名融合 (RRF)。
+"""
+import os
+import re
+import sys
+import json
+import math
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.partitions import PartitionIndex
+from core.versioned_dir import current_dir, new_version_dir, publish
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:  # jieba 为可选依赖，未安装时使用字二元组分词
+    jieba = None
+
+# 当前环境构建索引所用的分词方式，记录在索引元信息中
+TOKENIZER = "jieba" if jieba is not None else "bigram"
+# ASCII词元：数字、字母及其组合，如 688981、28nm、1q25、12.5%
+_ASCII_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.%][a-z0-9]*)*")
+# 连续的中日韩文字
+_CJK_RUN_PATTERN = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str, use_jieba: bool = jieba is not None) -> list[str]:
+    """
+    中文友好的分词：ASCII部分按字母数字串切分；中文部分在安装了jieba时使用搜索引擎模式分词，
+    否则使用字二元组（单字片段保留单字）。
+    """
+    text = text.lower()
+    tokens = _ASCII_TOKEN_PATTERN.findall(text)
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if use_jieba:
+            tokens.extend(word for word in jieba.lcut_for_search(run) if word.strip())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """
+    倒数排名融合：每个结果在各路排名中的得分为 1 / (k + 排名)，累加后降序排列。
+
+    :param rankings: 多路检索结果的ID列表，每路按相关性从高到低排列。
+    :param k: 平滑常数，越大则各路排名靠后的结果权重越接近。
+    :return: [(ID, 融合得分)]，按得分从高到低排列。
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    ARRAYS_FILENAME = "postings.npz"
+    VOCAB_FILENAME = "vocab.json"
+    IDS_FILENAME = "ids.json"
+    META_FILENAME = "index_meta.json"
+
+    def __init__(self, index_dir: str, k1: float = 1.5, b: float = 0.75):
+        """
+        从磁盘加载倒排索引。
+
+        :param index_dir: 索引目录（由 build 生成）。
+        :param k1: BM25的词频饱和参数。
+        :param b: BM25的文档长度归一化参数。
+        """
+        self.index_dir = index_dir
+        # 当前版本所在的目录（见 core.versioned_dir），所有文件都从同一个版本读取
+        self.version_dir = current_dir(index_dir)
+        self.k1, self.b = k1, b
+        with open(os.path.join(self.version_dir, self.META_FILENAME), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(self.version_dir, self.VOCAB_FILENAME), 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        with open(os.path.join(self.version_dir, self.IDS_FILENAME), 'r', encoding='utf-8') as f:
+            self.ids = json.load(f)
+        arrays = np.load(os.path.join(self.version_dir, self.ARRAYS_FILENAME))
+        # 词 t 的倒排表为 doc_ids/term_freqs[offsets[i]:offsets[i+1]]，i 为 t 在词表中的序号
+        self.offsets = arrays["offsets"]
+        self.doc_ids = arrays["doc_ids"]
+        self.term_freqs = arrays["term_freqs"].astype(np.float32)
+        self.doc_lengths = arrays["doc_lengths"].astype(np.float32)
+        self.vocab = vocab
+        self.term_to_index = {term: i for i, term in enumerate(vocab)}
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+        self.partitions = PartitionIndex.load(self.version_dir)
+        self.use_jieba = self.meta.get("tokenizer") == "jieba"
+        if self.use_jieba and jieba is None:
+            print("警告: 词法索引使用jieba分词构建，但当前环境未安装jieba，检索效果会下降。请重建索引或安装jieba。")
+            self.use_jieba = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, index_dir: str, ids: list[str], texts: list[str], metadatas: list[dict] = None,
+              extra_meta: dict = None):
+        """
+        构建倒排索引并写入磁盘。先写入新的版本目录，完成后再原子地切换为当前版本。
+
+        :param ids: 文档块ID列表。
+        :param texts: 与ids一一对应的文档块文本。
+        :param metadatas: 与ids一一对应的元数据，用于划分检索分区。
+        :param extra_meta: 写入索引元信息的附加字段（如向量库的构建标记）。
+        """
+        postings, doc_lengths = cls._count_terms(texts)
+        vocab = sorted(postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for i, term in enumerate(vocab):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(vocab):
+            entries = postings[term]
+            doc_ids[offsets[i]:offsets[i + 1]] = [doc_index for doc_index, _ in entries]
+            term_freqs[offsets[i]:offsets[i + 1]] = [min(count, 65535) for _, count in entries]
+        partitions = PartitionIndex.from_metadatas(metadatas or [{} for _ in ids])
+        cls._save(index_dir, ids, vocab, offsets, doc_ids, term_freqs, doc_lengths, partitions, extra_meta)
+
+    @classmethod
+    def update(cls, index_dir: str, db, chroma_ids: list[str], page_size: int = 5000, extra_meta: dict = None) -> tuple[int, int]:
+        """
+        增量更新已有的索引，使其与Chroma一致：删除已不在向量库中的文档块的倒排记录，只对新增的文档块分词，
+        与保留的倒排记录合并后重新写入。文档块ID由来源文件与内容决定，同一ID的内容不会改变，因此按ID集合的差异即可得到增量。
+        索引须由当前环境的分词方式 (TOKENIZER) 构建。
+
+        :param db: Chroma向量库，用于读取新增文档块的文本与元数据。
+        :param chroma_ids: 向量库中当前的全部文档块ID。
+        :return: (删除的文档块数, 新增的文档块数)
+        """
+        index = cls(index_dir)
+        current = set(chroma_ids)
+        existing = set(index.ids)
+        keep = np.fromiter((chunk_id in current for chunk_id in index.ids), dtype=bool, count=len(index.ids))
+        new_ids, new_texts, new_metadatas = [], [], []
+        missing_ids = [chunk_id for chunk_id in chroma_ids if chunk_id not in existing]
+        for start in range(0, len(missing_ids), page_size):
+            page = db.get(ids=missing_ids[start:start + page_size], include=["documents", "metadatas"])
+            new_ids.extend(page["ids"])
+            new_texts.extend(page["documents"])
+            new_metadatas.extend(page["metadatas"])
+
+        # 保留的倒排记录：文档序号按删除后的位置重新编号
+        raw_term_freqs = np.load(os.path.join(index.version_dir, cls.ARRAYS_FILENAME))["term_freqs"]
+        posting_terms = np.repeat(np.arange(len(index.vocab)), np.diff(index.offsets))
+        kept_postings = keep[index.doc_ids]
+        new_positions = np.cumsum(keep) - 1
+        num_kept = int(keep.sum())
+
+        postings, new_lengths = cls._count_terms(new_texts)
+        vocab = sorted(set(index.vocab[term] for term in np.unique(posting_terms[kept_postings])) | set(postings))
+        term_positions = {term: i for i, term in enumerate(vocab)}
+        old_term_positions = np.array([term_positions.get(term, -1) for term in index.vocab], dtype=np.int64)
+
+        terms = [old_term_positions[posting_terms[kept_postings]]]
+        docs = [new_positions[index.doc_ids[kept_postings]]]
+        freqs = [raw_term_freqs[kept_postings]]
+        for term, entries in postings.items():
+            terms.append(np.full(len(entries), term_positions[term], dtype=np.int64))
+            docs.append(np.array([num_kept + doc_index for doc_index, _ in entries], dtype=np.int64))
+            freqs.append(np.array([min(count, 65535) for _, count in entries], dtype=np.uint16))
+        terms, docs, freqs = np.concatenate(terms), np.concatenate(docs), np.concatenate(freqs)
+        # 按 (词, 文档) 排序，与全量构建的倒排表布局相同
+        order = np.lexsort((docs, terms))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(terms, minlength=len(vocab)))
+
+        ids = [chunk_id for chunk_id, kept in zip(index.ids, keep) if kept] + new_ids
+        doc_lengths = np.concatenate([index.doc_lengths[keep].astype(np.int32), new_lengths])
+        partitions = PartitionIndex.concat([index.partitions.take(np.flatnonzero(keep)),
+                                            PartitionIndex.from_metadatas(new_metadatas)])
+        cls._save(index_dir, ids, vocab, offsets, docs[order].astype(np.int32), freqs[order], doc_lengths,
+                  partitions, extra_meta)
+        return len(index.ids) - num_kept, len(new_ids)
+
+    @staticmethod
+    def _count_terms(texts: list[str]) -> tuple[dict, np.ndarray]:
+        """对文档块分词，返回 ({词: [(文档序号, 词频)]}, 各文档块的词数)。"""
+        postings = defaultdict(list)
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for doc_index, text in enumerate(texts):
+            counts = Counter(tokenize(text or ""))
+            doc_lengths[doc_index] = sum(counts.values())
+            for term, count in counts.items():
+                postings[term].append((doc_index, count))
+        return postings, doc_lengths
+
+    @classmethod
+    def _save(cls, index_dir: str, ids: list[str], vocab: list[str], offsets, doc_ids, term_freqs, doc_lengths,
+              partitions: PartitionIndex, extra_meta: dict = None):
+        """将倒排表写入磁盘。先写入新的版本目录，完成后再原子地切换为当前版本（见 core.versioned_dir）。"""
+        version_dir = new_version_dir(index_dir)
+        np.savez(os.path.join(version_dir, cls.ARRAYS_FILENAME),
+                 offsets=offsets, doc_ids=doc_ids, term_freqs=term_freqs, doc_lengths=doc_lengths)
+        with open(os.path.join(version_dir, cls.VOCAB_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(version_dir, cls.IDS_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(list(ids), f, ensure_ascii=False)
+        partitions.save(version_dir)
+        with open(os.path.join(version_dir, cls.META_FILENAME), 'w', encoding='utf-8') as f:
+            meta = {"count": len(ids), "terms": len(vocab), "tokenizer": TOKENIZER}
+            json.dump({**meta, **(extra_meta or {})}, f, ensure_ascii=False)
+        publish(index_dir, version_dir)
+
+    def search(self, query: str, k: int = 20, filters: dict = None) -> list[tuple[str, float]]:
+        """
+        BM25检索。
+
+        :param query: 查询文本。
+        :param k: 返回的结果数量。
+        :param filters: 可选的过滤条件（见 core.partitions），提供时只返回匹配分区内的文档块。
+        :return: [(文档块ID, BM25得分)]，按得分从高到低排列；没有任何词命中时返回空列表。
+        """
+        rows = self.partitions.rows(filters)
+        if not self.ids or k <= 0 or (rows is not None and not len(rows)):
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        num_docs = len(self.ids)
+        for term in set(tokenize(query, self.use_jieba)):
+            term_index = self.term_to_index.get(term)
+            if term_index is None:
+                continue
+            start, end = self.offsets[term_index], self.offsets[term_index + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            df = end - start
+            idf = math.log((num_docs - df + 0.5) / (df + 0.5) + 1.0)
+            length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+            # 同一个词在一个文档中只有一条倒排记录，因此可以直接按下标累加
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + length_norm)
+
+        matched = np.flatnonzero(scores) if rows is None else rows[scores[rows] > 0]
+        if not len(matched):
+            return []
+        k = min(k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
@@ -7,58 +7,125 @@
 """
 import os
 import sys
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 # 将项目根目录添加到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import dashscope
 from http import HTTPStatus
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
-from config import DASHSCOPE_API_KEY, RERANK_MODEL_NAME, EMBEDDING_MODEL_NAME, GENERATION_MODEL_NAME
+from config import (DASHSCOPE_API_KEY, RERANK_MODEL_NAME, EMBEDDING_MODEL_NAME, GENERATION_MODEL_NAME,
+                    LLM_MAX_CONCURRENCY, DASHSCOPE_USE_POOLED_HTTP)
+from core.metrics import record_tokens
+from core.dashscope_client import DashScopeRESTClient
+
+class DashScopeAPIError(Exception):
+    """DashScope API 返回非200状态时抛出的异常，保留状态码与错误码以便调用方判断是否为限流。"""
+    def __init__(self, status_code, code, message):
+        super().__init__(f"{status_code} {code} - {message}")
+        self.status_code = status_code
+        self.code = code or ""
+        self.message = message
+
+    @property
+    def is_throttling(self) -> bool:
+        """是否为限流响应 (HTTP 429 或 Throttling.* 错误码)。"""
+        return self.status_code == HTTPStatus.TOO_MANY_REQUESTS or self.code.startswith("Throttling")
+
 
 class QwenLLM:
-    def __init__(self, api_key=DASHSCOPE_API_KEY):
+    def __init__(self, api_key=DASHSCOPE_API_KEY, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 use_pooled_http: bool = DASHSCOPE_USE_POOLED_HTTP):
         """
         初始化QwenLLM服务。
+
+        :param api_key: 通义千问API Key。
+        :param max_concurrency: 异步接口允许同时在途的最大API调用数。
+        :param use_pooled_http: 是否通过共享连接池直接调用REST接口（否则使用dashscope SDK，每次调用新建连接）。
         """
         if api_key:
             dashscope.api_key = api_key
         else:
             raise ValueError("通义千问API Key未设置, 请在config.py中配置")
+        # 两者提供相同的 TextEmbedding / TextReRank / Generation 调用方式
+        self.api = DashScopeRESTClient(api_key) if use_pooled_http else dashscope
 
-    def get_rerank_documents(self, query: str, documents: list[str], top_n: int = 3) -> list[str]:
+        # dashscope SDK 只提供阻塞式调用，异步接口通过一个有界线程池执行这些调用，
+        # 线程池大小即为并发上限，超出的请求会在池内排队而不会阻塞事件循环。
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="qwen-llm")
+
+    async def arun(self, func, *args, **kwargs):
+        """
+        在有界线程池中执行一个阻塞函数，并以协程的方式等待其结果。
+
+        :param func: 需要执行的阻塞函数（如API调用或向量检索）。
+        :return: 函数的返回值。
+        """
+        loop = asyncio.get_running_loop()
+        # 复制当前上下文，使线程中的耗时记录 (core.metrics) 归属到发起调用的请求
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args, **kwargs))
+
+    def close(self):
+        """释放异步调用所使用的线程池。"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_rerank_results(self, query: str, documents: list[str], top_n: int = 3) -> list[tuple[int, float | None]]:
         """
         使用通义千问的rerank API对文档列表进行重排。
-        现在将实际调用API，而不是禁用它。
+
+        :param query: 查询文本。
+        :param documents: 待重排的文档文本列表。
+        :param top_n: 返回的文档数量。
+        :return: [(文档在documents中的下标, 相关性得分)]，按相关性从高到低排列。
+                 API失败时按原顺序返回前 top_n 个下标，得分为None。
         """
         if not documents:
             return []
-            
+
+        fallback = [(i, None) for i in range(min(top_n, len(documents)))]
         try:
             # 使用在config.py中定义的RERANK_MODEL_NAME
-            resp = dashscope.TextReRank.call(
+            resp = self.api.TextReRank.call(
                 model=RERANK_MODEL_NAME,
                 query=query,
                 documents=documents,
                 top_n=top_n
             )
-            
+
             # 调试日志：打印API原始返回
             # print(f"--- Rerank API Response ---\n{resp}\n--------------------------")
 
             if resp.status_code == HTTPStatus.OK:
-                # 最终解决方案：利用返回的index直接从原始documents列表中重构排序后的列表
-                reranked_indices = [item.index for item in resp.output.results]
-                reranked_docs = [documents[i] for i in reranked_indices]
-                return reranked_docs
+                # 直接返回API给出的下标与得分，调用方按下标取回原始文档，无需再按文本匹配
+                return [(item.index, item.relevance_score) for item in resp.output.results]
             else:
                 print(f"错误: 调用Rerank API失败: {resp.code} - {resp.message}")
                 # 在API失败时，返回原始文档的前 top_n 个作为备用
-                return documents[:top_n]
+                return fallback
         except Exception as e:
             print(f"调用Rerank API时发生异常: {e}")
             # 在发生异常时，也返回原始文档的前 top_n 个作为备用
-            return documents[:top_n]
+            return fallback
+
+    def get_rerank_documents(self, query: str, documents: list[str], top_n: int = 3) -> list[str]:
+        """
+        对文档列表进行重排，只返回重排后的文档文本。
+        """
+        return [documents[i] for i, _ in self.get_rerank_results(query, documents, top_n=top_n)]
+
+    async def aget_rerank_results(self, query: str, documents: list[str], top_n: int = 3) -> list[tuple[int, float | None]]:
+        """get_rerank_results 的异步版本。"""
+        return await self.arun(self.get_rerank_results, query, documents, top_n=top_n)
+
+    async def aget_rerank_documents(self, query: str, documents: list[str], top_n: int = 3) -> list[str]:
+        """get_rerank_documents 的异步版本。"""
+        return await self.arun(self.get_rerank_documents, query, documents, top_n=top_n)
 
     def get_text_embedding(self, text: str):
         """
@@ -68,7 +135,7 @@ class QwenLLM:
         :return: 文本的embedding向量，或在失败时返回None
         """
         try:
-            resp = dashscope.TextEmbedding.call(
+            resp = self.api.TextEmbedding.call(
                 model=EMBEDDING_MODEL_NAME,
                 input=text
             )
@@ -82,33 +149,33 @@ class QwenLLM:
             print(f"调用Embedding API时发生异常: {e}")
             return None
 
-    @retry(
-        wait=wait_exponential(min=1, max=10),  # 等待时间指数增长，1s到10s
-        stop=stop_after_attempt(3),  # 最多重试3次
-        retry=retry_if_exception_type(Exception)  # 任何Exception都重试
-    )
-    def get_text_embeddings_batch(self, texts: list[str]) -> list[list[float]] | None:
+    async def aget_text_embedding(self, text: str):
+        """get_text_embedding 的异步版本。"""
+        return await self.arun(self.get_text_embedding, text)
+
+    def get_text_embeddings_batch(self, texts: list[str]) -> list[list[float]]:
         """
-        获取批量文本的embedding向量。增加了重试机制。
+        获取批量文本的embedding向量。
+        本方法不做重试，失败时直接抛出异常，重试与限流退避由调用方（如EmbeddingBatchScheduler）统一负责，
+        避免多层重试叠加导致最坏情况下的等待时间成倍增长。
 
         :param texts: 输入文本列表
-        :return: 文本的embedding向量列表，或在失败时返回None
+        :return: 文本的embedding向量列表
+        :raises DashScopeAPIError: API返回非200状态（包括限流）时
         """
-        try:
-            resp = dashscope.TextEmbedding.call(
-                model=EMBEDDING_MODEL_NAME,
-                input=texts
-            )
-            if resp.status_code == HTTPStatus.OK:
-                # 提取所有embedding向量
-                embeddings = [record['embedding'] for record in resp.output['embeddings']]
-                return embeddings
-            else:
-                print(f"通义千问Embedding API批量调用失败: {resp.code} - {resp.message}")
-                return None
-        except Exception as e:
-            print(f"调用Embedding API批量接口时发生异常: {e}")
-            raise  # 重新抛出异常以触发tenacity的重试
+        resp = self.api.TextEmbedding.call(
+            model=EMBEDDING_MODEL_NAME,
+            input=texts
+        )
+        if resp.status_code != HTTPStatus.OK:
+            raise DashScopeAPIError(resp.status_code, resp.code, resp.message)
+        # 按text_index排序，确保结果顺序与输入一致
+        records = sorted(resp.output['embeddings'], key=lambda record: record.get('text_index', 0))
+        return [record['embedding'] for record in records]
+
+    async def aget_text_embeddings_batch(self, texts: list[str]) -> list[list[float]]:
+        """get_text_embeddings_batch 的异步版本。"""
+        return await self.arun(self.get_text_embeddings_batch, texts)
 
     def get_chat_completion(self, prompt: str, system_prompt: str = "You are a helpful assistant."):
         """
@@ -123,13 +190,14 @@ class QwenLLM:
             {'role': 'user', 'content': prompt}
         ]
         try:
-            response = dashscope.Generation.call(
+            response = self.api.Generation.call(
                 model=GENERATION_MODEL_NAME,
                 messages=messages,
                 result_format='message',  # 设置返回格式为message
             )
 
             if response.status_code == HTTPStatus.OK:
+                record_tokens(getattr(response, "usage", None))
                 return response.output.choices[0].message.content
             else:
                 print(f"通义千问Generation API调用失败: {response.code} - {response.message}")
@@ -138,6 +206,75 @@ class QwenLLM:
             print(f"调用Generation API时发生异常: {e}")
             return ""
 
+    async def aget_chat_completion(self, prompt: str, system_prompt: str = "You are a helpful assistant."):
+        """get_chat_completion 的异步版本。"""
+        return await self.arun(self.get_chat_completion, prompt, system_prompt=system_prompt)
+
+    def get_chat_completion_stream(self, prompt: str, system_prompt: str = "You are a helpful assistant."):
+        """
+        以流式方式获取大模型的文本生成结果。
+
+        :param prompt: 用户输入或组合后的prompt
+        :param system_prompt: 系统级指令
+        :return: 一个生成器，逐个产出模型新生成的文本片段；失败时提前结束
+        """
+        messages = [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': prompt}
+        ]
+        try:
+            responses = self.api.Generation.call(
+                model=GENERATION_MODEL_NAME,
+                messages=messages,
+                result_format='message',
+                stream=True,
+                incremental_output=True,  # 每次只返回新增的内容，而不是累计的全文
+            )
+            usage = None
+            for response in responses:
+                if response.status_code != HTTPStatus.OK:
+                    print(f"通义千问Generation API流式调用失败: {response.code} - {response.message}")
+                    return
+                # 每个片段的usage都是截至当前的累计用量，只需记录最后一个
+                usage = getattr(response, "usage", None) or usage
+                delta = response.output.choices[0].message.content
+                if delta:
+                    yield delta
+            record_tokens(usage)
+        except Exception as e:
+            print(f"调用Generation API流式接口时发生异常: {e}")
+
+    async def aget_chat_completion_stream(self, prompt: str, system_prompt: str = "You are a helpful assistant."):
+        """
+        get_chat_completion_stream 的异步版本。
+        同步的流式迭代在线程池中执行，产出的文本片段经由队列转交给事件循环。
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        finished = object()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for delta in self.get_chat_completion_stream(prompt, system_prompt=system_prompt):
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        producer = loop.run_in_executor(self._executor, contextvars.copy_context().run, produce)
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is finished:
+                    break
+                yield delta
+        finally:
+            # 客户端断开时通知生产线程尽早停止，释放线程池中的位置
+            cancelled.set()
+            await producer
+
 if __name__ == '__main__':
     # 简单测试
     llm = QwenLLM()
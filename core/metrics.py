@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+@file: metrics.py
+@desc: 问答流程的分阶段耗时与计数指标。
+       每个请求的耗时记录在一个 RequestTimings 对象中，通过 contextvars 在协程与线程池之间传递，
+       可用于生成 Server-Timing 响应头；同时所有阶段的耗时汇总到进程级的直方图中，
+       以Prometheus文本格式在 /metrics 接口输出。
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 单位为秒的直方图分桶，覆盖从毫秒级的向量检索到数十秒的LLM生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """线程安全的Prometheus风格直方图（支持标签）。"""
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # 标签值元组 -> [各分桶计数, 总和, 总数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.setdefault(label_values, [[0] * len(self.buckets), 0.0, 0])
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (bucket_counts, total, count) in sorted(self._series.items()):
+                labels = _format_labels(self.label_names, label_values)
+                for upper, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(self.label_names, label_values, le=upper)} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, label_values, le="+Inf")} {count}')
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    """线程安全的Prometheus风格计数器（支持标签）。"""
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+def _format_labels(label_names: tuple, label_values: tuple, le=None) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+STAGE_DURATION = Histogram("rag_stage_duration_seconds", "问答流程各阶段的耗时（秒）", ("stage",))
+REQUEST_DURATION = Histogram("rag_request_duration_seconds", "单个问答请求的总耗时（秒）", ("endpoint",))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "生成模型消耗的Token数", ("type",))
+CACHE_LOOKUPS = Counter("rag_answer_cache_lookups_total", "问答缓存的查询次数", ("result",))
+COALESCED_REQUESTS = Counter("rag_coalesced_requests_total", "合并到相同的在途请求、未单独执行流程的请求数")
+CONTEXT_TOKENS_SAVED = Counter("rag_context_tokens_saved_total", "上下文打包（去重与Token预算）节省的输入Token数（估算）")
+CONTEXT_CHUNKS_DROPPED = Counter("rag_context_chunks_dropped_total", "上下文打包剔除的文档块数", ("reason",))
+_METRICS = (STAGE_DURATION, REQUEST_DURATION, LLM_TOKENS, CACHE_LOOKUPS, COALESCED_REQUESTS,
+            CONTEXT_TOKENS_SAVED, CONTEXT_CHUNKS_DROPPED)
+
+
+class RequestTimings:
+    """
+    单个请求的分阶段耗时与计数。
+    对象本身是可变的，线程池中的任务拿到的是同一个对象，记录的数据对请求方可见。
+    """
+    def __init__(self):
+        self.stages = {}  # 阶段名 -> 累计耗时（秒），按首次出现的顺序排列
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_result = None  # "exact" / "semantic" / "miss"，未启用缓存时为None
+        self.coalesced = False  # 是否复用了相同的在途请求的结果
+        self.context_tokens_saved = 0  # 上下文打包节省的输入Token数（估算）
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_tokens(self, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def add_context_tokens_saved(self, tokens: int):
+        with self._lock:
+            self.context_tokens_saved += tokens
+
+    def server_timing(self) -> str:
+        """生成 Server-Timing 响应头的值，耗时单位为毫秒。"""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        if self.cache_result is not None:
+            entries.append(f'cache;desc="{self.cache_result}"')
+        if self.coalesced:
+            entries.append("coalesced")
+        if self.context_tokens_saved:
+            entries.append(f'context;desc="saved {self.context_tokens_saved} tokens"')
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache": self.cache_result,
+            "coalesced": self.coalesced,
+            "context_tokens_saved": self.context_tokens_saved,
+        }
+
+
+_current_timings: contextvars.ContextVar[RequestTimings | None] = contextvars.ContextVar("rag_request_timings", default=None)
+
+
+def current_timings() -> RequestTimings | None:
+    return _current_timings.get()
+
+
+@contextmanager
+def track_request(endpoint: str):
+    """
+    为一个请求开启耗时记录，在此上下文内（包括经由 QwenLLM.arun 提交到线程池的任务）
+    调用的 span 都会记录到返回的 RequestTimings 中。
+    """
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.add_stage("total", time.perf_counter() - start)
+        REQUEST_DURATION.observe(timings.stages["total"], endpoint)
+        _current_timings.reset(token)
+
+
+@contextmanager
+def span(stage: str):
+    """记录一个阶段的耗时：写入当前请求的 RequestTimings（如有）与全局直方图。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add_stage(stage, elapsed)
+
+
+def record_tokens(usage):
+    """记录一次生成调用的Token用量（DashScope响应中的 usage 字段）。"""
+    if not usage:
+        return
+    input_tokens = usage.get("input_tokens", 0) or 0
+    output_tokens = usage.get("output_tokens", 0) or 0
+    LLM_TOKENS.inc(input_tokens, "input")
+    LLM_TOKENS.inc(output_tokens, "output")
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add_tokens(input_tokens, output_tokens)
+
+
+def record_cache_lookup(result: str):
+    """记录一次问答缓存查询的结果："exact"、"semantic" 或 "miss"。"""
+    CACHE_LOOKUPS.inc(1, result)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.cache_result = result
+
+
+def record_coalesced():
+    """记录一次被合并到在途请求的调用。"""
+    COALESCED_REQUESTS.inc(1)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.coalesced = True
+
+
+def record_context_packing(stats):
+    """记录一次上下文打包的结果（context_packer.PackStats）。"""
+    CONTEXT_TOKENS_SAVED.inc(stats.tokens_saved)
+    CONTEXT_CHUNKS_DROPPED.inc(stats.duplicates_removed, "duplicate")
+    CONTEXT_CHUNKS_DROPPED.inc(stats.over_budget, "over_budget")
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add_context_tokens_saved(stats.tokens_saved)
+
+
+def render_metrics() -> str:
+    """以Prometheus文本格式输出所有指标。"""
+    return "\n".join(line for metric in _METRICS for line in metric.render()) + "\n"
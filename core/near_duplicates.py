@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+@file: near_duplicates.py
+@desc: 构建索引时的近似重复文档块检测（MinHash + LSH）。
+       研报中的免责声明、页眉页脚等样板内容会在向量库中重复成百上千次，既占用存储、拖慢检索，
+       又会挤占 top_k 的名额。每个文档块计算字符 n-gram 的MinHash签名，经LSH分桶找出候选，
+       估算的Jaccard相似度达到阈值、且包含的数字完全一致时判定为重复（避免合并仅关键数据不同的文档块）。
+"""
+import re
+import zlib
+
+import numpy as np
+
+# 签名计算前去除的字符：空白与常见的中英文标点
+_NOISE_PATTERN = re.compile(r"[\s\u3000-\u303f\uff00-\uff0f\uff1a-\uff20,.;:!?'\"()\[\]{}<>/\\|_\-]+")
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+_HASH_SHIFT = np.uint64(32)
+
+
+def normalize_text(text: str) -> str:
+    """计算指纹前的文本规范化：转为小写并去除空白与标点，使仅排版不同的文本得到相同的特征。"""
+    return _NOISE_PATTERN.sub("", text.lower())
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 42):
+        """
+        :param num_perm: 签名长度（哈希函数个数）。
+        :param shingle_size: 字符 n-gram 的长度。
+        :param seed: 生成哈希函数参数的随机种子，同一索引内必须保持不变。
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # multiply-shift 哈希族：h(x) = (a * x + b) >> 32，a 为奇数，uint64 运算自然溢出
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        normalized = normalize_text(text)
+        size = self.shingle_size
+        shingles = {normalized[i:i + size] for i in range(max(len(normalized) - size + 1, 1))}
+        return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str) -> np.ndarray:
+        """返回形如 (num_perm,) 的 uint32 签名。"""
+        hashes = self._shingles(text)
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> _HASH_SHIFT
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """增量式的近似重复检测：依次加入文档块，返回与之重复的、先加入的规范文档块。"""
+    def __init__(self, threshold: float = 0.9, num_perm: int = 64, bands: int = 8):
+        """
+        :param threshold: 判定为重复所需的最小Jaccard相似度（按签名估算）。
+        :param num_perm: MinHash签名长度，需能被 bands 整除。
+        :param bands: LSH的分段数。每段 num_perm / bands 行，任意一段完全相同即成为候选；
+                      默认 64/8 时，相似度0.9的文档块被召回为候选的概率约为99%。
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets = {}     # (段序号, 段内容) -> [规范文档块的键]
+        self._signatures = {}  # 规范文档块的键 -> 签名
+        self._numbers = {}     # 规范文档块的键 -> 文中出现的数字
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def add(self, key, text: str):
+        """
+        加入一个文档块。
+
+        :return: 若与已加入的某个文档块近似重复，返回该文档块的键（此文档块本身不会加入索引）；否则返回None。
+        """
+        signature = self.hasher.signature(text)
+        numbers = tuple(_NUMBER_PATTERN.findall(text))
+        band_keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+        checked = set()
+        for band_key in band_keys:
+            for candidate in self._buckets.get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if self._numbers[candidate] == numbers and \
+                        np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+
+        self._signatures[key] = signature
+        self._numbers[key] = numbers
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        return None
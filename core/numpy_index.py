@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+@file: numpy_index.py
+@desc: 进程内的NumPy向量索引。所有文档块的向量预先归一化后存放在一个连续的
+       float32/float16 矩阵文件中，以内存映射方式加载；一次查询只需一次矩阵-向量乘法
+       加 argpartition 即可得到top-k。对外提供与 LangChain Chroma 相同的检索接口，
+       可直接替换 QAService 使用的向量库对象。
+       加载时按元数据划分检索分区 (PartitionIndex)，带过滤条件的查询只对分区内的行计算相似度。
+       索引以版本目录的形式写入并原子切换（见 core.versioned_dir）。
+"""
+import os
+import sys
+import json
+
+import numpy as np
+from langchain.schema import Document
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.partitions import PartitionIndex
+from core.versioned_dir import current_dir, new_version_dir, publish
+
+# 对float16矩阵分块计算时每块的行数，避免一次性将整个矩阵转换为float32
+_SCORE_CHUNK_ROWS = 4096
+
+
+class NumpyVectorIndex:
+    EMBEDDINGS_FILENAME = "embeddings.npy"
+    DOCUMENTS_FILENAME = "documents.jsonl"
+    META_FILENAME = "index_meta.json"
+
+    def __init__(self, index_dir: str, embedding_function=None):
+        """
+        从磁盘加载索引。
+
+        :param index_dir: 索引目录（由 build 或 build_from_chroma 生成）。
+        :param embedding_function: 用于将查询文本转换为向量的Embedding对象（需提供 embed_query）。
+        """
+        self.index_dir = index_dir
+        self.embedding_function = embedding_function
+        # 只解析一次当前版本，之后的文件都从同一个版本目录读取
+        version_dir = current_dir(index_dir)
+        with open(os.path.join(version_dir, self.META_FILENAME), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        # 以只读内存映射方式打开，多个进程可共享同一份页缓存
+        self.embeddings = np.load(os.path.join(version_dir, self.EMBEDDINGS_FILENAME), mmap_mode='r')
+
+        self.ids, self.texts, self.metadatas = [], [], []
+        with open(os.path.join(version_dir, self.DOCUMENTS_FILENAME), 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.texts.append(record["page_content"])
+                self.metadatas.append(record["metadata"])
+        self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.partitions = PartitionIndex.from_metadatas(self.metadatas)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- 构建 ---
+    @classmethod
+    def build(cls, index_dir: str, ids: list[str], texts: list[str], metadatas: list[dict],
+              embeddings, dtype: str = "float32", extra_meta: dict = None):
+        """
+        由内存中的数据构建索引。
+
+        :param embeddings: 形如 (n, dim) 的向量数组或列表。
+        :param dtype: 向量的存储精度，"float32" 或 "float16"（体积减半，精度损失对检索影响很小）。
+        :param extra_meta: 写入索引元信息的附加字段（如向量库的构建标记）。
+        """
+        writer = _IndexWriter(index_dir, len(ids), len(embeddings[0]) if len(ids) else 0, dtype)
+        writer.write(ids, texts, metadatas, embeddings)
+        writer.close(extra_meta)
+
+    @classmethod
+    def build_from_chroma(cls, db, index_dir: str, dtype: str = "float32",
+                          page_size: int = 5000, extra_meta: dict = None):
+        """
+        从已有的Chroma向量库导出索引，直接复用库中的向量，不会调用Embedding API。
+        数据按页读取并写入内存映射文件，导出过程的内存占用与向量库大小无关。
+        """
+        total = db._collection.count()
+        dim = 0
+        if total:
+            first = db.get(limit=1, include=["embeddings"])
+            dim = len(first["embeddings"][0])
+        writer = _IndexWriter(index_dir, total, dim, dtype)
+        for offset in range(0, total, page_size):
+            page = db.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            writer.write(page["ids"], page["documents"], page["metadatas"], page["embeddings"])
+        writer.close(extra_meta)
+
+    @classmethod
+    def update_from_chroma(cls, index_dir: str, db, chroma_ids: list[str], page_size: int = 5000,
+                           extra_meta: dict = None) -> tuple[int, int]:
+        """
+        增量更新已有的（非空）索引，使其与Chroma一致：删除已不在向量库中的行，
+        只从Chroma读取新增文档块的向量追加到末尾，其余行直接从旧索引复制。
+        文档块ID由来源文件与内容决定，同一ID的内容不会改变，因此按ID集合的差异即可得到增量。
+
+        :param chroma_ids: 向量库中当前的全部文档块ID。
+        :return: (删除的行数, 新增的行数)
+        """
+        index = cls(index_dir)
+        current = set(chroma_ids)
+        keep_rows = [row for row, chunk_id in enumerate(index.ids) if chunk_id in current]
+        new_ids = [chunk_id for chunk_id in chroma_ids if chunk_id not in index._id_to_row]
+        removed = len(index) - len(keep_rows)
+
+        writer = _IndexWriter(index_dir, len(keep_rows) + len(new_ids), index.embeddings.shape[1], index.meta["dtype"])
+        for start in range(0, len(keep_rows), page_size):
+            rows = keep_rows[start:start + page_size]
+            writer.write([index.ids[row] for row in rows], [index.texts[row] for row in rows],
+                         [index.metadatas[row] for row in rows], index.embeddings[rows])
+        for start in range(0, len(new_ids), page_size):
+            page = db.get(ids=new_ids[start:start + page_size], include=["embeddings", "documents", "metadatas"])
+            writer.write(page["ids"], page["documents"], page["metadatas"], page["embeddings"])
+        # 先释放旧索引的内存映射，旧版本目录在之后的切换中才能被删除
+        del index
+        writer.close(extra_meta)
+        return removed, len(new_ids)
+
+    # --- 检索（与 LangChain Chroma 的接口保持一致） ---
+    def similarity_search_with_score(self, query: str, k: int = 4, filters: dict = None, **kwargs) -> list[tuple[Document, float]]:
+        query_embedding = self.embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(query_embedding, k=k, filters=filters)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filters: dict = None,
+                                                          **kwargs) -> list[tuple[Document, float]]:
+        """
+        返回与给定向量最相似的k个文档及其距离。
+        距离为归一化向量间的平方L2距离 (2 - 2·cos)，与Chroma默认的度量一致：越小越相似。
+        """
+        return self.similarity_search_by_vectors_with_relevance_scores([embedding], k=k, filters=filters)[0]
+
+    def similarity_search_by_vectors_with_relevance_scores(self, embeddings, k: int = 4,
+                                                           filters: dict = None) -> list[list[tuple[Document, float]]]:
+        """
+        批量检索：m 个查询向量与整个矩阵只做一次 (n, dim) x (dim, m) 的矩阵乘法。
+
+        :param filters: 可选的过滤条件 ({字段: 取值或取值列表}，见 core.partitions)，
+                        提供时只对匹配分区内的行计算相似度。
+        :return: 与embeddings一一对应的 [(Document, 距离)] 列表。
+        """
+        rows = self.partitions.rows(filters)
+        if not len(self.ids) or k <= 0 or (rows is not None and not len(rows)):
+            return [[] for _ in embeddings]
+        query_matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(query_matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        similarities = self._similarities((query_matrix / norms).T, rows)
+        k = min(k, len(similarities))
+
+        results = []
+        for column in similarities.T:
+            # argpartition 在O(n)内找出top-k，之后只需对这k个结果排序
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            results.append([
+                (self._document(index if rows is None else rows[index]), float(2.0 - 2.0 * column[index]))
+                for index in top
+            ])
+        return results
+
+    def get(self, ids: list[str] = None, include: list[str] = None, **kwargs) -> dict:
+        """按ID取回文档，返回结构与 Chroma.get 相同。"""
+        rows = range(len(self.ids)) if ids is None else [self._id_to_row[i] for i in ids if i in self._id_to_row]
+        include = include or ["documents", "metadatas"]
+        result = {"ids": [self.ids[row] for row in rows]}
+        result["documents"] = [self.texts[row] for row in rows] if "documents" in include else None
+        result["metadatas"] = [self.metadatas[row] for row in rows] if "metadatas" in include else None
+        result["embeddings"] = [self.embeddings[row].astype(np.float32).tolist() for row in rows] if "embeddings" in include else None
+        return result
+
+    def _similarities(self, query_matrix: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        返回形如 (n, m) 的相似度矩阵，query_matrix 的每一列为一个归一化的查询向量。
+        提供 rows 时只计算这些行（n = len(rows)），结果的第 i 行对应 rows[i]。
+        """
+        num_rows = len(self.embeddings) if rows is None else len(rows)
+
+        def block(start: int, end: int) -> np.ndarray:
+            # 按行号取子集时只读取分区内的行
+            return self.embeddings[start:end] if rows is None else self.embeddings[rows[start:end]]
+
+        if self.embeddings.dtype == np.float32:
+            return block(0, num_rows) @ query_matrix
+        # float16没有BLAS加速，分块转换为float32后计算，内存占用只与块大小有关
+        return np.concatenate([
+            block(start, start + _SCORE_CHUNK_ROWS).astype(np.float32) @ query_matrix
+            for start in range(0, num_rows, _SCORE_CHUNK_ROWS)
+        ])
+
+    def _document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+
+
+class _IndexWriter:
+    """
+    将数据分批写入一个新的版本目录，全部完成后再原子地切换为当前版本，
+    避免读取方看到写了一半的索引。
+    """
+    def __init__(self, index_dir: str, total: int, dim: int, dtype: str):
+        self.index_dir = index_dir
+        self.version_dir = new_version_dir(index_dir)
+        self.total, self.dim, self.dtype = total, dim, dtype
+        self._row = 0
+        self._matrix = np.lib.format.open_memmap(
+            os.path.join(self.version_dir, NumpyVectorIndex.EMBEDDINGS_FILENAME),
+            mode='w+', dtype=np.dtype(dtype), shape=(total, dim)
+        )
+        self._documents = open(os.path.join(self.version_dir, NumpyVectorIndex.DOCUMENTS_FILENAME), 'w', encoding='utf-8')
+
+    def write(self, ids, texts, metadatas, embeddings):
+        if not len(ids):
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._matrix[self._row:self._row + len(ids)] = vectors / norms
+        self._row += len(ids)
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            self._documents.write(json.dumps({"id": chunk_id, "page_content": text, "metadata": metadata or {}}, ensure_ascii=False) + "\n")
+
+    def close(self, extra_meta: dict = None):
+        self._matrix.flush()
+        del self._matrix
+        self._documents.close()
+        with open(os.path.join(self.version_dir, NumpyVectorIndex.META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({"count": self._row, "dim": self.dim, "dtype": self.dtype, **(extra_meta or {})}, f, ensure_ascii=False)
+        publish(self.index_dir, self.version_dir)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+@file: partitions.py
+@desc: 按元数据预先划分的检索分区。许多问题只针对某家券商或某一期研报（如"光大证券认为……"、
+       "2024年年度报告中……"），在全库中检索再事后过滤既浪费算力，又会让无关研报挤占 top_k 的名额。
+       本模块按来源研报、券商、报告期与元素类型记录每个分区包含的行号，检索时只对匹配分区内的向量打分，
+       耗时与分区大小而非语料规模成正比；并提供从问题文本中自动识别券商与报告期的过滤条件。
+"""
+import os
+import re
+import json
+from collections import defaultdict
+
+import numpy as np
+
+# 支持过滤的元数据字段
+PARTITION_FIELDS = ("report", "broker", "report_year", "report_period", "chunk_type")
+# 取值为整数的字段，其余字段均为字符串
+_INT_FIELDS = {"report_year"}
+
+# 文件名开头的券商名称，如 "【光大证券】中芯国际2025年一季度点评"
+_BROKER_PATTERN = re.compile(r"^\s*[【\[]([^】\]]+)[】\]]")
+# 文件名开头括号中不是券商、而是文档类型的标签，如 "【财报】中芯国际2024年年度报告"
+_NON_BROKER_TAG_PATTERN = re.compile(r"财报|年报|季报|中报|公告|纪要|调研|招股")
+# 报告期：年份加可选的期间，期间的写法按 (标准化后的期间, 模式) 列出
+_PERIODS = (
+    ("Q1", r"Q1|[1一]季度?"),
+    ("H1", r"H1|半年度?|中报|中期"),
+    ("Q2", r"Q2|[2二]季度?"),
+    ("Q3", r"Q3|[3三]季度?"),
+    ("Q4", r"Q4|[4四]季度?"),
+    ("FY", r"FY|年度|年报"),
+)
+_PERIOD_PATTERN = re.compile(
+    r"(20\d{2})\s*(?:" + "|".join(rf"年?\s*(?P<{name}>{pattern})" for name, pattern in _PERIODS) + r"|年)",
+    re.IGNORECASE
+)
+# 问题中的报告期后紧跟这些词时，才视为在限定研报（"2025年一季度点评中"），而不是在询问该期的数据（"2025年一季度营收"）
+_REPORT_WORD_PATTERN = re.compile(r"\s*(?:的)?\s*(?:研报|点评|报)")
+# 券商简称需去除的后缀，如 "光大证券" -> "光大"
+_BROKER_SUFFIX_PATTERN = re.compile(r"(?:证券)?(?:股份有限公司|有限公司)?$")
+
+
+def _parse_period(match) -> tuple[int, str | None]:
+    """由报告期的匹配结果返回 (年份, 标准化的报告期如 "2025Q1"；没有期间时为None)。"""
+    year = int(match.group(1))
+    period = next((name for name, _ in _PERIODS if match.group(name)), None)
+    return year, f"{year}{period}" if period else None
+
+
+def report_attributes(source: str) -> dict:
+    """
+    从研报文件名中解析分区属性：report（不含扩展名的文件名）、broker（券商）、
+    report_year（年份）、report_period（报告期，如 "2025Q1"）。无法识别的属性不包含在结果中。
+    """
+    report = os.path.splitext(os.path.basename(source))[0]
+    if not report:
+        return {}
+    attributes = {"report": report}
+    broker = _BROKER_PATTERN.match(report)
+    if broker and not _NON_BROKER_TAG_PATTERN.search(broker.group(1)):
+        attributes["broker"] = broker.group(1).strip()
+    period = _PERIOD_PATTERN.search(report)
+    if period:
+        year, report_period = _parse_period(period)
+        attributes["report_year"] = year
+        if report_period:
+            attributes["report_period"] = report_period
+    return attributes
+
+
+def partition_attributes(metadata: dict, from_source: bool = True) -> dict:
+    """
+    文档块所属的各个分区。
+
+    :param from_source: 元数据中没有的属性（如早期构建的向量库）是否由来源文件名解析。分区供按元数据字段过滤的
+                        后端（Chroma的 where）使用时应为False，使分区与该后端实际能匹配到的文档块一致。
+    """
+    attributes = report_attributes(metadata.get("source") or "") if from_source else {}
+    attributes.update({field: metadata[field] for field in PARTITION_FIELDS if metadata.get(field) is not None})
+    return attributes
+
+
+def normalize_filters(filters: dict | None) -> dict:
+    """
+    规范化过滤条件：{字段: 取值或取值列表} -> {字段: [取值]}，去除空条件。
+    同一字段的多个取值之间为"或"，不同字段之间为"且"。
+
+    :raises ValueError: 字段不受支持或取值类型不正确时。
+    """
+    normalized = {}
+    for field, values in (filters or {}).items():
+        if field not in PARTITION_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}，可选字段为 {', '.join(PARTITION_FIELDS)}")
+        if values is None:
+            continue
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        values = [int(value) if field in _INT_FIELDS else str(value) for value in values]
+        if values:
+            normalized[field] = values
+    return normalized
+
+
+def to_chroma_where(filters: dict) -> dict | None:
+    """将过滤条件转换为Chroma的 where 表达式（要求文档块的元数据中存有对应字段）。"""
+    conditions = [{field: {"$in": values}} for field, values in normalize_filters(filters).items()]
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def extract_query_filters(query: str, partitions: "PartitionIndex") -> dict:
+    """
+    从问题文本中识别过滤条件：
+    - broker: 问题中出现的券商全称或简称（如 "光大证券"、"光大"），候选取自分区中已有的券商；
+    - report_period / report_year: 紧跟"报告/研报/点评"等词的报告期（如 "2024年年度报告"、"2025年一季度点评"），
+      带期间时按报告期过滤，否则按年份过滤。
+    分区中不存在的取值会被忽略，以免把检索范围缩小为空。
+    """
+    filters = {}
+    brokers = [
+        broker for broker in partitions.values("broker")
+        if broker in query or len(short := _BROKER_SUFFIX_PATTERN.sub("", broker)) >= 2 and short in query
+    ]
+    if brokers:
+        filters["broker"] = brokers
+
+    for match in _PERIOD_PATTERN.finditer(query):
+        if not (match.group(0).endswith("报") or _REPORT_WORD_PATTERN.match(query, match.end())):
+            continue
+        year, report_period = _parse_period(match)
+        field, value = ("report_period", report_period) if report_period else ("report_year", str(year))
+        if partitions.size({field: value}):
+            filters.setdefault(field, []).append(value)
+    return normalize_filters(filters)
+
+
+class PartitionIndex:
+    """字段取值到行号的倒排表。行号即文档块在所属检索索引中的位置。"""
+    FILENAME = "partitions.json"
+
+    def __init__(self, num_rows: int, partitions: dict):
+        """
+        :param num_rows: 索引中的文档块总数。
+        :param partitions: {字段: {取值的字符串形式: 行号列表}}。
+        """
+        self.num_rows = num_rows
+        self._partitions = {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in partitions.items()
+        }
+
+    @classmethod
+    def from_metadatas(cls, metadatas: list, from_source: bool = True) -> "PartitionIndex":
+        """由各行的元数据划分分区，from_source 见 partition_attributes。"""
+        partitions = {field: defaultdict(list) for field in PARTITION_FIELDS}
+        for row, metadata in enumerate(metadatas):
+            for field, value in partition_attributes(metadata or {}, from_source).items():
+                partitions[field][str(value)].append(row)
+        return cls(len(metadatas), partitions)
+
+    @classmethod
+    def concat(cls, indexes: list) -> "PartitionIndex":
+        """按顺序拼接多个索引（如各分片的分区），后一个索引的行号依次接在前一个之后。"""
+        partitions, offset = {}, 0
+        for index in indexes:
+            for field, values in index._partitions.items():
+                field_partitions = partitions.setdefault(field, {})
+                for value, rows in values.items():
+                    field_partitions.setdefault(value, []).append(rows + offset)
+            offset += index.num_rows
+        return cls(offset, {field: {value: np.concatenate(rows) for value, rows in values.items()}
+                            for field, values in partitions.items()})
+
+    def take(self, rows) -> "PartitionIndex":
+        """只保留给定的行（升序），按其在 rows 中的位置重新编号（如增量更新的索引删除部分行后）。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = np.full(self.num_rows, -1, dtype=np.int64)
+        positions[rows] = np.arange(len(rows))
+        partitions = {}
+        for field, values in self._partitions.items():
+            field_partitions = partitions.setdefault(field, {})
+            for value, value_rows in values.items():
+                kept = positions[value_rows]
+                kept = kept[kept >= 0]
+                if len(kept):
+                    field_partitions[value] = kept
+        return PartitionIndex(len(rows), partitions)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "PartitionIndex":
+        with open(os.path.join(index_dir, cls.FILENAME), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["num_rows"], data["partitions"])
+
+    def save(self, index_dir: str):
+        data = {
+            "num_rows": self.num_rows,
+            "partitions": {field: {value: rows.tolist() for value, rows in values.items()}
+                           for field, values in self._partitions.items()},
+        }
+        with open(os.path.join(index_dir, self.FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def values(self, field: str) -> list[str]:
+        """某个字段在索引中出现过的全部取值。"""
+        return list(self._partitions.get(field, {}))
+
+    def rows(self, filters: dict) -> np.ndarray | None:
+        """
+        返回满足过滤条件的行号（升序）；没有过滤条件时返回None，表示全部行。
+        """
+        filters = normalize_filters(filters)
+        if not filters:
+            return None
+        selected = None
+        for field, values in filters.items():
+            partitions = self._partitions.get(field, {})
+            field_rows = [partitions[str(value)] for value in values if str(value) in partitions]
+            field_rows = np.unique(np.concatenate(field_rows)) if field_rows else np.empty(0, dtype=np.int64)
+            selected = field_rows if selected is None else np.intersect1d(selected, field_rows, assume_unique=True)
+            if not len(selected):
+                break
+        return selected
+
+    def size(self, filters: dict) -> int:
+        """满足过滤条件的文档块数量。"""
+        rows = self.rows(filters)
+        return self.num_rows if rows is None else len(rows)
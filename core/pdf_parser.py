@@ -10,14 +10,22 @@ import sys
 import time
 import json
 import requests
+import random
 import hashlib
-import io
 import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 将项目根目录添加到Python的模块搜索路径中
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import PDF_REPORTS_DIR, MINERU_API_KEY, PROCESSED_REPORTS_DIR
+from config import PDF_REPORTS_DIR, MINERU_API_KEY, PROCESSED_REPORTS_DIR, MINERU_VERIFY_SSL, MINERU_MAX_WORKERS
+from config import PARSE_MANIFEST_PATH, MINERU_POLL_INITIAL_INTERVAL, MINERU_POLL_MAX_INTERVAL, MINERU_POLL_TIMEOUT
+from config import VECTOR_STORE_SHARDS
+from core.http_transport import get_session
+from core.report_columns import columnar_path, write_report_columns
+from core.pipeline import CoalescingRunner
 
 # API端点
 BASE_URL = 'https://mineru.net/api/v4'
@@ -28,23 +36,53 @@ BATCH_RESULT_URL_TEMPLATE = f'{BASE_URL}/extract-results/batch/{{}}'
 # TASK_URL = f'{BASE_URL}/extract/task'
 # RESULT_URL_TEMPLATE = f'{BASE_URL}/extract/task/{{}}'
 
+# 流式下载时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 轮询结果时，没有新文件完成则将间隔乘以该系数；每次等待叠加 ±POLL_JITTER 比例的随机抖动
+POLL_BACKOFF_FACTOR = 1.5
+POLL_JITTER = 0.2
+
+def _session():
+    """
+    minerU接口、文件上传与结果下载共用的长连接会话。
+    固定使用 requests（HTTP/1.1 连接池），以便沿用 requests 的异常类型与流式上传/下载。
+    """
+    return get_session("mineru", verify=MINERU_VERIFY_SSL, http2=False)
+
+def _upload_file(upload_url: str, filepath: str):
+    """
+    以流式方式上传文件：直接传入文件对象，requests 边读边发送，内存占用与文件大小无关。
+    显式设置 Content-Length，避免使用分块传输编码（预签名的上传地址不接受分块上传）。
+    """
+    with open(filepath, 'rb') as f:
+        upload_response = _session().put(
+            upload_url, data=f, headers={"Content-Length": str(os.path.getsize(filepath))}
+        )
+        upload_response.raise_for_status()
+
 def _download_and_extract_zip(zip_url: str) -> dict:
-    """从给定的URL下载ZIP文件，在内存中解压，并返回解析后的JSON内容。"""
+    """
+    从给定的URL下载ZIP文件并返回其中JSON文件的内容。
+    ZIP文件以流式方式写入临时文件而不是整体读入内存，解压时只读取需要的JSON成员。
+    """
     try:
         print(f" -> 正在下载并解压结果: {zip_url}")
-        response = requests.get(zip_url, verify=False)
-        response.raise_for_status()
+        with tempfile.TemporaryFile() as tmp_file:
+            with _session().get(zip_url, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    tmp_file.write(chunk)
+            tmp_file.seek(0)
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-            # 假设压缩包里有且仅有一个我们需要的json文件
-            json_filename = next((name for name in zip_file.namelist() if name.endswith('.json')), None)
-            if not json_filename:
-                print(" -> 错误: 在ZIP文件中没有找到 .json 文件。")
-                return None
-            
-            with zip_file.open(json_filename) as json_file:
-                content = json_file.read()
-                return json.loads(content)
+            with zipfile.ZipFile(tmp_file) as zip_file:
+                # 假设压缩包里有且仅有一个我们需要的json文件
+                json_filename = next((name for name in zip_file.namelist() if name.endswith('.json')), None)
+                if not json_filename:
+                    print(" -> 错误: 在ZIP文件中没有找到 .json 文件。")
+                    return None
+
+                with zip_file.open(json_filename) as json_file:
+                    return json.load(json_file)
 
     except requests.exceptions.RequestException as e:
         print(f" -> 下载ZIP文件时出错: {e}")
@@ -54,66 +92,200 @@ def _download_and_extract_zip(zip_url: str) -> dict:
         print(f" -> 处理ZIP文件时发生未知错误: {e}")
     return None
 
-def _get_batch_result(batch_id: str, headers: dict, num_files: int):
+def _iter_batch_results(batch_id: str, headers: dict, data_ids: list):
     """
-    使用requests轮询并获取批量任务的结果。
-    当所有文件的状态都为 'done' 或包含错误信息时，返回结果。
+    轮询批量任务的结果，每个文件的状态一旦变为 'done' 或包含错误信息就立即产出该结果项，
+    无需等待整个批次完成，调用方可以边轮询边下载、保存和入库。
+
+    轮询间隔自适应：有新文件完成时回到初始间隔，否则按 POLL_BACKOFF_FACTOR 逐步拉长，
+    直到 MINERU_POLL_MAX_INTERVAL；每次等待叠加随机抖动，避免多个批次同时请求。
     """
     result_url = BATCH_RESULT_URL_TEMPLATE.format(batch_id)
-    max_wait_time = 600  # 延长到10分钟以处理大文件
-    start_time = time.time()
-    while time.time() - start_time < max_wait_time:
+    pending = set(data_ids)
+    interval = MINERU_POLL_INITIAL_INTERVAL
+    deadline = time.time() + MINERU_POLL_TIMEOUT
+    while pending:
         try:
-            response = requests.get(result_url, headers=headers, verify=False)
-            response.raise_for_status() 
-            response_data = response.json()
-            
-            task_info = response_data.get('data', {})
-            results_list = task_info.get('extract_result', [])
-
-            # 检查是否所有任务都已完成（成功或失败）
-            if len(results_list) == num_files:
-                all_finished = all(
-                    item.get('state') == 'done' or item.get('err_msg')
-                    for item in results_list
-                )
-                if all_finished:
-                    print("批量任务处理完成。")
-                    return results_list
-            
-            # 提供更详细的进度信息
-            finished_count = sum(1 for item in results_list if item.get('state') == 'done' or item.get('err_msg'))
-            print(f"批量任务 {batch_id} 仍在处理中 ({finished_count}/{num_files} 完成), 15秒后重试...")
-            time.sleep(15)
+            response = _session().get(result_url, headers=headers)
+            response.raise_for_status()
+            results_list = response.json().get('data', {}).get('extract_result', [])
+
+            finished = [
+                item for item in results_list
+                if item.get('data_id') in pending and (item.get('state') == 'done' or item.get('err_msg'))
+            ]
+            for item in finished:
+                pending.discard(item.get('data_id'))
+                yield item
+            if not pending:
+                print("批量任务处理完成。")
+                return
+            interval = MINERU_POLL_INITIAL_INTERVAL if finished else min(interval * POLL_BACKOFF_FACTOR, MINERU_POLL_MAX_INTERVAL)
+            print(f"批量任务 {batch_id} 仍在处理中 ({len(data_ids) - len(pending)}/{len(data_ids)} 完成), {interval:.1f}秒后重试...")
 
         except requests.exceptions.RequestException as e:
+            interval = min(interval * POLL_BACKOFF_FACTOR, MINERU_POLL_MAX_INTERVAL)
             print(f"查询批量任务 {batch_id} 结果时出错: {e}")
-            time.sleep(15)
-    print(f"批量任务 {batch_id} 等待超时。")
-    return None
+
+        # 最后一次等待截止到超时时刻，醒来后再查询一次，不会提前放弃仍在处理的文件
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        time.sleep(min(interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER), remaining))
+    print(f"批量任务 {batch_id} 等待超时，仍有 {len(pending)} 个文件未完成。")
+
+def _handle_result(res_item: dict, data_id_map: dict) -> bool:
+    """处理批量结果中的一项：下载并保存解析结果，成功时返回True。"""
+    data_id = res_item.get("data_id")
+    filename = data_id_map.get(data_id)
+    if not filename:
+        print(f"警告：收到一个无法识别的data_id的结果: {data_id}")
+        return False
+
+    error_message = res_item.get("err_msg")
+    if error_message:
+        print(f" -> 文件 '{filename}' 解析失败: {error_message}")
+        return False
+    if res_item.get("state") != "done":
+        print(f" -> 文件 '{filename}' 处于未知状态: {res_item.get('state')}")
+        return False
+
+    zip_url = res_item.get("full_zip_url")
+    if not zip_url:
+        print(f" -> 文件 '{filename}' 状态为 'done' 但缺少 'full_zip_url'。")
+        return False
+    result_data = _download_and_extract_zip(zip_url)
+    if not result_data:
+        print(f" -> 未能从ZIP文件中提取 '{filename}' 的结果。")
+        return False
+    save_json_result(filename, result_data)
+    return True
 
 def save_json_result(filename: str, data: dict):
-    """将解析结果保存为JSON文件"""
+    """将解析结果保存为JSON文件，同时保存一份列式文件供构建知识库时快速加载。"""
     if not os.path.exists(PROCESSED_REPORTS_DIR):
         os.makedirs(PROCESSED_REPORTS_DIR)
     
-    base_name = os.path.splitext(filename)[0]
-    json_path = os.path.join(PROCESSED_REPORTS_DIR, f"{base_name}.json")
+    json_path = _json_output_path(filename)
     
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    # JSON先写入临时文件，列式文件写好后再原子替换：同时运行的增量同步不会读到写了一半的JSON，
+    # 且替换后JSON的修改时间早于列式文件，列式文件不会被判定为过期而重新生成
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    if isinstance(data, list):
+        write_report_columns(columnar_path(json_path), data)
+    os.replace(tmp_path, json_path)
     print(f" -> 结果已保存到: {json_path}")
 
-def parse_pdf_documents_requests(pdf_directory: str = PDF_REPORTS_DIR):
+def _json_output_path(filename: str) -> str:
+    """PDF文件对应的解析结果JSON文件路径。"""
+    base_name = os.path.splitext(filename)[0]
+    return os.path.join(PROCESSED_REPORTS_DIR, f"{base_name}.json")
+
+def _hash_file(file_path: str) -> str:
+    """计算文件内容的SHA-256哈希，同时用作提交给minerU的 data_id。"""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _load_parse_manifest() -> dict | None:
+    """
+    读取解析清单：{PDF内容哈希: {"pdf": PDF文件名, "json": 结果JSON文件名}}。
+    清单不存在时返回None。
+    """
+    try:
+        with open(PARSE_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _save_parse_manifest(manifest: dict):
+    os.makedirs(os.path.dirname(PARSE_MANIFEST_PATH), exist_ok=True)
+    tmp_path = PARSE_MANIFEST_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, PARSE_MANIFEST_PATH)
+
+def _record_parsed(manifest: dict, file_hash: str, filename: str):
+    """在清单中记录一个已解析的文件，并移除指向同一个JSON文件的旧条目（该JSON已被覆盖）。"""
+    json_name = os.path.basename(_json_output_path(filename))
+    for stale_hash in [h for h, entry in manifest.items() if entry["json"] == json_name and h != file_hash]:
+        del manifest[stale_hash]
+    manifest[file_hash] = {"pdf": filename, "json": json_name}
+
+def _select_files_to_parse(pdf_directory: str, pdf_files: list, manifest: dict, adopt_existing: bool) -> dict:
+    """
+    根据解析清单筛选需要提交给minerU的文件：
+    - 内容哈希已在清单中且结果JSON存在的文件直接跳过；
+    - 仅被重命名的文件（原文件名已不存在）：将结果JSON随之重命名，不重新解析；
+    - 与另一个文件内容完全相同的文件只解析一次；
+    - adopt_existing 为True（首次使用清单）时，已存在同名结果JSON的文件视为已解析并记入清单。
+
+    :return: {内容哈希: 文件名}，即需要解析的文件。会就地更新 manifest。
+    """
+    files_to_parse = {}
+    for fname in sorted(pdf_files):
+        file_hash = _hash_file(os.path.join(pdf_directory, fname))
+        entry = manifest.get(file_hash)
+        if entry and os.path.exists(os.path.join(PROCESSED_REPORTS_DIR, entry["json"])):
+            if entry["pdf"] == fname:
+                continue
+            if os.path.exists(os.path.join(pdf_directory, entry["pdf"])):
+                print(f"跳过 '{fname}': 内容与已解析的 '{entry['pdf']}' 相同。")
+                continue
+            old_json_path = os.path.join(PROCESSED_REPORTS_DIR, entry["json"])
+            new_json_path = _json_output_path(fname)
+            os.replace(old_json_path, new_json_path)
+            if os.path.exists(columnar_path(old_json_path)):
+                os.replace(columnar_path(old_json_path), columnar_path(new_json_path))
+            _record_parsed(manifest, file_hash, fname)
+            print(f"检测到重命名: '{entry['pdf']}' -> '{fname}'，已将解析结果移动到 {new_json_path}")
+            continue
+
+        if file_hash in files_to_parse:
+            print(f"跳过 '{fname}': 内容与 '{files_to_parse[file_hash]}' 相同。")
+        elif adopt_existing and os.path.exists(_json_output_path(fname)):
+            _record_parsed(manifest, file_hash, fname)
+        else:
+            files_to_parse[file_hash] = fname
+    return files_to_parse
+
+def parse_pdf_documents_requests(pdf_directory: str = PDF_REPORTS_DIR, on_result=None):
     """
     使用 requests 库和 minerU 的批量流程，解析指定目录下的所有PDF文件。
     新流程：1. 批量申请URL -> 2. 上传文件 -> 3. 批量获取结果
+    根据解析清单，只有新增或内容发生变化的PDF会被提交给minerU。
+
+    :param pdf_directory: PDF文件所在的目录。
+    :param on_result: 可选，每个文件的解析结果保存后立即调用 on_result(PDF文件名, JSON文件路径)，
+                      此时批次中的其他文件可能仍在解析，可用于流水线式地分割、向量化并入库。
+                      回调在下载线程中执行，抛出的异常只会被打印，不影响其他文件。
     """
     pdf_files = [f for f in os.listdir(pdf_directory) if f.endswith(".pdf")]
     if not pdf_files:
         print(f"在目录 '{pdf_directory}' 中没有找到PDF文件。")
         return
 
+    manifest = _load_parse_manifest()
+    adopt_existing = manifest is None
+    if adopt_existing:
+        print("未找到解析清单，已存在同名解析结果的PDF将被视为已解析并记入清单。")
+        manifest = {}
+    # data_id (PDF内容哈希) 到原始文件名的映射
+    data_id_map = _select_files_to_parse(pdf_directory, pdf_files, manifest, adopt_existing)
+    _save_parse_manifest(manifest)
+
+    skipped = len(pdf_files) - len(data_id_map)
+    if skipped:
+        print(f"根据解析清单跳过 {skipped} 个已解析的PDF文件。")
+    if not data_id_map:
+        print("没有新增或变化的PDF文件需要解析。")
+        return
+    pdf_files = list(data_id_map.values())
+
     print(f"准备使用 minerU API (批量流程) 解析以下 {len(pdf_files)} 个PDF文件...")
 
     headers = {
@@ -125,16 +297,11 @@ def parse_pdf_documents_requests(pdf_directory: str = PDF_REPORTS_DIR):
         # --- 步骤 1/3: 批量申请文件上传地址 ---
         print("\n--- 步骤 1/3: 批量申请文件上传地址 ---")
         
-        # 创建一个从 data_id (hash) 到原始文件名的映射
-        data_id_map = {}
-        files_to_request = []
-        for fname in pdf_files:
-            # 使用文件名的MD5哈希作为唯一且简短的 data_id
-            hasher = hashlib.md5()
-            hasher.update(fname.encode('utf-8'))
-            data_id = hasher.hexdigest()
-            data_id_map[data_id] = fname
-            files_to_request.append({"name": fname, "is_ocr": True, "data_id": data_id})
+        # 使用PDF内容的哈希作为 data_id，返回结果时据此找回文件名并记入解析清单
+        files_to_request = [
+            {"name": fname, "is_ocr": True, "data_id": data_id}
+            for data_id, fname in data_id_map.items()
+        ]
 
         batch_payload = {
             "files": files_to_request,
@@ -143,7 +310,7 @@ def parse_pdf_documents_requests(pdf_directory: str = PDF_REPORTS_DIR):
             "model_version": "v2"
         }
         
-        response = requests.post(BATCH_URLS_URL, headers=headers, json=batch_payload, verify=False)
+        response = _session().post(BATCH_URLS_URL, headers=headers, json=batch_payload)
         response.raise_for_status()
         batch_response_data = response.json()
 
@@ -162,52 +329,45 @@ def parse_pdf_documents_requests(pdf_directory: str = PDF_REPORTS_DIR):
         print(f"成功获取 {len(upload_urls_info)} 个文件的上传地址, Batch ID: {batch_id}")
 
         # --- 步骤 2/3: 上传所有文件 ---
-        print("\n--- 步骤 2/3: 开始上传所有文件 ---")
-        upload_map = {} # 这个map现在可以不创建，但保留以防万一
-        for i, (filename, url_info) in enumerate(zip(pdf_files, upload_urls_info)):
-            filepath = os.path.join(pdf_directory, filename)
+        print(f"\n--- 步骤 2/3: 开始上传所有文件 (并发数: {MINERU_MAX_WORKERS}) ---")
+
+        def upload(item):
+            filename, url_info = item
             print(f"正在上传: {filename}...")
-            
-            # 将文件读入内存再上传，以确保使用 Content-Length
-            with open(filepath, 'rb') as f:
-                file_content = f.read()
-                upload_response = requests.put(url_info, data=file_content, verify=False)
-                upload_response.raise_for_status()
-            upload_map[filename] = url_info # 保留赋值
+            _upload_file(url_info, os.path.join(pdf_directory, filename))
+
+        with ThreadPoolExecutor(max_workers=MINERU_MAX_WORKERS, thread_name_prefix="mineru-upload") as executor:
+            # 任一文件上传失败时，异常会在这里抛出，由外层统一处理
+            list(executor.map(upload, zip(pdf_files, upload_urls_info)))
 
         print("所有文件上传成功。")
         
         # --- 步骤 3/3: 轮询获取所有任务的结果 ---
+        # 每个文件一完成就提交到下载线程池，下载、保存与 on_result 回调和后续轮询同时进行
         print(f"\n--- 步骤 3/3: 获取批量任务 (Batch ID: {batch_id}) 的解析结果 ---")
-        results = _get_batch_result(batch_id, {"Authorization": headers["Authorization"]}, len(pdf_files))
-        
-        successful_files = 0
-        if results is not None:
-            for res_item in results:
-                data_id = res_item.get("data_id")
-                filename = data_id_map.get(data_id)
-                
-                if filename:
-                    error_message = res_item.get("err_msg")
-                    if error_message:
-                        print(f" -> 文件 '{filename}' 解析失败: {error_message}")
-                    elif res_item.get("state") == "done":
-                        zip_url = res_item.get("full_zip_url")
-                        if zip_url:
-                            result_data = _download_and_extract_zip(zip_url)
-                            if result_data:
-                                save_json_result(filename, result_data)
-                                successful_files += 1
-                            else:
-                                print(f" -> 未能从ZIP文件中提取 '{filename}' 的结果。")
-                        else:
-                            print(f" -> 文件 '{filename}' 状态为 'done' 但缺少 'full_zip_url'。")
-                    else:
-                        print(f" -> 文件 '{filename}' 处于未知状态: {res_item.get('state')}")
-                else:
-                    print(f"警告：收到一个无法识别的data_id的结果: {data_id}")
-        else:
-            print("未能获取任何批量解析结果。")
+        manifest_lock = threading.Lock()
+
+        def handle(res_item):
+            if not _handle_result(res_item, data_id_map):
+                return False
+            data_id = res_item["data_id"]
+            filename = data_id_map[data_id]
+            with manifest_lock:
+                _record_parsed(manifest, data_id, filename)
+                _save_parse_manifest(manifest)
+            if on_result is not None:
+                try:
+                    on_result(filename, _json_output_path(filename))
+                except Exception as e:
+                    print(f" -> 处理文件 '{filename}' 的解析结果时出错: {e}")
+            return True
+
+        with ThreadPoolExecutor(max_workers=MINERU_MAX_WORKERS, thread_name_prefix="mineru-download") as executor:
+            futures = [
+                executor.submit(handle, res_item)
+                for res_item in _iter_batch_results(batch_id, {"Authorization": headers["Authorization"]}, list(data_id_map))
+            ]
+            successful_files = sum(future.result() for future in futures)
         
         if successful_files == len(pdf_files):
             print(f"\n--- ✅ 所有 {successful_files} 个文件均已成功解析并保存 ---")
@@ -220,8 +380,26 @@ def parse_pdf_documents_requests(pdf_directory: str = PDF_REPORTS_DIR):
         print(f"\n在处理过程中发生未知错误: {e}")
 
 
+def parse_and_sync(pdf_directory: str = PDF_REPORTS_DIR):
+    """
+    解析PDF并增量同步知识库：每个文件的解析结果保存后立即在后台触发一次同步（见 KnowledgeBaseManager.sync），
+    与批次中其余文件的解析同时进行。同步期间又有文件完成时，当前同步结束后再同步一次；返回前等待最后一次同步完成。
+    """
+    # 知识库依赖LangChain与Chroma，只在需要同步时导入
+    from core.knowledge_base_manager import KnowledgeBaseManager
+    from core.sharded_store import ShardedKnowledgeBase
+    kb_manager = ShardedKnowledgeBase() if VECTOR_STORE_SHARDS > 1 else KnowledgeBaseManager()
+    with CoalescingRunner(kb_manager.sync, name="kb-sync") as syncer:
+        parse_pdf_documents_requests(pdf_directory, on_result=lambda filename, json_path: syncer.trigger())
+
+
 if __name__ == '__main__':
+    # True: 解析完成的文件立即增量同步到知识库；False: 只解析，之后再运行 core/knowledge_base_manager.py
+    SYNC_KNOWLEDGE_BASE = True
+
     if not any(f.endswith(".pdf") for f in os.listdir(PDF_REPORTS_DIR)):
         print(f"'{PDF_REPORTS_DIR}' 目录为空，请先放置PDF文件。")
+    elif SYNC_KNOWLEDGE_BASE:
+        parse_and_sync()
     else:
         parse_pdf_documents_requests() 
\ No newline at end of file
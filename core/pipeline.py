@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+@file: pipeline.py
+@desc: 生成器流水线的辅助工具。prefetch 在后台线程中迭代上游生成器，并通过有界队列交给下游：
+       上下游得以同时运行，而队列满时上游阻塞（背压），内存中最多只有 maxsize 个在途元素。
+       CoalescingRunner 在后台线程中执行合并后的触发，如解析结果陆续到达时增量同步知识库。
+"""
+import queue
+import threading
+
+# 队列消息的类型
+_ITEM, _ERROR, _DONE = range(3)
+
+
+def batched(iterable, batch_size: int):
+    """将可迭代对象按 batch_size 切分为列表，最后一批可能不足 batch_size。"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(iterable, maxsize: int = 2, name: str = None):
+    """
+    在后台线程中迭代 iterable，产出相同的元素。
+
+    :param iterable: 上游的可迭代对象（通常是生成器），在后台线程中执行。
+    :param maxsize: 队列中最多缓存的元素个数，上游领先下游超过该数量时阻塞。
+    :param name: 后台线程的名称，便于调试。
+    上游抛出的异常会在下游迭代时重新抛出；下游提前结束（如出错或 break）时，上游随之停止。
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(message) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((_ITEM, item)):
+                    return
+        except BaseException as e:
+            put((_ERROR, e))
+        else:
+            put((_DONE, None))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    worker = threading.Thread(target=produce, name=name, daemon=True)
+    worker.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == _ITEM:
+                yield value
+            elif kind == _ERROR:
+                raise value
+            else:
+                return
+    finally:
+        stopped.set()
+        worker.join()
+
+
+class CoalescingRunner:
+    """
+    在一个后台线程中执行 func，多次触发合并执行：执行期间到达的触发只会使其在结束后再执行一次。
+    适用于"有新数据就重新同步"的场景，如每个PDF解析完成后增量同步知识库。
+    func 抛出的异常只会被打印，不影响之后的执行。
+    """
+    def __init__(self, func, name: str = None):
+        self._func = func
+        self._condition = threading.Condition()
+        self._requested = False
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def trigger(self):
+        """请求执行一次 func（不等待执行完成）。"""
+        with self._condition:
+            self._requested = True
+            self._condition.notify()
+
+    def close(self):
+        """等待已请求的执行全部完成后停止后台线程。"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._requested and not self._closed:
+                    self._condition.wait()
+                if not self._requested:
+                    return
+                self._requested = False
+            try:
+                self._func()
+            except Exception as e:
+                print(f"后台任务执行失败: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,37 +1,124 @@
 import os
 import sys
 import json
+import asyncio
+import threading
 from typing import Dict
 
+from langchain.schema import Document
+
 # 将项目根目录添加到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from core.knowledge_base_manager import KnowledgeBaseManager
+from core.knowledge_base_manager import KnowledgeBaseManager, QueryEmbeddingError
 from core.llm_service import QwenLLM
-from config import PROMPT_TEMPLATE
+from core.stream_parser import StreamingJSONFieldParser, clean_llm_json
+from core.answer_cache import AnswerCache
+from core.lexical_index import reciprocal_rank_fusion
+from core.metrics import span, record_cache_lookup, record_coalesced, record_context_packing
+from core.single_flight import SingleFlight, AsyncSingleFlight
+from core.batch_runner import BatchRunner
+from core.context_packer import ContextPacker, CONTEXT_SEPARATOR
+from core.partitions import extract_query_filters, normalize_filters
+from core.sharded_store import ShardedKnowledgeBase, search_vectors
+from config import (PROMPT_TEMPLATE, ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES,
+                    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                    HYBRID_SEARCH_ENABLED, LEXICAL_TOP_K, RRF_K, REQUEST_COALESCING_ENABLED,
+                    CONTEXT_PACKING_ENABLED, CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_MAX_HAMMING,
+                    QUERY_FILTER_EXTRACTION_ENABLED, VECTOR_STORE_SHARDS)
+
+# 解析LLM响应失败时返回的答案文本，此类答案不会写入缓存
+PARSE_ERROR_ANSWER = "抱歉，处理您的请求时发生错误。"
+# 无法执行检索时返回的答案文本，同样不会写入缓存
+RETRIEVAL_UNAVAILABLE_ANSWER = "抱歉，检索服务暂时不可用，请稍后重试。"
 
 class QAService:
-    def __init__(self):
+    def __init__(self, llm: QwenLLM = None, kb_manager: KnowledgeBaseManager = None):
         """
         初始化问答服务, 加载所需的组件。
+
+        :param llm: 可选，自定义的LLM服务实例（如压测时使用的模拟LLM）。
+        :param kb_manager: 可选，自定义的知识库管理器实例。
         """
         print("正在初始化问答服务...")
-        self.llm = QwenLLM()
-        self.kb_manager = KnowledgeBaseManager()
-        self.db = self.kb_manager.load_db()
+        self.llm = llm or QwenLLM()
+        if kb_manager is None:
+            # 配置了多个分片时使用分片知识库，其接口与 KnowledgeBaseManager 相同
+            kb_manager = ShardedKnowledgeBase(llm=self.llm) if VECTOR_STORE_SHARDS > 1 else KnowledgeBaseManager(llm=self.llm)
+        self.kb_manager = kb_manager
+        self._index_lock = threading.Lock()
+        self._load_indexes()
+        self.answer_cache = None
+        if ANSWER_CACHE_ENABLED:
+            self.answer_cache = AnswerCache(
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                version_file=self.kb_manager.build_stamp_path
+            )
+        # 相同请求同时在途时合并执行（同步接口与异步接口各自独立合并）
+        self._flight = SingleFlight() if REQUEST_COALESCING_ENABLED else None
+        self._async_flight = AsyncSingleFlight() if REQUEST_COALESCING_ENABLED else None
+        self.context_packer = ContextPacker(CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_MAX_HAMMING) if CONTEXT_PACKING_ENABLED else None
         print("问答服务初始化完成。")
 
-    def search_documents(self, query: str, top_k: int, rerank_top_n: int) -> list:
+    def _load_indexes(self):
+        """
+        加载检索所用的索引：向量检索后端、BM25词法索引，以及从问题中识别过滤条件所用的检索分区
+        （NumPy后端直接复用索引自带的分区，Chroma后端由元数据划分），并记录它们对应的向量库版本。
+        """
+        # 先读取版本：加载期间向量库再次更新时，下一次检查仍会发现版本变化
+        version = self._read_index_version()
+        db = self.kb_manager.load_search_backend()
+        lexical_index = self.kb_manager.load_lexical_index() if HYBRID_SEARCH_ENABLED else None
+        partitions = None
+        if QUERY_FILTER_EXTRACTION_ENABLED:
+            partitions = getattr(db, "partitions", None) or self.kb_manager.load_partition_index()
+        self.db, self.lexical_index, self.partitions = db, lexical_index, partitions
+        self._index_version = version
+
+    def _read_index_version(self) -> int | None:
+        """向量库构建标记文件的修改时间，与问答缓存判断向量库是否被重建的依据相同。"""
+        version_file = self.kb_manager.build_stamp_path
+        if not version_file:
+            return None
+        try:
+            return os.stat(version_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _refresh_indexes(self) -> int | None:
+        """
+        向量库被重建或同步后（构建标记变化），重新加载检索所用的全部索引。
+
+        :return: 当前检索索引对应的向量库版本。
+        """
+        if self._read_index_version() != self._index_version:
+            with self._index_lock:
+                if self._read_index_version() != self._index_version:
+                    print("检测到向量库已更新，正在重新加载检索索引...")
+                    # 旧的Chroma客户端不立即停止，仍在使用它的请求可以继续完成
+                    close_db = getattr(self.kb_manager, "close_db", None)
+                    if close_db is not None:
+                        close_db(stop=False)
+                    self._load_indexes()
+        return self._index_version
+
+    def search_documents(self, query: str, top_k: int, rerank_top_n: int, query_embedding: list[float] = None,
+                         filters: dict = None) -> list:
         """
         仅执行文档检索和重排步骤。
 
         :param query: 用户提出的问题。
         :param top_k: 向量检索时召回的文档数量。
         :param rerank_top_n: Reranker模型筛选出的最相关文档数量。
+        :param query_embedding: 可选，已计算好的问题向量，提供时不再重复调用Embedding API。
+        :param filters: 可选的过滤条件，如 {"broker": "光大证券", "report_period": "2025Q1"}（字段见 core.partitions），
+                        只在匹配的分区内检索。启用自动识别时，问题中提到的券商与报告期会补充到未指定的字段中。
         :return: 一个包含文档内容和元数据的字典列表。
         """
         print(f"步骤1: 正在从向量数据库中检索 {top_k} 个相关文档...")
-        retrieved_docs = self.db.similarity_search_with_score(query, k=top_k)
+        retrieved_docs = self._retrieve(query, top_k, query_embedding, filters)
         
         if not retrieved_docs:
             print("警告: 向量检索未找到任何相关文档。")
@@ -39,79 +126,335 @@ class QAService:
         
         print(f"检索完成，共找到 {len(retrieved_docs)} 个文档。")
 
+        rerank_results = None
         if rerank_top_n > 0:
             print(f"步骤2: Rerank模型正在对召回的文档进行重排 (取前{rerank_top_n}个)...")
-            reranked_docs_content = self.llm.get_rerank_documents(query, [doc.page_content for doc, score in retrieved_docs], top_n=rerank_top_n)
-            
-            # Rerank后只返回了文本内容，我们需要找到原始文档以保留元数据
-            final_docs = []
-            if reranked_docs_content:
-                for content in reranked_docs_content:
-                    original_doc_tuple = next(((doc, score) for doc, score in retrieved_docs if doc.page_content == content), None)
-                    if original_doc_tuple:
-                        original_doc, score = original_doc_tuple
-                        final_docs.append({
-                            "page_content": original_doc.page_content,
-                            "metadata": {**original_doc.metadata, 'score': score}
-                        })
-            
-            if not final_docs: # Fallback if rerank fails
-                print("警告: Rerank后没有返回任何文档或无法匹配原始文档，将使用原始检索结果。")
-                final_docs = [{"page_content": doc.page_content, "metadata": {**doc.metadata, 'score': score}} for doc, score in retrieved_docs]
+            with span("rerank"):
+                rerank_results = self.llm.get_rerank_results(query, [doc.page_content for doc, score in retrieved_docs], top_n=rerank_top_n)
+        else:
+            print("步骤2: 已跳过Rerank。")
+
+        return self._build_final_docs(retrieved_docs, rerank_results)
 
+    async def asearch_documents(self, query: str, top_k: int, rerank_top_n: int, query_embedding: list[float] = None,
+                                filters: dict = None) -> list:
+        """
+        search_documents 的异步版本，向量检索与Rerank调用均不会阻塞事件循环。
+        """
+        print(f"步骤1: 正在从向量数据库中检索 {top_k} 个相关文档...")
+        retrieved_docs = await self.llm.arun(self._retrieve, query, top_k, query_embedding, filters)
+
+        if not retrieved_docs:
+            print("警告: 向量检索未找到任何相关文档。")
+            return []
+
+        print(f"检索完成，共找到 {len(retrieved_docs)} 个文档。")
+        return await self._arerank(query, retrieved_docs, rerank_top_n)
+
+    async def _arerank(self, query: str, retrieved_docs: list, rerank_top_n: int) -> list:
+        """对召回的文档执行Rerank（rerank_top_n<=0时跳过），并整理为最终的文档字典列表。"""
+        rerank_results = None
+        if rerank_top_n > 0:
+            print(f"步骤2: Rerank模型正在对召回的文档进行重排 (取前{rerank_top_n}个)...")
+            with span("rerank"):
+                rerank_results = await self.llm.aget_rerank_results(query, [doc.page_content for doc, score in retrieved_docs], top_n=rerank_top_n)
         else:
             print("步骤2: 已跳过Rerank。")
-            final_docs = [{"page_content": doc.page_content, "metadata": {**doc.metadata, 'score': score}} for doc, score in retrieved_docs]
-        
-        print("文档检索与重排完成。")
-        return final_docs
 
-    def generate_answer(self, query: str, documents: list) -> Dict:
+        return self._build_final_docs(retrieved_docs, rerank_results)
+
+    def _retrieve(self, query: str, top_k: int, query_embedding: list[float] = None, filters: dict = None) -> list:
         """
-        根据提供的文档生成最终答案和思考过程。
+        召回候选文档。启用混合检索时，将向量检索与BM25词法检索的结果按倒数排名融合 (RRF)，
+        取融合后的前 top_k 个，使包含精确代码、数字的文档块不会被向量检索漏掉。
 
-        :param query: 用户提出的问题。
-        :param documents: 用于生成答案的上下文文档列表 (字典格式)。
-        :return: LLM生成的包含思考过程的结构化JSON对象。
+        :return: (Document, score) 列表。score 为向量距离，仅由词法检索召回的文档为None。
+        """
+        if query_embedding is None:
+            query_embedding = self._embed_query(query)
+        return self._retrieve_many([query], [query_embedding], top_k, filters)[0]
+
+    def _retrieve_many(self, queries: list[str], query_embeddings: list, top_k: int, filters: dict = None) -> list[list]:
         """
+        为多个问题同时召回候选文档：过滤条件相同的问题的向量检索合并为一次矩阵运算，
+        各问题的BM25结果中需要额外取回的文档块去重后一次性读取。
+
+        :param filters: 所有问题共用的过滤条件；各问题自动识别出的条件分别补充。
+        :return: 与queries一一对应的 (Document, score) 列表。
+        """
+        self._refresh_indexes()
+        scopes = [self._resolve_filters(query, filters) for query in queries]
+        vector_results = self._vector_search_many(query_embeddings, top_k, scopes)
+        if self.lexical_index is None:
+            return vector_results
+
+        with span("lexical_search"):
+            lexical_results = [self.lexical_index.search(query, LEXICAL_TOP_K, filters=scope)
+                               for query, scope in zip(queries, scopes)]
+
+        # 所有问题共享同一个候选池，同一文档块只保留一份
+        candidates = {}
+        vector_ids = set()
+        for vector_docs in vector_results:
+            for doc, score in vector_docs:
+                candidates.setdefault(self._doc_key(doc), doc)
+                vector_ids.add(doc.metadata.get("chunk_id"))
+        missing_ids = list(dict.fromkeys(
+            chunk_id for lexical_hits in lexical_results for chunk_id, _ in lexical_hits if chunk_id not in vector_ids
+        ))
+        chunk_keys = {chunk_id: chunk_id for chunk_id in vector_ids}
+        if missing_ids:
+            fetched = self.db.get(ids=missing_ids, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"]):
+                doc = Document(page_content=text, metadata=dict(metadata or {}))
+                chunk_keys[chunk_id] = self._doc_key(doc)
+                candidates.setdefault(chunk_keys[chunk_id], doc)
+
+        return [
+            self._fuse(vector_docs, lexical_hits, candidates, chunk_keys, top_k)
+            for vector_docs, lexical_hits in zip(vector_results, lexical_results)
+        ]
+
+    def _fuse(self, vector_docs: list, lexical_hits: list, candidates: dict, chunk_keys: dict, top_k: int) -> list:
+        """将一个问题的向量检索结果与BM25结果按RRF融合，返回 (Document, score) 列表。"""
+        if not lexical_hits:
+            return vector_docs
+
+        vector_scores = {self._doc_key(doc): score for doc, score in vector_docs}
+        bm25_scores = {}
+        lexical_ranking = []
+        for chunk_id, bm25_score in lexical_hits:
+            key = chunk_keys.get(chunk_id)
+            if key in candidates:
+                lexical_ranking.append(key)
+                bm25_scores[key] = bm25_score
+
+        vector_ranking = list(vector_scores)
+        fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking], k=RRF_K)[:top_k]
+        print(f"混合检索: 向量召回 {len(vector_ranking)} 个，BM25召回 {len(lexical_ranking)} 个，融合后保留 {len(fused)} 个。")
+
+        results = []
+        for key, rrf_score in fused:
+            doc = candidates[key]
+            # 候选文档在多个问题间共享，融合得分写入各自的元数据副本
+            metadata = {**doc.metadata, "rrf_score": rrf_score}
+            if key in bm25_scores:
+                metadata["bm25_score"] = bm25_scores[key]
+            results.append((Document(page_content=doc.page_content, metadata=metadata), vector_scores.get(key)))
+        return results
+
+    def _resolve_filters(self, query: str, filters: dict = None) -> dict:
+        """
+        确定一个问题的检索范围：调用方指定的过滤条件，加上从问题中识别出的、调用方未指定字段的条件。
+        识别出的条件会使检索范围为空时（如券商与报告期没有交集）不予采用。
+        """
+        filters = normalize_filters(filters)
+        if self.partitions is None:
+            return filters
+        extracted = {field: values for field, values in extract_query_filters(query, self.partitions).items()
+                     if field not in filters}
+        if extracted and self.partitions.size({**filters, **extracted}):
+            print(f"从问题中识别出过滤条件: {extracted}")
+            filters.update(extracted)
+        return filters
+
+    def _vector_search(self, query_embedding: list[float], top_k: int, filters: dict = None) -> list:
+        """执行向量检索，返回 (Document, score) 列表。"""
+        return self._vector_search_many([query_embedding], top_k, [filters or {}])[0]
+
+    def _vector_search_many(self, query_embeddings: list, top_k: int, scopes: list[dict] = None) -> list[list]:
+        """
+        批量向量检索，过滤条件相同的向量合并为一次查询。
+
+        :param scopes: 与query_embeddings一一对应的过滤条件，为None表示都不过滤。
+        :return: 与query_embeddings一一对应的 (Document, score) 列表。
+        """
+        scopes = scopes or [{}] * len(query_embeddings)
+        groups = {}
+        for i, scope in enumerate(scopes):
+            groups.setdefault(json.dumps(scope, sort_keys=True, ensure_ascii=False), []).append(i)
+
+        results = [None] * len(query_embeddings)
+        with span("vector_search"):
+            for indices in groups.values():
+                group_results = self._vector_search_batch([query_embeddings[i] for i in indices], top_k, scopes[indices[0]])
+                for i, docs in zip(indices, group_results):
+                    results[i] = docs
+        return results
+
+    def _vector_search_batch(self, query_embeddings: list, top_k: int, filters: dict) -> list[list]:
+        """以同一过滤条件检索多个向量，见 core.sharded_store.search_vectors。"""
+        return search_vectors(self.db, query_embeddings, top_k, filters)
+
+    @staticmethod
+    def _doc_key(doc: Document) -> str:
+        """文档块的唯一标识。早期构建的向量库没有 chunk_id 元数据，此时以文本内容代替。"""
+        return doc.metadata.get("chunk_id") or doc.page_content
+
+    def _embed_query(self, query: str) -> list[float]:
+        """计算问题向量，供语义缓存与向量检索共用。"""
+        return self.kb_manager.embedding_function.embed_query(query)
+
+    def _cache_answer(self, query: str, query_embedding, top_k: int, rerank_top_n: int, answer: Dict,
+                      filters: dict = None, index_version: int = None):
+        """
+        将成功生成的答案写入缓存（解析失败的答案、指定了过滤条件的答案不缓存）。
+
+        :param index_version: 检索时所用索引对应的向量库版本；生成期间向量库被更新时，缓存不会写入该答案。
+        """
+        if self.answer_cache is not None and not filters and answer.get("final_answer") != PARSE_ERROR_ANSWER:
+            self.answer_cache.put(query, query_embedding, top_k, rerank_top_n, answer, version=index_version)
+
+    def _build_final_docs(self, retrieved_docs: list, rerank_results: list | None) -> list:
+        """
+        将向量检索结果（及可选的Rerank结果）整理为带元数据的字典列表。
+
+        :param retrieved_docs: 向量检索返回的 (Document, score) 列表。
+        :param rerank_results: Rerank返回的 (下标, 相关性得分) 列表，为None表示跳过了Rerank。
+        :return: 一个包含文档内容和元数据的字典列表。元数据中的 score 为向量距离，
+                 rerank_score 为Rerank相关性得分，chunk_id 为文档块的唯一标识。
+        """
+        if rerank_results is None:
+            final_docs = [self._doc_dict(doc, score) for doc, score in retrieved_docs]
+            print("文档检索与重排完成。")
+            return self._pack_context(final_docs)
+
+        # Rerank返回的是文档在候选列表中的下标，直接按下标取回原始文档及其元数据
+        final_docs = [
+            self._doc_dict(*retrieved_docs[index], rerank_score=relevance_score)
+            for index, relevance_score in rerank_results
+            if 0 <= index < len(retrieved_docs)
+        ]
+
+        if not final_docs: # Fallback if rerank fails
+            print("警告: Rerank后没有返回任何文档，将使用原始检索结果。")
+            final_docs = [self._doc_dict(doc, score) for doc, score in retrieved_docs]
+
+        print("文档检索与重排完成。")
+        return self._pack_context(final_docs)
+
+    def _pack_context(self, final_docs: list) -> list:
+        """按得分排序、剔除近似重复的文档块，并截取到上下文Token预算以内。"""
+        if self.context_packer is None or not final_docs:
+            return final_docs
+        with span("context_pack"):
+            packed_docs, stats = self.context_packer.pack(final_docs)
+        record_context_packing(stats)
+        print(f"上下文打包: {stats.input_docs} 个文档块 (约 {stats.input_tokens} tokens) -> "
+              f"{stats.packed_docs} 个 (约 {stats.packed_tokens} tokens)，"
+              f"去除近似重复 {stats.duplicates_removed} 个，超出预算 {stats.over_budget} 个，节省约 {stats.tokens_saved} tokens。")
+        return packed_docs
+
+    @staticmethod
+    def _doc_dict(doc: Document, score: float | None, rerank_score: float | None = None) -> dict:
+        """将检索到的文档转换为返回给调用方的字典。"""
+        metadata = {**doc.metadata, 'score': score}
+        if rerank_score is not None:
+            metadata['rerank_score'] = rerank_score
+        return {"page_content": doc.page_content, "metadata": metadata}
+
+    def _build_prompt(self, query: str, documents: list) -> str:
+        """根据问题和上下文文档构建最终的Prompt。"""
         print("步骤3: 正在构建最终的Prompt...")
-        
-        doc_contents = [doc["page_content"] for doc in documents]
-        
-        context = "\n\n---\n\n".join(doc_contents)
-        final_prompt = PROMPT_TEMPLATE.format(question=query, context=context)
+        with span("prompt_build"):
+            doc_contents = [doc["page_content"] for doc in documents]
 
-        print("步骤4: 正在请求大语言模型生成最终答案...")
-        raw_response = self.llm.get_chat_completion(prompt=final_prompt, system_prompt="")
-        print("答案生成完毕。")
-        
+            context = CONTEXT_SEPARATOR.join(doc_contents)
+            return PROMPT_TEMPLATE.format(question=query, context=context)
+
+    def _parse_answer(self, raw_response: str, documents: list) -> Dict:
+        """
+        解析LLM返回的JSON字符串，失败时返回一个错误结构。
+
+        :param raw_response: LLM返回的原始字符串。
+        :param documents: 用于生成答案的上下文文档列表 (字典格式)。
+        :return: 结构化的答案字典。
+        """
         # 增强调试：打印LLM返回的原始字符串
         print("--- LLM 原始返回 ---")
         print(raw_response)
         print("--------------------")
         
         # 解析LLM返回的JSON字符串
-        try:
-            json_str = raw_response.strip().removeprefix("```json").removesuffix("```")
+        with span("json_parse"):
+            try:
+                json_str = raw_response.strip().removeprefix("```json").removesuffix("```")
             
-            # 增强清洗逻辑：同时处理qwen-turbo可能生成的`\%`和`\\%`两种非法转义
-            cleaned_json_str = json_str.replace('\\\\%', '%').replace('\\%', '%')
+                # 增强清洗逻辑：同时处理qwen-turbo可能生成的`\%`和`\\%`两种非法转义
+                cleaned_json_str = clean_llm_json(json_str)
             
-            parsed_response = json.loads(cleaned_json_str)
-            parsed_response['raw_context'] = documents
-            return parsed_response
-        except (json.JSONDecodeError, AttributeError) as e:
-            print(f"错误: 解析LLM返回的JSON失败 - {e}")
-            # 返回一个错误结构，以便前端可以优雅地处理
-            return {
-                "reasoning_steps": ["无法解析模型的响应。"],
-                "reasoning_summary": "模型返回的格式不正确，请稍后重试。",
-                "relevant_context": raw_response, # 返回原始响应以便调试
-                "final_answer": "抱歉，处理您的请求时发生错误。",
-                "raw_context": documents
-            }
-
-    def ask(self, query: str, top_k: int = 20, rerank_top_n: int = 5) -> Dict:
+                parsed_response = json.loads(cleaned_json_str)
+                parsed_response['raw_context'] = documents
+                return parsed_response
+            except (json.JSONDecodeError, AttributeError) as e:
+                print(f"错误: 解析LLM返回的JSON失败 - {e}")
+                # 返回一个错误结构，以便前端可以优雅地处理
+                return {
+                    "reasoning_steps": ["无法解析模型的响应。"],
+                    "reasoning_summary": "模型返回的格式不正确，请稍后重试。",
+                    "relevant_context": raw_response, # 返回原始响应以便调试
+                    "final_answer": PARSE_ERROR_ANSWER,
+                    "raw_context": documents
+                }
+
+    def generate_answer(self, query: str, documents: list) -> Dict:
+        """
+        根据提供的文档生成最终答案和思考过程。
+
+        :param query: 用户提出的问题。
+        :param documents: 用于生成答案的上下文文档列表 (字典格式)。
+        :return: LLM生成的包含思考过程的结构化JSON对象。
+        """
+        final_prompt = self._build_prompt(query, documents)
+
+        print("步骤4: 正在请求大语言模型生成最终答案...")
+        with span("llm_call"):
+            raw_response = self.llm.get_chat_completion(prompt=final_prompt, system_prompt="")
+        print("答案生成完毕。")
+
+        return self._parse_answer(raw_response, documents)
+
+    async def agenerate_answer(self, query: str, documents: list) -> Dict:
+        """
+        generate_answer 的异步版本。
+        """
+        final_prompt = self._build_prompt(query, documents)
+
+        print("步骤4: 正在请求大语言模型生成最终答案...")
+        with span("llm_call"):
+            raw_response = await self.llm.aget_chat_completion(prompt=final_prompt, system_prompt="")
+        print("答案生成完毕。")
+
+        return self._parse_answer(raw_response, documents)
+
+    @staticmethod
+    def _empty_answer() -> Dict:
+        """未检索到任何文档时返回的答案结构。"""
+        return {
+            "reasoning_steps": [],
+            "reasoning_summary": "未能找到相关文档。",
+            "relevant_context": "",
+            "final_answer": "抱歉，我在知识库中没有找到与您问题相关的信息。",
+            "raw_context": []
+        }
+
+    @staticmethod
+    def _retrieval_unavailable_answer() -> Dict:
+        """无法执行检索（如查询向量化失败）时返回的答案结构，此类答案不会写入缓存。"""
+        return {
+            "reasoning_steps": [],
+            "reasoning_summary": "检索服务暂时不可用。",
+            "relevant_context": "",
+            "final_answer": RETRIEVAL_UNAVAILABLE_ANSWER,
+            "raw_context": []
+        }
+
+    @staticmethod
+    def is_fallback_answer(answer: Dict) -> bool:
+        """判断答案是否为出错时的兜底答案（LLM响应解析失败或检索不可用），而非真正生成的答案。"""
+        return answer.get("final_answer") in (PARSE_ERROR_ANSWER, RETRIEVAL_UNAVAILABLE_ANSWER)
+
+    def ask(self, query: str, top_k: int = 20, rerank_top_n: int = 5, filters: dict = None) -> Dict:
         """
         接收问题, 执行完整的RAG流程, 并返回结构化的答案。
         
@@ -121,22 +464,225 @@ class QAService:
         - rerank_top_n: 从3增加到5，在扩大召回的基础上，为Rerank模型提供
                         更丰富的候选集，并最终为LLM提供更全面的上下文，
                         以提升复杂问题的分析和生成质量。
+        - filters: 可选的检索过滤条件（见 search_documents）。指定了过滤条件的问答不读写问答缓存。
         """
         print(f"\n--- 接收到问题: {query} ---")
-        final_docs = self.search_documents(query, top_k, rerank_top_n)
+        if self._flight is None:
+            return self._ask(query, top_k, rerank_top_n, filters)
+        answer, coalesced = self._flight.do(self._flight_key(query, top_k, rerank_top_n, filters),
+                                            self._ask, query, top_k, rerank_top_n, filters)
+        if coalesced:
+            print("相同的问题正在处理中，已合并到该请求。")
+            record_coalesced()
+        # 合并的请求共享同一个结果，各自返回一份浅拷贝，避免调用方修改彼此的答案
+        return dict(answer)
+
+    def _ask(self, query: str, top_k: int, rerank_top_n: int, filters: dict = None) -> Dict:
+        """ask 的实际流程。"""
+        try:
+            cached, query_embedding, index_version = self._lookup_cache(query, top_k, rerank_top_n, filters)
+            if cached is not None:
+                return cached
+            final_docs = self.search_documents(query, top_k, rerank_top_n, query_embedding=query_embedding, filters=filters)
+        except QueryEmbeddingError as e:
+            print(f"检索失败: {e}")
+            return self._retrieval_unavailable_answer()
         
         if not final_docs:
-            return {
-                "reasoning_steps": [],
-                "reasoning_summary": "未能找到相关文档。",
-                "relevant_context": "",
-                "final_answer": "抱歉，我在知识库中没有找到与您问题相关的信息。",
-                "raw_context": []
-            }
+            return self._empty_answer()
         
         answer = self.generate_answer(query, final_docs)
+        self._cache_answer(query, query_embedding, top_k, rerank_top_n, answer, filters, index_version)
         return answer
 
+    async def aask(self, query: str, top_k: int = 20, rerank_top_n: int = 5, filters: dict = None) -> Dict:
+        """
+        ask 的异步版本，供Web服务使用。
+        所有阻塞的检索与API调用都在LLM服务的有界线程池中执行，
+        因此单个服务进程可以同时处理多个问题。
+        """
+        print(f"\n--- 接收到问题: {query} ---")
+        if self._async_flight is None:
+            return await self._aask(query, top_k, rerank_top_n, filters)
+        answer, coalesced = await self._async_flight.do(
+            self._flight_key(query, top_k, rerank_top_n, filters), lambda: self._aask(query, top_k, rerank_top_n, filters)
+        )
+        if coalesced:
+            print("相同的问题正在处理中，已合并到该请求。")
+            record_coalesced()
+        return dict(answer)
+
+    async def _aask(self, query: str, top_k: int, rerank_top_n: int, filters: dict = None) -> Dict:
+        """aask 的实际流程。"""
+        try:
+            cached, query_embedding, index_version = await self._alookup_cache(query, top_k, rerank_top_n, filters)
+            if cached is not None:
+                return cached
+            final_docs = await self.asearch_documents(query, top_k, rerank_top_n, query_embedding=query_embedding, filters=filters)
+        except QueryEmbeddingError as e:
+            print(f"检索失败: {e}")
+            return self._retrieval_unavailable_answer()
+
+        if not final_docs:
+            return self._empty_answer()
+
+        answer = await self.agenerate_answer(query, final_docs)
+        self._cache_answer(query, query_embedding, top_k, rerank_top_n, answer, filters, index_version)
+        return answer
+
+    async def aask_batch(self, queries: list[str], top_k: int = 20, rerank_top_n: int = 5, filters: dict = None) -> list[Dict]:
+        """
+        一次回答多个问题。流程的前半段在所有问题间共享：
+        所有问题的向量通过批量Embedding接口计算，向量检索合并为一次矩阵运算，
+        各问题召回的候选文档块去重后统一读取；之后各问题的Rerank与生成并发执行。
+
+        :param queries: 问题列表。规范化后相同的问题只处理一次。
+        :param filters: 可选，所有问题共用的检索过滤条件（见 search_documents），指定时不读写问答缓存。
+        :return: 与queries一一对应的答案列表。
+        """
+        print(f"\n--- 接收到批量问题: {len(queries)} 个 ---")
+        unique_queries = {}
+        for query in queries:
+            unique_queries.setdefault(AnswerCache.normalize_query(query), query)
+        answers = {}
+        # 向量库已更新时先重新加载检索索引，之后的缓存查询与检索都基于新的向量库
+        index_version = await self.llm.arun(self._refresh_indexes)
+
+        pending = []
+        for key, query in unique_queries.items():
+            cached = self.answer_cache.get_exact(query, top_k, rerank_top_n) if self.answer_cache is not None and not filters else None
+            if cached is not None:
+                record_cache_lookup("exact")
+                answers[key] = cached
+            else:
+                pending.append(key)
+
+        if pending:
+            print(f"步骤1: 正在批量计算 {len(pending)} 个问题的向量并检索相关文档...")
+            try:
+                embeddings = await self.llm.arun(self.kb_manager.embedding_function.embed_queries, [unique_queries[key] for key in pending])
+            except QueryEmbeddingError as e:
+                print(f"检索失败: {e}")
+                for key in pending:
+                    answers[key] = self._retrieval_unavailable_answer()
+                return [answers[AnswerCache.normalize_query(query)] for query in queries]
+            to_answer = []
+            for key, query_embedding in zip(pending, embeddings):
+                if self.answer_cache is not None and not filters:
+                    cached = self.answer_cache.get_semantic(query_embedding, top_k, rerank_top_n)
+                    record_cache_lookup("semantic" if cached is not None else "miss")
+                    if cached is not None:
+                        answers[key] = cached
+                        continue
+                to_answer.append((key, query_embedding))
+
+            retrieved = await self.llm.arun(
+                self._retrieve_many, [unique_queries[key] for key, _ in to_answer], [e for _, e in to_answer], top_k, filters
+            )
+
+            async def answer_one(key: str, query_embedding, retrieved_docs: list):
+                query = unique_queries[key]
+                final_docs = await self._arerank(query, retrieved_docs, rerank_top_n) if retrieved_docs else []
+                if not final_docs:
+                    answers[key] = self._empty_answer()
+                    return
+                answers[key] = await self.agenerate_answer(query, final_docs)
+                self._cache_answer(query, query_embedding, top_k, rerank_top_n, answers[key], filters, index_version)
+
+            await asyncio.gather(*(
+                answer_one(key, query_embedding, retrieved_docs)
+                for (key, query_embedding), retrieved_docs in zip(to_answer, retrieved)
+            ))
+
+        return [answers[AnswerCache.normalize_query(query)] for query in queries]
+
+    @staticmethod
+    def _flight_key(query: str, top_k: int, rerank_top_n: int, filters: dict = None) -> tuple:
+        """请求合并的键，与精确缓存使用相同的问题规范化规则。"""
+        scope = json.dumps(normalize_filters(filters), sort_keys=True, ensure_ascii=False)
+        return AnswerCache.normalize_query(query), top_k, rerank_top_n, scope
+
+    def _lookup_cache(self, query: str, top_k: int, rerank_top_n: int, filters: dict = None):
+        """
+        依次查询精确与语义缓存。缓存不区分检索范围，因此指定了过滤条件时不查询缓存。
+
+        缓存与检索索引依据同一个构建标记失效：向量库更新后，先重新加载检索索引，再查询随之清空的缓存。
+
+        :return: (命中的缓存答案或None, 问题向量或None, 检索索引对应的向量库版本或None)
+        """
+        if self.answer_cache is None or filters:
+            return None, None, None
+        index_version = self._refresh_indexes()
+        cached = self.answer_cache.get_exact(query, top_k, rerank_top_n)
+        if cached is not None:
+            print("命中问答缓存 (精确匹配)。")
+            record_cache_lookup("exact")
+            return cached, None, index_version
+
+        query_embedding = self._embed_query(query)
+        cached = self.answer_cache.get_semantic(query_embedding, top_k, rerank_top_n)
+        if cached is not None:
+            print("命中问答缓存 (语义匹配)。")
+        record_cache_lookup("semantic" if cached is not None else "miss")
+        return cached, query_embedding, index_version
+
+    async def _alookup_cache(self, query: str, top_k: int, rerank_top_n: int, filters: dict = None):
+        """_lookup_cache 的异步版本（问题向量的计算在线程池中执行）。"""
+        return await self.llm.arun(self._lookup_cache, query, top_k, rerank_top_n, filters)
+
+    async def aask_stream(self, query: str, top_k: int = 20, rerank_top_n: int = 5, filters: dict = None):
+        """
+        流式版本的问答流程，按阶段产出事件，供SSE接口逐步推送：
+        - context: 检索与重排完成后立即发送的上下文文档 (raw_context)
+        - delta:   LLM新生成的文本片段
+        - field:   某个JSON字段（如 reasoning_steps、final_answer）完整生成后的解析结果
+        - done:    完整解析后的最终答案（不再重复包含 raw_context）
+
+        :return: 一个异步生成器，每个元素为 {"event": 事件名, "data": 数据}。
+        """
+        print(f"\n--- 接收到问题 (流式): {query} ---")
+        try:
+            cached, query_embedding, index_version = await self._alookup_cache(query, top_k, rerank_top_n, filters)
+            if cached is None:
+                final_docs = await self.asearch_documents(query, top_k, rerank_top_n, query_embedding=query_embedding,
+                                                          filters=filters)
+        except QueryEmbeddingError as e:
+            print(f"检索失败: {e}")
+            cached = self._retrieval_unavailable_answer()
+        if cached is not None:
+            # 命中缓存时（或检索不可用时）按相同的事件顺序一次性回放完整答案
+            yield {"event": "context", "data": cached.pop("raw_context", [])}
+            for name, value in cached.items():
+                yield {"event": "field", "data": {"name": name, "value": value}}
+            yield {"event": "done", "data": cached}
+            return
+
+        yield {"event": "context", "data": final_docs}
+
+        if not final_docs:
+            answer = self._empty_answer()
+            answer.pop("raw_context")
+            yield {"event": "done", "data": answer}
+            return
+
+        final_prompt = self._build_prompt(query, final_docs)
+
+        print("步骤4: 正在以流式方式请求大语言模型生成最终答案...")
+        parser = StreamingJSONFieldParser()
+        raw_chunks = []
+        with span("llm_call"):
+            async for delta in self.llm.aget_chat_completion_stream(prompt=final_prompt, system_prompt=""):
+                raw_chunks.append(delta)
+                yield {"event": "delta", "data": delta}
+                for name, value in parser.feed(delta):
+                    yield {"event": "field", "data": {"name": name, "value": value}}
+        print("答案生成完毕。")
+
+        answer = self._parse_answer("".join(raw_chunks), final_docs)
+        self._cache_answer(query, query_embedding, top_k, rerank_top_n, answer, filters, index_version)
+        answer.pop("raw_context", None)
+        yield {"event": "done", "data": answer}
+
 def run_batch_mode(qa_service: QAService):
     """
     运行批量问答模式。
@@ -155,22 +701,22 @@ def run_batch_mode(qa_service: QAService):
         print(f"错误: 问题文件 {questions_path} 格式不正确。")
         return
 
-    results = []
-    total_questions = len(questions)
-    print(f"共找到 {total_questions} 个问题，开始逐一处理...")
+    question_texts = [item.get("text") for item in questions if item.get("text")]
+    print(f"共找到 {len(question_texts)} 个问题，开始并行处理...")
 
-    for i, item in enumerate(questions):
-        question_text = item.get("text")
-        if not question_text:
-            continue
-        
-        print(f"\n--- 正在处理问题 {i+1}/{total_questions} ---")
-        answer = qa_service.ask(question_text)
-        results.append(answer)
+    # 每完成一个问题即写入检查点，中断后重新运行会跳过已完成的问题
+    checkpoint_path = os.path.join(os.path.dirname(answers_path), "answers.checkpoint.jsonl")
+    results = BatchRunner(qa_service, checkpoint_path).run(question_texts)
 
     with open(answers_path, 'w', encoding='utf-8') as f:
         json.dump(results, f, ensure_ascii=False, indent=4)
-    
+
+    if any(result is None for result in results):
+        print(f"\n--- ⚠️ 部分问题处理失败，结果已保存到 {answers_path}。重新运行将从检查点 {checkpoint_path} 继续。 ---")
+        return
+    # 全部完成后删除检查点，下一次运行将重新回答所有问题
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
     print(f"\n--- ✅ 批量问答完成！结果已保存到 {answers_path} ---")
 
 
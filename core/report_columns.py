@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+@file: report_columns.py
+@desc: 已解析研报的紧凑列式二进制格式 (.rcol)。
+       minerU输出的JSON是一个元素列表，每个元素含 type、text、table_body、page_idx、text_level 等字段。
+       构建知识库时逐个JSON解析并经过jq表达式处理的开销很大；本格式将这些字段按列存储，
+       读取时以内存映射方式打开文件，只解码需要的列。
+
+文件布局（小端序）:
+    头部:   魔数 b"RCOL" | 版本 u16 | 行数 u32 | 列数 u16
+    列目录: 每列 名称长度 u16 | 名称(UTF-8) | 类型 u8 | 数据偏移 u64 | 数据长度 u64
+    数据区:
+      - 整数列 (类型0): n 个 int32，-1 表示缺失
+      - 字符串列 (类型1): n 字节的缺失标记 | n+1 个 int64 偏移 | UTF-8 数据
+"""
+import os
+import json
+import mmap
+import struct
+from array import array
+
+MAGIC = b"RCOL"
+VERSION = 1
+EXTENSION = ".rcol"
+
+_HEADER = struct.Struct("<4sHIH")
+_COLUMN_ENTRY = struct.Struct("<BQQ")
+_INT_COLUMN, _STR_COLUMN = 0, 1
+_INT_NULL = -1
+
+# 存储的列及其类型；非对象元素（如纯字符串）的内容按jq的 tostring 规则存入 text 列
+COLUMNS = (
+    ("type", _STR_COLUMN),
+    ("text", _STR_COLUMN),
+    ("table_body", _STR_COLUMN),
+    ("page_idx", _INT_COLUMN),
+    ("text_level", _INT_COLUMN),
+)
+
+
+def columnar_path(json_path: str) -> str:
+    """JSON文件对应的列式文件路径（与JSON文件位于同一目录）。"""
+    return os.path.splitext(json_path)[0] + EXTENSION
+
+
+def _to_string(value):
+    if value is None or value is False:
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _to_int(value) -> int:
+    return value if isinstance(value, int) and not isinstance(value, bool) and 0 <= value < 2 ** 31 else _INT_NULL
+
+
+def _column_values(records: list, name: str) -> list:
+    if name == "text":
+        return [_to_string(record.get("text") if isinstance(record, dict) else record) for record in records]
+    return [record.get(name) if isinstance(record, dict) else None for record in records]
+
+
+def _read_array(typecode: str, data) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+def _encode_column(values: list, kind: int) -> bytes:
+    if kind == _INT_COLUMN:
+        return array("i", [_to_int(value) for value in values]).tobytes()
+    nulls = bytearray(len(values))
+    offsets = array("q", [0])
+    blob = bytearray()
+    for i, value in enumerate(values):
+        value = _to_string(value)
+        if value is None:
+            nulls[i] = 1
+        else:
+            blob += value.encode("utf-8")
+        offsets.append(len(blob))
+    return bytes(nulls) + offsets.tobytes() + bytes(blob)
+
+
+def write_report_columns(path: str, records: list):
+    """
+    将minerU的解析结果（元素列表）写入列式文件。先写临时文件再原子替换。
+
+    :param path: 目标文件路径（通常由 columnar_path 得到）。
+    :param records: minerU content_list 风格的元素列表。
+    """
+    payloads = [(name.encode("utf-8"), kind, _encode_column(_column_values(records, name), kind))
+                for name, kind in COLUMNS]
+    directory_size = sum(2 + len(name) + _COLUMN_ENTRY.size for name, _, _ in payloads)
+    offset = _HEADER.size + directory_size
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(records), len(payloads)))
+        for name, kind, data in payloads:
+            f.write(struct.pack("<H", len(name)) + name + _COLUMN_ENTRY.pack(kind, offset, len(data)))
+            offset += len(data)
+        for _, _, data in payloads:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ReportColumns:
+    """以内存映射方式读取列式文件，按需解码单个列。"""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"'{path}' 不是有效的列式文件")
+        magic, version, self.num_rows, num_columns = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{path}' 不是有效的列式文件（版本 {version}）")
+
+        self._columns = {}
+        pos = _HEADER.size
+        for _ in range(num_columns):
+            (name_length,) = struct.unpack_from("<H", self._mmap, pos)
+            name = bytes(self._mmap[pos + 2:pos + 2 + name_length]).decode("utf-8")
+            pos += 2 + name_length
+            self._columns[name] = _COLUMN_ENTRY.unpack_from(self._mmap, pos)
+            pos += _COLUMN_ENTRY.size
+
+    def __len__(self):
+        return self.num_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+
+    def column(self, name: str) -> list:
+        """
+        解码一列。字符串列返回 str 或 None 的列表，整数列返回 int 或 None 的列表。
+        只会访问该列所在的文件区域。
+        """
+        kind, offset, length = self._columns[name]
+        n = self.num_rows
+        data = memoryview(self._mmap)[offset:offset + length]
+        if kind == _INT_COLUMN:
+            return [None if value == _INT_NULL else value for value in _read_array("i", data)]
+
+        nulls = data[:n]
+        offsets = _read_array("q", data[n:n + (n + 1) * 8])
+        blob = data[n + (n + 1) * 8:]
+        values = [
+            None if nulls[i] else str(blob[offsets[i]:offsets[i + 1]], "utf-8")
+            for i in range(n)
+        ]
+        return values
+
+    def page_contents(self) -> list[str]:
+        """
+        每个元素的正文，规则与原先的jq表达式一致：优先取 text，其次取 table_body，否则为空字符串。
+        """
+        return [
+            text if text is not None else (table_body if table_body is not None else "")
+            for text, table_body in zip(self.column("text"), self.column("table_body"))
+        ]
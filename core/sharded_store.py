@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+@file: sharded_store.py
+@desc: 分片向量库。语料扩展到大量公司和券商后，单个向量库的全量重建越来越慢，检索也只能在一个进程内顺序扫描。
+       本模块按JSON文件相对路径的哈希将知识库划分为 N 个分片，每个分片是一个独立的
+       KnowledgeBaseManager（各自的向量库、清单、NumPy与BM25索引），可以单独重建或同步；
+       检索时在线程池中并行查询所有分片，再按距离（BM25按得分）归并各分片的 top-k。
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.schema import Document
+
+# 将项目根目录添加到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.knowledge_base_manager import KnowledgeBaseManager
+from core.llm_service import QwenLLM
+from core.partitions import PartitionIndex, to_chroma_where
+from config import PROCESSED_REPORTS_DIR, VECTOR_STORE_DIR, VECTOR_STORE_SHARDS, LLM_MAX_CONCURRENCY
+
+# 分片根目录为 VECTOR_STORE_DIR 加上该后缀的同级目录。不能放在 VECTOR_STORE_DIR 之内：
+# 不分片的全量构建会将 VECTOR_STORE_DIR 整体替换，其中的分片会被一并删除
+SHARDS_DIR_SUFFIX = "_shards"
+
+
+def shard_of(rel_path: str, num_shards: int) -> int:
+    """
+    按JSON文件相对 processed_dir 的路径返回其所属的分片编号。
+    使用md5而不是内置的hash()，保证不同进程、不同次运行的分配结果一致。
+    """
+    digest = hashlib.md5(rel_path.replace(os.sep, "/").encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def search_vectors(db, query_embeddings: list, top_k: int, filters: dict = None) -> list[list]:
+    """
+    以同一过滤条件在一个检索后端中检索多个向量。NumPy后端（及分片后端）与Chroma均支持一次查询多个向量，
+    其他后端逐个检索。NumPy后端只对匹配分区内的行打分；Chroma后端将过滤条件转换为 where 表达式。
+
+    :return: 与query_embeddings一一对应的 [(Document, 距离)] 列表。
+    """
+    if hasattr(db, "similarity_search_by_vectors_with_relevance_scores"):
+        return db.similarity_search_by_vectors_with_relevance_scores(query_embeddings, k=top_k, filters=filters)
+    where = to_chroma_where(filters)
+    if len(query_embeddings) > 1 and hasattr(db, "_collection"):
+        result = db._collection.query(
+            query_embeddings=query_embeddings, n_results=top_k, where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            [(Document(page_content=text, metadata=metadata or {}), distance)
+             for text, metadata, distance in zip(texts, metadatas, distances)]
+            for texts, metadatas, distances in zip(result["documents"], result["metadatas"], result["distances"])
+        ]
+    filter_kwargs = {"filter": where} if where else {}
+    return [
+        db.similarity_search_by_vector_with_relevance_scores(query_embedding, k=top_k, **filter_kwargs)
+        for query_embedding in query_embeddings
+    ]
+
+
+class ShardedSearchBackend:
+    """
+    将多个分片的检索后端（Chroma或NumPy索引）组合为一个，检索接口与 NumpyVectorIndex 一致。
+    各分片的距离度量相同，可以直接比较，因此归并时按距离取全局最小的k个。
+    """
+
+    def __init__(self, backends: list, executor: ThreadPoolExecutor):
+        self.backends = backends
+        self.executor = executor
+        # 各分片分区的拼接，行号与 get() 不带ids时返回的顺序一致；有分片没有分区（Chroma后端）时为None
+        partitions = [getattr(backend, "partitions", None) for backend in backends]
+        self.partitions = None if not partitions or any(p is None for p in partitions) else PartitionIndex.concat(partitions)
+
+    def __len__(self):
+        return sum(len(backend) if hasattr(backend, "__len__") else backend._collection.count()
+                   for backend in self.backends)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k: int = 4, filters: dict = None,
+                                                          **kwargs) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vectors_with_relevance_scores([embedding], k=k, filters=filters)[0]
+
+    def similarity_search_by_vectors_with_relevance_scores(self, embeddings, k: int = 4,
+                                                           filters: dict = None) -> list[list[tuple[Document, float]]]:
+        """
+        并行地在每个分片中检索 top-k，再为每个查询向量归并出全局的 top-k。
+
+        :return: 与embeddings一一对应的 [(Document, 距离)] 列表，按距离从小到大排列。
+        """
+        embeddings = list(embeddings)
+        per_shard = list(self.executor.map(lambda backend: search_vectors(backend, embeddings, k, filters), self.backends))
+        return [
+            heapq.nsmallest(k, (hit for shard_results in per_shard for hit in shard_results[i]), key=lambda hit: hit[1])
+            for i in range(len(embeddings))
+        ]
+
+    def get(self, ids: list[str] = None, include: list[str] = None, **kwargs) -> dict:
+        """按ID从所有分片取回文档，返回结构与 Chroma.get 相同。"""
+        include = include or ["documents", "metadatas"]
+        pages = list(self.executor.map(lambda backend: backend.get(ids=ids, include=include, **kwargs), self.backends))
+        result = {"ids": [i for page in pages for i in page["ids"]]}
+        for field in ("documents", "metadatas", "embeddings"):
+            result[field] = [value for page in pages for value in page[field]] if field in include else None
+        return result
+
+
+class ShardedLexicalIndex:
+    """
+    将多个分片的BM25索引组合为一个，检索接口与 LexicalIndex 一致。
+    IDF与平均文档长度按分片各自统计，分片由哈希均匀划分时与全局统计相差很小。
+    """
+
+    def __init__(self, indexes: list, executor: ThreadPoolExecutor):
+        self.indexes = indexes
+        self.executor = executor
+
+    def __len__(self):
+        return sum(len(index) for index in self.indexes)
+
+    def search(self, query: str, k: int = 20, filters: dict = None) -> list[tuple[str, float]]:
+        """并行地在每个分片中检索，返回得分最高的k个 [(文档块ID, BM25得分)]。"""
+        per_shard = self.executor.map(lambda index: index.search(query, k, filters=filters), self.indexes)
+        return heapq.nlargest(k, (hit for hits in per_shard for hit in hits), key=lambda hit: hit[1])
+
+
+class ShardedKnowledgeBase:
+    """
+    分片知识库，对外提供与 KnowledgeBaseManager 相同的构建、同步与加载接口，可直接替换后者供问答服务使用。
+    第 i 个分片存放在 root_directory/shard_{i:02d} 下，只包含 shard_of() 分配给它的JSON文件。
+    """
+    LAYOUT_FILENAME = "shards.json"
+    BUILD_STAMP_FILENAME = KnowledgeBaseManager.BUILD_STAMP_FILENAME
+
+    def __init__(self, num_shards: int = VECTOR_STORE_SHARDS, processed_dir: str = PROCESSED_REPORTS_DIR,
+                 root_directory: str = None, llm: QwenLLM = None, max_concurrent_searches: int = None):
+        """
+        :param num_shards: 分片数量。
+        :param processed_dir: 已处理（JSON）文件所在的目录。
+        :param root_directory: 分片根目录，默认为与 VECTOR_STORE_DIR 同级的 VECTOR_STORE_DIR + "_shards"。
+        :param llm: 可选，共享的QwenLLM实例；未提供时自动创建。
+        :param max_concurrent_searches: 同时在途的检索请求数上限，默认与问答服务执行检索的线程池一致
+                                        (llm.max_concurrency，未提供llm时为 LLM_MAX_CONCURRENCY)。
+        """
+        if num_shards < 1:
+            raise ValueError(f"分片数量必须大于0: {num_shards}")
+        self.num_shards = num_shards
+        self.processed_dir = processed_dir
+        self.root_directory = root_directory or os.path.normpath(VECTOR_STORE_DIR) + SHARDS_DIR_SUFFIX
+
+        # 所有分片共用同一个Embedding对象（及其缓存与限流）
+        first = KnowledgeBaseManager(processed_dir, self.shard_directory(0), llm=llm, source_filter=self._source_filter(0))
+        self.embedding_function = first.embedding_function
+        self.shards = [first] + [
+            KnowledgeBaseManager(processed_dir, self.shard_directory(shard), embedding_function=self.embedding_function,
+                                 source_filter=self._source_filter(shard))
+            for shard in range(1, num_shards)
+        ]
+        # 每个在途的检索请求在每个分片上各占用一个线程，并发的请求之间不必排队等待彼此的分片检索；
+        # NumPy的矩阵乘法与Chroma的查询都在原生代码中执行并释放GIL
+        max_concurrent_searches = max_concurrent_searches or (llm.max_concurrency if llm is not None else LLM_MAX_CONCURRENCY)
+        self._executor = ThreadPoolExecutor(max_workers=num_shards * max_concurrent_searches,
+                                            thread_name_prefix="shard-search")
+        self._search_backend = None
+
+    def shard_directory(self, shard: int) -> str:
+        return os.path.join(self.root_directory, f"shard_{shard:02d}")
+
+    def _source_filter(self, shard: int):
+        return lambda rel_path: shard_of(rel_path, self.num_shards) == shard
+
+    @property
+    def build_stamp_path(self) -> str:
+        """分片知识库的构建标记，任一分片被重建或同步出变化时更新。"""
+        return os.path.join(self.root_directory, self.BUILD_STAMP_FILENAME)
+
+    def _write_build_stamp(self):
+        with open(self.build_stamp_path, 'w', encoding='utf-8') as f:
+            f.write(time.strftime("%Y-%m-%d %H:%M:%S"))
+
+    @property
+    def layout_path(self) -> str:
+        return os.path.join(self.root_directory, self.LAYOUT_FILENAME)
+
+    def _layout_matches(self) -> bool:
+        """已构建的分片数量是否与当前配置一致。"""
+        try:
+            with open(self.layout_path, 'r', encoding='utf-8') as f:
+                layout = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return layout == {"num_shards": self.num_shards}
+
+    def _reset_layout(self):
+        """分片配置变化时清空分片根目录，并记录新的分片配置。"""
+        for manager in self.shards:
+            manager.close_db()
+        if os.path.exists(self.root_directory):
+            shutil.rmtree(self.root_directory)
+        os.makedirs(self.root_directory, exist_ok=True)
+        with open(self.layout_path, 'w', encoding='utf-8') as f:
+            json.dump({"num_shards": self.num_shards}, f)
+
+    def _active_shards(self) -> list[KnowledgeBaseManager]:
+        """已构建的分片。没有分配到任何文件的分片不会生成向量库。"""
+        return [shard for shard in self.shards if os.path.exists(shard.persist_directory)]
+
+    def build_db(self, shards: list[int] = None, chunk_size=500, chunk_overlap=50) -> list:
+        """
+        全量重建指定的分片，其余分片保持不变。分片依次构建，以免多个分片争抢Embedding API的限流额度。
+        分片数与已构建的分片不一致时，清空后重建全部分片。
+
+        :param shards: 要重建的分片编号，默认全部。
+        :return: 各被重建分片的向量数据库对象（没有分配到文件的分片为None）。
+        """
+        if not self._layout_matches():
+            if shards is not None:
+                print("分片数量已变化，将重建全部分片。")
+            self._reset_layout()
+            shards = None
+        shards = range(self.num_shards) if shards is None else shards
+
+        results = []
+        for shard in shards:
+            manager = self.shards[shard]
+            print(f"--- 正在构建分片 {shard} ({manager.persist_directory}) ---")
+            if not manager._list_source_files():
+                # 没有文件的分片删除旧的向量库，避免检索到已不存在的文件
+                if os.path.exists(manager.persist_directory):
+                    manager.close_db()
+                    shutil.rmtree(manager.persist_directory)
+                results.append(None)
+                continue
+            results.append(manager.build_db(chunk_size, chunk_overlap))
+        self._write_build_stamp()
+        self._search_backend = None
+        return results
+
+    def sync(self, chunk_size=500, chunk_overlap=50) -> list:
+        """
+        逐个增量同步各分片（见 KnowledgeBaseManager.sync），文件所属的分片由其路径决定，不会在分片之间移动。
+        分片配置变化或尚未构建时执行全量构建。
+
+        :return: 各分片的向量数据库对象（没有分配到文件的分片为None）。
+        """
+        if not self._layout_matches():
+            print("未找到与当前配置一致的分片，将执行全量构建。")
+            return self.build_db(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+        results, changed = [], False
+        for shard, manager in enumerate(self.shards):
+            if not manager._list_source_files() and not os.path.exists(manager.persist_directory):
+                results.append(None)
+                continue
+            print(f"--- 正在同步分片 {shard} ---")
+            stamp = manager._read_build_stamp()
+            results.append(manager.sync(chunk_size, chunk_overlap))
+            changed = changed or manager._read_build_stamp() != stamp
+        if changed or not os.path.exists(self.build_stamp_path):
+            self._write_build_stamp()
+            self._search_backend = None
+        return results
+
+    def load_search_backend(self) -> ShardedSearchBackend:
+        """加载各分片的检索后端（由配置项 RETRIEVAL_BACKEND 决定），组合为并行检索的分片后端。"""
+        return ShardedSearchBackend([shard.load_search_backend() for shard in self._active_shards()], self._executor)
+
+    def load_lexical_index(self) -> ShardedLexicalIndex:
+        return ShardedLexicalIndex([shard.load_lexical_index() for shard in self._active_shards()], self._executor)
+
+    def load_partition_index(self) -> PartitionIndex:
+        return PartitionIndex.concat([shard.load_partition_index() for shard in self._active_shards()])
+
+    def close_db(self, stop: bool = True):
+        """关闭各分片的向量数据库，见 KnowledgeBaseManager.close_db。"""
+        for manager in self.shards:
+            manager.close_db(stop)
+        self._search_backend = None
+
+    def similarity_search(self, query: str, k: int = 5) -> list[Document]:
+        """在所有分片中执行相似度搜索。"""
+        if self._search_backend is None:
+            self._search_backend = self.load_search_backend()
+        embedding = self.embedding_function.embed_query(query)
+        results = self._search_backend.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        return [doc for doc, _ in results]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
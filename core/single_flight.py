@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+@file: single_flight.py
+@desc: 请求合并 (single-flight)：相同键的调用同时在途时只真正执行一次，
+       其余调用等待并共享同一个结果（或异常）。分别提供线程版本与asyncio版本。
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """线程版本，用于在线程池中执行的同步调用（如查询Embedding）。"""
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        执行 func(*args, **kwargs)；若相同key的调用正在执行，则等待其完成并返回相同的结果。
+
+        :return: (结果, 是否为合并到他人调用的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """asyncio版本，用于合并相同的问答请求。"""
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, coro_factory):
+        """
+        执行 coro_factory() 返回的协程；若相同key的协程正在执行，则等待其完成并返回相同的结果。
+        实际的执行放在独立的任务中，任何一个调用方被取消（如客户端断开）都不会影响其他调用方。
+
+        :return: (结果, 是否为合并到他人调用的结果)
+        """
+        task = self._tasks.get(key)
+        is_follower = task is not None
+        if not is_follower:
+            task = asyncio.ensure_future(coro_factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._tasks.pop(key) if self._tasks.get(key) is done else None)
+        return await asyncio.shield(task), is_follower
+
+    def __len__(self):
+        return len(self._tasks)
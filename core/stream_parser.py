@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+@file: stream_parser.py
+@desc: 增量解析LLM流式输出的JSON答案，每当一个顶层字段（如 reasoning_steps、final_answer）
+       完整到达时立即将其解析出来，供流式接口逐字段推送给前端。
+"""
+import json
+
+
+def clean_llm_json(json_str: str) -> str:
+    """
+    清洗LLM输出中的非法转义：同时处理qwen-turbo可能生成的`\\%`和`\\\\%`两种写法。
+    """
+    return json_str.replace('\\\\%', '%').replace('\\%', '%')
+
+
+class StreamingJSONFieldParser:
+    """
+    一个面向单个JSON对象的增量解析器。
+
+    LLM按照Prompt返回形如 ```json {"reasoning_steps": [...], "final_answer": "..."} ``` 的内容，
+    但在流式模式下它是被切成任意片段陆续到达的。该解析器逐字符扫描已到达的内容，
+    只跟踪字符串/转义状态与括号深度，当某个顶层字段的值结束（遇到同层的 `,` 或 `}`）时，
+    对该值单独执行 json.loads 并返回 (字段名, 值)。每个字段只会被返回一次。
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        # 状态: seek_object -> seek_key -> in_key -> seek_colon -> seek_value -> in_value -> seek_key ... -> finished
+        self._state = "seek_object"
+        self._key_start = 0
+        self._key = None
+        self._value_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def finished(self) -> bool:
+        """顶层对象是否已经完整结束。"""
+        return self._state == "finished"
+
+    def feed(self, text: str) -> list[tuple[str, object]]:
+        """
+        输入新到达的文本片段。
+
+        :param text: LLM流式返回的增量文本。
+        :return: 本次输入后新完成的 (字段名, 值) 列表，可能为空。
+        """
+        self._buffer += text
+        completed = []
+        buffer = self._buffer
+        while self._pos < len(buffer) and self._state != "finished":
+            ch = buffer[self._pos]
+            state = self._state
+
+            if state == "seek_object":
+                if ch == "{":
+                    self._state = "seek_key"
+            elif state == "seek_key":
+                if ch == '"':
+                    self._key_start = self._pos + 1
+                    self._state = "in_key"
+                elif ch == "}":
+                    self._state = "finished"
+            elif state == "in_key":
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._key = json.loads(f'"{buffer[self._key_start:self._pos]}"')
+                    self._state = "seek_colon"
+            elif state == "seek_colon":
+                if ch == ":":
+                    self._state = "seek_value"
+            elif state == "seek_value":
+                if not ch.isspace():
+                    self._value_start = self._pos
+                    self._depth = 0
+                    self._in_string = False
+                    self._state = "in_value"
+                    # 当前字符也属于值本身，交给 in_value 状态重新处理
+                    continue
+            elif state == "in_value":
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._in_string = True
+                elif ch in "[{":
+                    self._depth += 1
+                elif ch in "]}" and self._depth > 0:
+                    self._depth -= 1
+                elif ch in ",}" and self._depth == 0:
+                    raw_value = buffer[self._value_start:self._pos].strip()
+                    completed.append((self._key, self._decode_value(raw_value)))
+                    self._state = "seek_key" if ch == "," else "finished"
+            self._pos += 1
+        return completed
+
+    @staticmethod
+    def _decode_value(raw_value: str):
+        """解析单个字段的值，失败时退化为原始文本。"""
+        try:
+            return json.loads(clean_llm_json(raw_value))
+        except json.JSONDecodeError:
+            return raw_value
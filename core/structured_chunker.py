@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+@file: structured_chunker.py
+@desc: 基于minerU版面信息的结构化分块。minerU输出的每个元素（单行文字、标题、表格）都很短，
+       逐元素分割会产生大量细碎的文档块，每个都要单独向量化、占用一个索引位置。
+       本模块按 type、text_level、page_idx 将同一标题下相邻的段落合并到目标长度，表格单独成块（过长的表格按行切分并重复表头），
+       并在元数据中记录文档块覆盖的页码范围与所属章节。
+"""
+import re
+import json
+from dataclasses import dataclass
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# 文档块内相邻元素之间的分隔符
+ELEMENT_SEPARATOR = "\n"
+# 章节路径中各级标题之间的分隔符
+SECTION_SEPARATOR = " > "
+# minerU表格 (table_body) 中的一行
+_TABLE_ROW_PATTERN = re.compile(r"<tr[\s>].*?</tr>", re.IGNORECASE | re.DOTALL)
+
+
+@dataclass
+class LayoutElement:
+    """minerU content_list 中的一个元素。"""
+    seq_num: int           # 元素在列表中从1开始的序号
+    type: str | None       # text / table / image / equation 等；非对象元素为None
+    content: str           # 正文：优先取 text，其次取 table_body
+    page_idx: int | None
+    text_level: int | None  # 标题层级，正文为None
+
+    @classmethod
+    def from_record(cls, seq_num: int, record) -> "LayoutElement":
+        """由JSON中的一个元素构造，正文的取值规则与加载文档时的jq表达式一致。"""
+        if not isinstance(record, dict):
+            content = record if isinstance(record, str) else json.dumps(record, ensure_ascii=False)
+            return cls(seq_num, None, content, None, None)
+        content = record.get("text") or record.get("table_body") or ""
+        return cls(seq_num, record.get("type"), content if isinstance(content, str) else str(content),
+                   cls._to_int(record.get("page_idx")), cls._to_int(record.get("text_level")))
+
+    @staticmethod
+    def _to_int(value):
+        return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+    @property
+    def is_heading(self) -> bool:
+        return self.type == "text" and self.text_level is not None and self.text_level > 0
+
+    @property
+    def is_table(self) -> bool:
+        return self.type == "table"
+
+
+class StructuredChunker:
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50, max_table_size: int = 1500):
+        """
+        :param chunk_size: 合并段落时文档块的目标长度（字符数）。表格不受此限制。
+        :param chunk_overlap: 单个段落超过 chunk_size 需要切开时，相邻片段的重叠字符数。
+                              由完整段落合并而成的文档块之间不重叠。
+        :param max_table_size: 表格文档块的最大长度（字符数）。更长的表格（如年报中的财务报表）按行切分，
+                               每个片段都重复表头，以免超出Embedding模型单条文本的长度上限。
+        """
+        self.chunk_size = chunk_size
+        self.max_table_size = max_table_size
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.table_splitter = RecursiveCharacterTextSplitter(chunk_size=max_table_size, chunk_overlap=chunk_overlap)
+
+    def chunk(self, elements, source: str) -> list[Document]:
+        """
+        将一份研报的元素序列切分为文档块。
+
+        - 标题结束当前文档块并开始新的章节，标题文字作为该章节第一个正文文档块的开头；
+          没有正文的标题（后面紧跟同级或更高级的标题）单独成块，使每个文档块的章节路径包含其中的全部标题；
+        - 同一章节内相邻的段落依次合并，加入下一个段落会超过 chunk_size 时开始新的文档块，跨页不打断；
+        - 表格单独成块，超过 max_table_size 时按行切分（见 _split_table）；
+        - 没有正文的元素（如图片）被跳过。
+
+        每个文档块的元数据包括 source、seq_num（第一个元素的序号）、page_start、page_end（从0开始的页码，
+        与minerU的 page_idx 一致）、chunk_type（text 或 table）以及所属的章节路径 section（有标题时）。
+        """
+        chunks = []
+        headings = []  # [(标题层级, 标题文字)]，当前位置所属的各级标题
+        buffer = []    # 当前正在合并的元素
+
+        def flush():
+            if buffer:
+                chunks.extend(self._make_chunks(buffer, source, headings, "text"))
+                buffer.clear()
+
+        for element in elements:
+            content = element.content.strip() if element.content else ""
+            if not content:
+                continue
+            # 只有标题的文档块留给后面的正文，连续的多级标题也合并在一起
+            has_body = any(not e.is_heading for e in buffer)
+
+            if element.is_heading:
+                # 缓冲区中的标题即将被同级或更高级的新标题替换时，它们不在新章节的路径中，先单独输出
+                if has_body or (buffer and headings[-1][0] >= element.text_level):
+                    flush()
+                while headings and headings[-1][0] >= element.text_level:
+                    headings.pop()
+                headings.append((element.text_level, content))
+                buffer.append(element)
+            elif element.is_table:
+                if has_body:
+                    flush()
+                chunks.extend(self._make_chunks([element], source, headings, "table"))
+            else:
+                if has_body and self._length(buffer) + len(ELEMENT_SEPARATOR) + len(content) > self.chunk_size:
+                    flush()
+                buffer.append(element)
+        flush()
+        return chunks
+
+    @staticmethod
+    def _length(elements: list) -> int:
+        return sum(len(e.content.strip()) for e in elements) + len(ELEMENT_SEPARATOR) * (len(elements) - 1)
+
+    def _make_chunks(self, elements: list, source: str, headings: list, chunk_type: str) -> list[Document]:
+        pages = [e.page_idx for e in elements if e.page_idx is not None]
+        metadata = {"source": source, "seq_num": elements[0].seq_num, "chunk_type": chunk_type}
+        if pages:
+            metadata.update(page_start=min(pages), page_end=max(pages))
+        if headings:
+            metadata["section"] = SECTION_SEPARATOR.join(text for _, text in headings)
+
+        text = ELEMENT_SEPARATOR.join(e.content.strip() for e in elements)
+        if chunk_type == "table":
+            pieces = self._split_table(text)
+        # 合并后的正文只有在单个段落本身过长时才会超过 chunk_size，此时按字符切开
+        elif len(text) <= self.chunk_size:
+            pieces = [text]
+        else:
+            pieces = self.text_splitter.split_text(text)
+        return [Document(page_content=piece, metadata=dict(metadata)) for piece in pieces]
+
+    def _split_table(self, table: str) -> list[str]:
+        """
+        将超过 max_table_size 的HTML表格按行 (<tr>) 切分。每个片段都以原表格第一行之前的内容加表头行开头、
+        以最后一行之后的内容（如 </table>）结尾，因此仍是完整的表格。
+        不是HTML表格，或加上表头后单行仍然过长时，按字符切分。
+        """
+        if self.max_table_size <= 0 or len(table) <= self.max_table_size:
+            return [table]
+        rows = list(_TABLE_ROW_PATTERN.finditer(table))
+        if len(rows) < 2:
+            return self.table_splitter.split_text(table)
+
+        head, tail = table[:rows[1].start()], table[rows[-1].end():]
+        # 每个数据行连同其后、下一行之前的内容（如 </tbody>）一起移动
+        body = [table[row.start():next_row.start()] for row, next_row in zip(rows[1:], rows[2:])]
+        body.append(table[rows[-1].start():rows[-1].end()])
+
+        pieces, current = [], []
+        for row in body:
+            if current and len(head) + sum(map(len, current)) + len(row) + len(tail) > self.max_table_size:
+                pieces.append(head + "".join(current) + tail)
+                current = []
+            current.append(row)
+        pieces.append(head + "".join(current) + tail)
+        return [part for piece in pieces
+                for part in ([piece] if len(piece) <= self.max_table_size else self.table_splitter.split_text(piece))]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+@file: versioned_dir.py
+@desc: 派生索引（NumPy向量索引、BM25词法索引）的目录版本管理。
+       每次写入都在索引目录下新建一个版本子目录，写完后以 os.replace 原子地替换 CURRENT 指针文件，
+       读取方总是通过指针找到一个完整的版本：不会看到写了一半的索引，也不会遇到目录被删除后、
+       新目录尚未就位的空窗；写入过程中进程崩溃时，指针仍指向旧版本。
+       切换后保留上一个版本（切换前已解析到它的读取方仍可完成加载），更早的版本被清理。
+"""
+import os
+import time
+import shutil
+
+CURRENT_FILENAME = "CURRENT"
+
+
+def current_dir(base_dir: str) -> str:
+    """
+    返回索引当前版本所在的目录。
+
+    :param base_dir: 索引目录。
+    :return: CURRENT 指向的版本目录；没有指针时（引入版本管理之前写入的索引）返回 base_dir 本身。
+    """
+    try:
+        with open(os.path.join(base_dir, CURRENT_FILENAME), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return base_dir
+    return os.path.join(base_dir, name)
+
+
+def new_version_dir(base_dir: str) -> str:
+    """在 base_dir 下创建一个空的版本目录，写入完成后调用 publish 使其生效。"""
+    os.makedirs(base_dir, exist_ok=True)
+    while True:
+        path = os.path.join(base_dir, f"v{time.time_ns()}")
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            continue
+
+
+def publish(base_dir: str, version_dir: str):
+    """
+    原子地将 CURRENT 指向 version_dir，然后清理更早的版本。
+
+    :param base_dir: 索引目录。
+    :param version_dir: 由 new_version_dir 创建、已写入完整索引的版本目录。
+    """
+    previous = current_dir(base_dir)
+    pointer_path = os.path.join(base_dir, CURRENT_FILENAME)
+    with open(pointer_path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(version_dir))
+    os.replace(pointer_path + ".tmp", pointer_path)
+    _remove_old_versions(base_dir, keep={os.path.basename(version_dir), os.path.basename(previous)},
+                         keep_files=previous == base_dir)
+
+
+def _remove_old_versions(base_dir: str, keep: set[str], keep_files: bool):
+    """
+    删除 keep 之外的版本目录（包括写入中途崩溃留下的未生效版本）与旧布局直接存放在 base_dir 下的索引文件。
+    上一个版本就是旧布局时（keep_files），这些文件留到下一次切换时再删除。
+    文件仍被占用（如Windows上仍有进程映射）时跳过，下一次切换时再尝试。
+    """
+    for name in os.listdir(base_dir):
+        if name in keep or name == CURRENT_FILENAME:
+            continue
+        path = os.path.join(base_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif not keep_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -5,21 +5,46 @@
 @file: main.py
 @desc: RAG应用的主入口，使用FastAPI提供Web服务
 """
-from fastapi import FastAPI
+import json
+from fastapi import FastAPI, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 import uvicorn
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, Optional, Union
 from contextlib import asynccontextmanager
 
 # 导入我们的核心服务
 from core.qa_service import QAService
+from core.metrics import track_request, render_metrics
+from core.http_transport import close_sessions
+from config import BATCH_ASK_MAX_QUERIES
 
 # --- 数据模型定义 ---
+class SearchFilters(BaseModel):
+    """检索过滤条件，只在匹配的研报分区内检索。每个字段可为单个取值或取值列表（列表内为"或"），字段之间为"且"。"""
+    model_config = ConfigDict(extra="forbid")
+
+    report: Optional[Union[str, List[str]]] = None           # 研报文件名（不含扩展名）
+    broker: Optional[Union[str, List[str]]] = None           # 券商，如 "光大证券"
+    report_year: Optional[Union[int, List[int]]] = None      # 报告年份，如 2025
+    report_period: Optional[Union[str, List[str]]] = None    # 报告期，如 "2025Q1"、"2024H1"、"2024FY"
+    chunk_type: Optional[Union[str, List[str]]] = None       # 文档块类型："text" 或 "table"
+
+    def to_dict(self) -> Dict[str, Any] | None:
+        return self.model_dump(exclude_none=True) or None
+
 class AskRequest(BaseModel):
     query: str
     top_k: int = 20
     rerank_top_n: int = 5
+    filters: Optional[SearchFilters] = None
+
+class AskBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 20
+    rerank_top_n: int = 5
+    filters: Optional[SearchFilters] = None
 
 # --- 应用生命周期管理 ---
 @asynccontextmanager
@@ -32,6 +57,8 @@ async def lifespan(app: FastAPI):
     yield
     
     # 应用关闭时执行 (如果需要)
+    app.state.qa_service.llm.close()
+    close_sessions()
     print("应用关闭。")
 
 
@@ -50,6 +77,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 允许前端读取各阶段的耗时
+    expose_headers=["Server-Timing"],
 )
 
 # --- API路由定义 ---
@@ -58,19 +87,95 @@ async def root():
     return {"message": "欢迎使用RAG企业知识库问答API！服务运行正常。"}
 
 @app.post("/api/ask", summary="执行完整的RAG问答流程")
-async def ask_question(request: AskRequest):
+async def ask_question(request: AskRequest, response: Response):
     """
     接收用户问题，执行完整的检索、重排和生成流程，返回结构化的答案。
+    各阶段的耗时通过 Server-Timing 响应头返回。
     """
     qa_service: QAService = app.state.qa_service
-    # 注意：我们将在这里直接调用一个非流式的ask方法
-    result = qa_service.ask(
-        query=request.query, 
-        top_k=request.top_k, 
-        rerank_top_n=request.rerank_top_n
-    )
+    # 使用异步版本的ask方法，检索与API调用不会阻塞事件循环，多个请求可以并发处理
+    with track_request("ask") as timings:
+        result = await qa_service.aask(
+            query=request.query, 
+            top_k=request.top_k, 
+            rerank_top_n=request.rerank_top_n,
+            filters=request.filters.to_dict() if request.filters else None
+        )
+    response.headers["Server-Timing"] = timings.server_timing()
     return result
 
+@app.post("/api/ask/batch", summary="一次回答多个问题")
+async def ask_questions_batch(request: AskBatchRequest, response: Response):
+    """
+    接收多个问题，共享Embedding与向量检索步骤后并发生成答案，按输入顺序返回答案列表。
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries 不能为空。")
+    if len(request.queries) > BATCH_ASK_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {BATCH_ASK_MAX_QUERIES} 个问题。")
+
+    qa_service: QAService = app.state.qa_service
+    with track_request("ask_batch") as timings:
+        results = await qa_service.aask_batch(
+            queries=request.queries,
+            top_k=request.top_k,
+            rerank_top_n=request.rerank_top_n,
+            filters=request.filters.to_dict() if request.filters else None
+        )
+    response.headers["Server-Timing"] = timings.server_timing()
+    return results
+
+def _format_sse(event: str, data) -> str:
+    """将一个事件编码为Server-Sent Events格式的文本。"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/ask/stream", summary="以SSE流式返回RAG问答结果")
+async def ask_question_stream(request: AskRequest):
+    """
+    与 /api/ask 执行相同的流程，但以Server-Sent Events的形式逐步返回：
+    先推送检索到的上下文 (context)，再推送生成的增量文本 (delta)，
+    每当一个JSON字段生成完整时推送该字段 (field)，最后推送完整答案 (done)。
+    """
+    qa_service: QAService = app.state.qa_service
+
+    async def event_stream():
+        # 响应头在第一个事件之前就已发送，流式接口的耗时只记录到 /metrics
+        with track_request("ask_stream"):
+            async for event in qa_service.aask_stream(
+                query=request.query,
+                top_k=request.top_k,
+                rerank_top_n=request.rerank_top_n,
+                filters=request.filters.to_dict() if request.filters else None
+            ):
+                yield _format_sse(event["event"], event["data"])
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 禁止代理缓存与缓冲，确保每个事件到达后立即发送给客户端
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/cache/stats", summary="查看问答缓存的命中率")
+async def cache_stats():
+    """返回问答缓存的条目数、精确/语义命中次数及命中率等统计信息。"""
+    qa_service: QAService = app.state.qa_service
+    if qa_service.answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **qa_service.answer_cache.get_stats()}
+
+@app.delete("/api/cache", summary="清空问答缓存")
+async def clear_cache():
+    qa_service: QAService = app.state.qa_service
+    if qa_service.answer_cache is not None:
+        qa_service.answer_cache.clear()
+    return {"message": "问答缓存已清空。"}
+
+@app.get("/metrics", summary="Prometheus格式的性能指标", response_class=PlainTextResponse)
+async def metrics():
+    """输出各阶段耗时直方图、请求总耗时、Token用量与缓存命中次数。"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- 启动服务 ---
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
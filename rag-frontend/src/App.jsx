@@ -1,21 +1,33 @@
 import { useState } from 'react'
-import axios from 'axios'
 import { App as AntApp, Input, Button, Card, Typography, Space, Spin, Alert, List, Collapse } from 'antd'
 import { RocketOutlined } from '@ant-design/icons'
 
 const { Title, Text, Paragraph } = Typography
 const { TextArea } = Input
 
-// 配置axios实例，设置后端的base URL
-const apiClient = axios.create({
-  baseURL: 'http://localhost:8000',
-})
+// 后端的base URL
+const API_BASE_URL = 'http://localhost:8000'
+
+// 解析一段完整的SSE事件文本，返回 { event, data }
+const parseSSEEvent = (block) => {
+  let event = 'message'
+  const dataLines = []
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim()
+    } else if (line.startsWith('data:')) {
+      dataLines.push(line.slice(5).trim())
+    }
+  }
+  return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : null }
+}
 
 function App() {
   // --- State Management ---
   const [query, setQuery] = useState('中芯国际的2024年主营业务是多少？')
   const [result, setResult] = useState(null)
   const [isLoading, setIsLoading] = useState(false)
+  const [isGenerating, setIsGenerating] = useState(false)
   const [error, setError] = useState('')
 
   // --- API Call Handler ---
@@ -25,17 +37,49 @@ function App() {
       return
     }
     setIsLoading(true)
+    setIsGenerating(true)
     setResult(null)
     setError('')
 
+    // 使用流式接口：先收到检索上下文，之后每个字段生成完毕就立即渲染
+    const handleEvent = ({ event, data }) => {
+      if (event === 'context') {
+        setResult({ raw_context: data })
+        setIsLoading(false)
+      } else if (event === 'field') {
+        setResult((prev) => ({ ...prev, [data.name]: data.value }))
+      } else if (event === 'done') {
+        setResult((prev) => ({ ...prev, ...data }))
+      }
+    }
+
     try {
-      const response = await apiClient.post('/api/ask', { query })
-      setResult(response.data)
+      const response = await fetch(`${API_BASE_URL}/api/ask/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query }),
+      })
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`)
+      }
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder('utf-8')
+      let buffer = ''
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const blocks = buffer.split('\n\n')
+        buffer = blocks.pop()
+        blocks.filter((block) => block.trim()).forEach((block) => handleEvent(parseSSEEvent(block)))
+      }
     } catch (err) {
       setError('请求失败，请检查后端服务是否正在运行或查看控制台日志。')
       console.error(err)
     } finally {
       setIsLoading(false)
+      setIsGenerating(false)
     }
   }
   
@@ -83,7 +127,7 @@ function App() {
           <Button
             type="default"
             onClick={handleGenerateAnswer}
-            loading={isLoading}
+            loading={isGenerating}
             style={{ width: '100%', height: '40px', marginTop: '10px', backgroundColor: '#f0f0f0' }}
           >
             生成答案
@@ -102,22 +146,28 @@ function App() {
             {result && (
               <Space direction="vertical" style={{ width: '100%' }}>
                 <Card title={<Title level={5} style={{fontSize: '14px'}}>检索结果</Title>} style={cardStyle} styles={{ body: { padding: '15px' } }}>
-                  {/* This card can be used for general search status if needed */}
-                </Card>
-                <Card title={<Title level={5} style={{fontSize: '14px'}}>分步推理:</Title>} style={{ ...cardStyle, backgroundColor: '#e6f7ff' }} styles={{ body: { padding: '15px' } }}>
-                  <List
-                    dataSource={result.reasoning_steps}
-                    renderItem={(item, index) => (
-                      <List.Item style={{padding: '0 0 10px 0', border: 'none'}}>
-                        <Text>{index + 1}. {item}</Text>
-                      </List.Item>
-                    )}
-                    split={false}
-                  />
-                </Card>
-                <Card title={<Title level={5} style={{fontSize: '14px'}}>推理摘要:</Title>} style={{ ...cardStyle, backgroundColor: '#e6ffe6' }} styles={{ body: { padding: '15px' } }}>
-                  <Paragraph style={{margin: 0}}>{result.reasoning_summary}</Paragraph>
+                  <Text>已检索到 {result.raw_context?.length ?? 0} 个相关文档。</Text>
+                  {isGenerating && <Spin size="small" style={{ marginLeft: '10px' }} />}
+                  {isGenerating && <Text type="secondary" style={{ marginLeft: '8px' }}>正在生成答案...</Text>}
                 </Card>
+                {result.reasoning_steps && (
+                  <Card title={<Title level={5} style={{fontSize: '14px'}}>分步推理:</Title>} style={{ ...cardStyle, backgroundColor: '#e6f7ff' }} styles={{ body: { padding: '15px' } }}>
+                    <List
+                      dataSource={result.reasoning_steps}
+                      renderItem={(item, index) => (
+                        <List.Item style={{padding: '0 0 10px 0', border: 'none'}}>
+                          <Text>{index + 1}. {item}</Text>
+                        </List.Item>
+                      )}
+                      split={false}
+                    />
+                  </Card>
+                )}
+                {result.reasoning_summary && (
+                  <Card title={<Title level={5} style={{fontSize: '14px'}}>推理摘要:</Title>} style={{ ...cardStyle, backgroundColor: '#e6ffe6' }} styles={{ body: { padding: '15px' } }}>
+                    <Paragraph style={{margin: 0}}>{result.reasoning_summary}</Paragraph>
+                  </Card>
+                )}
                 <Card title={<Title level={5} style={{fontSize: '14px'}}>相关页面:</Title>} style={cardStyle} styles={{ body: { padding: '15px' } }}>
                   <Collapse ghost>
                     <Collapse.Panel header="点击查看/折叠详细上下文" key="1">
@@ -127,9 +177,11 @@ function App() {
                     </Collapse.Panel>
                   </Collapse>
                 </Card>
-                <Card title={<Title level={5} style={{fontSize: '14px'}}>最终答案:</Title>} style={{ ...cardStyle, backgroundColor: '#f0f0f0' }} styles={{ body: { padding: '10px 20px 15px' } }}>
-                  <Paragraph style={{margin: 0, fontWeight: 'bold', fontSize: '16px'}}>{result.final_answer}</Paragraph>
-                </Card>
+                {result.final_answer && (
+                  <Card title={<Title level={5} style={{fontSize: '14px'}}>最终答案:</Title>} style={{ ...cardStyle, backgroundColor: '#f0f0f0' }} styles={{ body: { padding: '10px 20px 15px' } }}>
+                    <Paragraph style={{margin: 0, fontWeight: 'bold', fontSize: '16px'}}>{result.final_answer}</Paragraph>
+                  </Card>
+                )}
               </Space>
             )}
           </Spin>
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+@file: conftest.py
+@desc: pytest 公共配置，将项目根目录添加到 sys.path，使测试可以导入 core 与 main。
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
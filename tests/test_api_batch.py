@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+@file: test_api_batch.py
+@desc: /api/ask/batch 接口：批量计算查询向量失败时，所有问题返回"检索服务暂时不可用"的兜底答案，而不是500。
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from core.llm_service import QwenLLM
+from core.qa_service import QAService
+from core.partitions import PartitionIndex
+from core.knowledge_base_manager import QwenTongyiEmbeddings
+
+
+class FailingKnowledgeBaseManager:
+    """只提供 QAService 需要的接口；Embedding API 始终失败，向量库不应被访问。"""
+    def __init__(self, llm: QwenLLM):
+        self.embedding_function = QwenTongyiEmbeddings(llm)
+        self.embedding_function.scheduler.embed = self._fail
+        self.db = object()
+        self.build_stamp_path = None
+
+    @staticmethod
+    def _fail(texts: list[str]) -> list[list[float]]:
+        raise RuntimeError("模拟的Embedding API故障")
+
+    def load_search_backend(self):
+        return self.db
+
+    def load_lexical_index(self):
+        return None
+
+    def load_partition_index(self):
+        return PartitionIndex.from_metadatas([])
+
+
+@pytest.fixture
+def client():
+    llm = QwenLLM(api_key="mock-api-key", max_concurrency=4)
+    main.app.state.qa_service = QAService(llm=llm, kb_manager=FailingKnowledgeBaseManager(llm))
+    # 不进入应用的 lifespan，使用上面注入的问答服务
+    yield TestClient(main.app)
+    llm.close()
+
+
+def test_ask_batch_returns_unavailable_answers_when_embedding_fails(client):
+    response = client.post("/api/ask/batch", json={"queries": ["问题一", "问题二", "问题一 "]})
+
+    assert response.status_code == 200
+    answers = response.json()
+    assert len(answers) == 3
+    assert all(answer == QAService._retrieval_unavailable_answer() for answer in answers)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+@file: test_batch_runner.py
+@desc: BatchRunner 的检查点行为：兜底答案视为失败，不写入检查点，再次运行时重试。
+"""
+import json
+
+from core.batch_runner import BatchRunner
+from core.qa_service import QAService
+
+
+class FakeQAService:
+    """按预设的答案序列依次返回，记录被调用的问题。"""
+    is_fallback_answer = staticmethod(QAService.is_fallback_answer)
+
+    def __init__(self, answers: list[dict]):
+        self.answers = list(answers)
+        self.calls = []
+
+    async def aask(self, query: str, top_k: int = 20, rerank_top_n: int = 5) -> dict:
+        self.calls.append(query)
+        return self.answers.pop(0)
+
+
+def _answer(text: str) -> dict:
+    return {"reasoning_steps": [], "reasoning_summary": "", "relevant_context": "",
+            "final_answer": text, "raw_context": []}
+
+
+def _read_checkpoint(path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_retrieval_unavailable_answer_is_not_checkpointed(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    qa_service = FakeQAService([QAService._retrieval_unavailable_answer()])
+
+    results = BatchRunner(qa_service, str(checkpoint), concurrency=1).run(["问题一"])
+
+    assert results == [None]
+    assert _read_checkpoint(checkpoint) == []
+
+
+def test_fallback_answer_is_retried_on_next_run(tmp_path):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    parse_error = _answer("抱歉，处理您的请求时发生错误。")
+    assert QAService.is_fallback_answer(parse_error)
+
+    first = FakeQAService([_answer("答案一"), parse_error])
+    assert BatchRunner(first, str(checkpoint), concurrency=1).run(["问题一", "问题二"]) == [_answer("答案一"), None]
+    assert [r["question"] for r in _read_checkpoint(checkpoint)] == ["问题一"]
+
+    second = FakeQAService([_answer("答案二")])
+    results = BatchRunner(second, str(checkpoint), concurrency=1).run(["问题一", "问题二"])
+
+    assert second.calls == ["问题二"]
+    assert results == [_answer("答案一"), _answer("答案二")]
+    assert [r["question"] for r in _read_checkpoint(checkpoint)] == ["问题一", "问题二"]
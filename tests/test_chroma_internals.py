@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+@file: test_chroma_internals.py
+@desc: KnowledgeBaseManager._close_chroma 依赖 chromadb 中 SharedSystemClient 的私有属性。
+       升级 chromadb 后这些属性消失或含义改变时，此测试会直接失败，而不是在重新加载向量库时静默出错。
+"""
+import chromadb
+from chromadb.api.client import SharedSystemClient
+
+from core.knowledge_base_manager import KnowledgeBaseManager
+
+
+def test_shared_system_client_internals_exist():
+    assert hasattr(SharedSystemClient, "_refcount_lock")
+    assert isinstance(SharedSystemClient._identifier_to_system, dict)
+    assert isinstance(SharedSystemClient._identifier_to_refcount, dict)
+
+
+def test_close_chroma_releases_only_the_given_directory(tmp_path):
+    first_dir, second_dir = str(tmp_path / "first"), str(tmp_path / "second")
+    first = chromadb.PersistentClient(path=first_dir)
+    second = chromadb.PersistentClient(path=second_dir)
+    first.get_or_create_collection("reports").add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["a"])
+    second.get_or_create_collection("reports")
+    # Chroma 以目录路径作为进程内共享系统的键
+    assert first_dir in SharedSystemClient._identifier_to_system
+    assert second_dir in SharedSystemClient._identifier_to_system
+
+    KnowledgeBaseManager._close_chroma(first_dir)
+
+    assert first_dir not in SharedSystemClient._identifier_to_system
+    assert first_dir not in SharedSystemClient._identifier_to_refcount
+    assert second_dir in SharedSystemClient._identifier_to_system
+    # 重新打开时读取的是磁盘上的数据库，而不是已停止的旧系统
+    reopened = chromadb.PersistentClient(path=first_dir)
+    assert reopened.get_collection("reports").count() == 1
+    KnowledgeBaseManager._close_chroma(first_dir)
+    KnowledgeBaseManager._close_chroma(second_dir)
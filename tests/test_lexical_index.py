@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+@file: test_lexical_index.py
+@desc: BM25词法索引的版本化写入：增量更新读取的是当前版本，切换后旧版本仍可供已加载的读取方使用。
+"""
+import os
+
+from core.lexical_index import LexicalIndex
+from core.versioned_dir import current_dir
+
+
+class FakeChroma:
+    """只提供 LexicalIndex.update 需要的 get 接口。"""
+    def __init__(self, documents: dict[str, str]):
+        self.documents = documents
+
+    def get(self, ids: list[str], include: list[str] = None) -> dict:
+        return {"ids": ids, "documents": [self.documents[i] for i in ids],
+                "metadatas": [{"source": f"{i}.json"} for i in ids]}
+
+
+def test_update_publishes_a_new_version(tmp_path):
+    index_dir = str(tmp_path / "lexical_index")
+    LexicalIndex.build(index_dir, ["a", "b"], ["中芯国际 营收", "毛利率 提升"], [{}, {}])
+    first_version = current_dir(index_dir)
+    old_index = LexicalIndex(index_dir)
+
+    removed, added = LexicalIndex.update(index_dir, FakeChroma({"c": "产能利用率 回升"}), ["a", "c"])
+
+    assert (removed, added) == (1, 1)
+    assert current_dir(index_dir) != first_version
+    index = LexicalIndex(index_dir)
+    assert index.ids == ["a", "c"]
+    assert [chunk_id for chunk_id, _ in index.search("产能利用率")] == ["c"]
+    # 切换前加载的索引不受影响，上一个版本的文件仍然保留
+    assert [chunk_id for chunk_id, _ in old_index.search("毛利率")] == ["b"]
+    assert os.path.exists(os.path.join(first_version, LexicalIndex.META_FILENAME))
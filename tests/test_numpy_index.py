@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+@file: test_numpy_index.py
+@desc: NumPy向量索引的版本化写入：替换索引时读取方始终能看到一个完整的版本。
+"""
+import os
+import json
+
+import numpy as np
+
+from core.numpy_index import NumpyVectorIndex, _IndexWriter
+from core.versioned_dir import CURRENT_FILENAME, current_dir
+
+
+def _build(index_dir: str, ids: list[str]):
+    vectors = np.eye(4, dtype=np.float32)[:len(ids)]
+    NumpyVectorIndex.build(index_dir, ids, [f"文本 {i}" for i in ids], [{"source": f"{i}.json"} for i in ids], vectors)
+
+
+def _versions(index_dir: str) -> list[str]:
+    return sorted(name for name in os.listdir(index_dir) if os.path.isdir(os.path.join(index_dir, name)))
+
+
+def test_rebuild_switches_versions_and_keeps_the_previous_one(tmp_path):
+    index_dir = str(tmp_path / "numpy_index")
+    _build(index_dir, ["a", "b"])
+    first_version = current_dir(index_dir)
+    old_index = NumpyVectorIndex(index_dir)
+
+    _build(index_dir, ["c"])
+
+    assert current_dir(index_dir) != first_version
+    assert NumpyVectorIndex(index_dir).ids == ["c"]
+    # 切换前加载的索引仍可检索，上一个版本保留给尚未完成加载的读取方
+    assert old_index.similarity_search_by_vector_with_relevance_scores([1.0, 0, 0, 0], k=1)[0][0].page_content == "文本 a"
+    assert os.path.basename(first_version) in _versions(index_dir)
+
+    del old_index
+    _build(index_dir, ["d"])
+    assert len(_versions(index_dir)) == 2
+    assert os.path.basename(first_version) not in _versions(index_dir)
+
+
+def test_unfinished_write_leaves_the_current_version_readable(tmp_path):
+    index_dir = str(tmp_path / "numpy_index")
+    _build(index_dir, ["a"])
+
+    # 模拟写入中途进程崩溃：版本目录已创建，但从未切换
+    writer = _IndexWriter(index_dir, 1, 4, "float32")
+    writer.write(["b"], ["文本 b"], [{}], np.eye(4, dtype=np.float32)[:1])
+
+    assert NumpyVectorIndex(index_dir).ids == ["a"]
+    _build(index_dir, ["c"])
+    assert os.path.basename(writer.version_dir) not in _versions(index_dir)
+
+
+def test_legacy_layout_is_loaded_and_replaced(tmp_path):
+    index_dir = tmp_path / "numpy_index"
+    index_dir.mkdir()
+    np.save(index_dir / NumpyVectorIndex.EMBEDDINGS_FILENAME, np.eye(4, dtype=np.float32)[:1])
+    (index_dir / NumpyVectorIndex.DOCUMENTS_FILENAME).write_text(
+        json.dumps({"id": "a", "page_content": "文本 a", "metadata": {}}, ensure_ascii=False) + "\n", encoding="utf-8")
+    (index_dir / NumpyVectorIndex.META_FILENAME).write_text(json.dumps({"count": 1, "dim": 4, "dtype": "float32"}),
+                                                            encoding="utf-8")
+    assert NumpyVectorIndex(str(index_dir)).ids == ["a"]
+
+    _build(str(index_dir), ["b"])
+    assert NumpyVectorIndex(str(index_dir)).ids == ["b"]
+    # 旧布局的文件作为上一个版本保留一次，下一次切换时删除
+    assert (index_dir / NumpyVectorIndex.META_FILENAME).exists()
+    _build(str(index_dir), ["c"])
+    assert sorted(p.name for p in index_dir.iterdir() if p.is_file()) == [CURRENT_FILENAME]